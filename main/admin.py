@@ -1,7 +1,11 @@
-from django.contrib import admin
-from .models import ArtPiece, SentArtPiece, CustomUser, Comment, Like, Notification
+from django.contrib import admin, messages
+from django.shortcuts import render
+from .models import ArtPiece, SentArtPiece, CustomUser, Comment, Like, Notification, DistributionRun, DistributionRunEntry, EmailOutbox, NotificationDelivery
 from django.http import HttpResponse
 import csv
+from .forms import ShareWithUsersForm
+from .services.selection import invalidate_welcome_pool
+from .services.sharing import share_piece_with_users
 
 
 @admin.action(description="Export emails (CSV)")
@@ -38,20 +42,46 @@ class ArtPieceAdmin(admin.ModelAdmin):
     )
 
     actions = ["mark_as_welcome_eligible",
-               "unmark_as_welcome_eligible", "export_emails_csv"]
+               "unmark_as_welcome_eligible", "share_with_users", "export_emails_csv"]
 
     def mark_as_welcome_eligible(self, request, queryset):
         updated = queryset.update(welcome_eligible=True)
+        invalidate_welcome_pool()
         self.message_user(
             request, f"{updated} piece(s) marked as welcome-eligible.")
     mark_as_welcome_eligible.short_description = "Mark selected as welcome-eligible"
 
     def unmark_as_welcome_eligible(self, request, queryset):
         updated = queryset.update(welcome_eligible=False)
+        invalidate_welcome_pool()
         self.message_user(
             request, f"{updated} piece(s) unmarked as welcome-eligible.")
     unmark_as_welcome_eligible.short_description = "Unmark selected as welcome-eligible"
 
+    def share_with_users(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(
+                request, "Select exactly one piece to share.", level=messages.ERROR)
+            return None
+        art = queryset.select_related("user").get()
+
+        form = ShareWithUsersForm(request.POST if "apply" in request.POST else None)
+        if not form.is_valid():
+            return render(request, "admin/main/artpiece/share_with_users.html", {
+                **self.admin_site.each_context(request),
+                "title": "Share a piece with users",
+                "art_piece": art,
+                "form": form,
+            })
+
+        counts = share_piece_with_users(art, form.users())
+        self.message_user(
+            request,
+            f"Shared \"{art.piece_name}\" with {counts['sent']} user(s); "
+            f"{counts['skipped']} already had it.")
+        return None
+    share_with_users.short_description = "Share selected piece with users…"
+
 
 class CustomUserAdmin(admin.ModelAdmin):
     list_filter = ("date_joined", "last_login", "is_active", "is_staff")
@@ -108,9 +138,40 @@ class NotificationAdmin(admin.ModelAdmin):
                     "art_piece", "is_read", "timestamp", "message")
 
 
+class DistributionRunAdmin(admin.ModelAdmin):
+    list_filter = ("status", "started_at")
+    list_display = ("run_id", "status", "started_at", "finished_at", "users_processed",
+                    "sent_count", "skipped_count", "failed_count", "users_per_second")
+    readonly_fields = ("run_id", "started_at")
+
+
+class DistributionRunEntryAdmin(admin.ModelAdmin):
+    list_filter = ("outcome", "email_sent")
+    list_display = ("run", "user", "art_piece",
+                    "outcome", "email_sent", "created_at")
+    raw_id_fields = ("run", "user", "art_piece", "notification")
+
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_filter = ("state", "kind", "priority", "created_at")
+    list_display = ("notification", "kind", "priority", "state", "attempts",
+                    "available_at", "sent_at", "created_at", "last_error")
+    raw_id_fields = ("notification",)
+
+
+class NotificationDeliveryAdmin(admin.ModelAdmin):
+    list_filter = ("channel", "delivered_at")
+    list_display = ("notification", "channel", "delivered_at")
+    raw_id_fields = ("notification",)
+
+
 admin.site.register(ArtPiece, ArtPieceAdmin)
 admin.site.register(SentArtPiece, SentArtPieceAdmin)
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Like, LikeAdmin)
 admin.site.register(Notification, NotificationAdmin)
+admin.site.register(DistributionRun, DistributionRunAdmin)
+admin.site.register(DistributionRunEntry, DistributionRunEntryAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
+admin.site.register(NotificationDelivery, NotificationDeliveryAdmin)
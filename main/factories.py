@@ -0,0 +1,44 @@
+# main/factories.py
+"""
+factory_boy factories for synthetic users, art and delivery history.
+Used by the benchmarks (bench_weekly) and handy in tests; build_batch()
++ bulk_create is the fast path for large datasets.
+"""
+import factory
+from factory.django import DjangoModelFactory
+
+from main.models import ArtPiece, CustomUser, SentArtPiece
+
+
+class UserFactory(DjangoModelFactory):
+    class Meta:
+        model = CustomUser
+
+    username = factory.Sequence(lambda n: f"synthetic-{n}")
+    email = factory.Sequence(lambda n: f"synthetic-{n}@example.com")
+    first_name = factory.Faker("first_name")
+    last_name = factory.Faker("last_name")
+    timezone = factory.Faker("timezone")
+    # Unusable password: hashing a real one costs ~100 ms per user
+    password = "!"
+
+
+class ArtPieceFactory(DjangoModelFactory):
+    class Meta:
+        model = ArtPiece
+
+    user = factory.SubFactory(UserFactory)
+    artist_name = factory.Faker("name")
+    piece_name = factory.Faker("sentence", nb_words=3)
+    piece_description = factory.Faker("paragraph", nb_sentences=2)
+    link = factory.Faker("url")
+    approved_status = True
+
+
+class SentArtPieceFactory(DjangoModelFactory):
+    class Meta:
+        model = SentArtPiece
+
+    user = factory.SubFactory(UserFactory)
+    art_piece = factory.SubFactory(ArtPieceFactory)
+    source = "weekly"
@@ -1,6 +1,9 @@
 from django import forms
-from django.contrib.auth.forms import UserCreationForm, PasswordChangeForm, AuthenticationForm, SetPasswordForm
+from django.contrib.auth.forms import UserCreationForm, PasswordChangeForm, AuthenticationForm, SetPasswordForm, PasswordResetForm
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
 from .models import ArtPiece, CustomUser, Comment
+from .services.outbox import queue_message
 from django.core.exceptions import ValidationError
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field, HTML, Submit, Div
@@ -161,11 +164,12 @@ class ArtDeliveryForm(forms.ModelForm):
 class EmailPreferencesForm(forms.ModelForm):
     class Meta:
         model = CustomUser
-        fields = ['email_on_art_shared', 'email_on_comment', 'email_on_like']
+        fields = ['email_on_art_shared', 'email_on_comment', 'email_on_like', 'email_digest']
         labels = {
             'email_on_art_shared': 'Email me when someone shares art with me',
             'email_on_comment': 'Email me when someone comments on my art',
             'email_on_like': 'Email me when someone likes my art',
+            'email_digest': 'Send comment and like emails',
         }
 
 
@@ -176,6 +180,28 @@ class CustomPasswordChangeForm(PasswordChangeForm):
             self.fields['old_password'].widget.attrs.pop('autofocus', None)
 
 
+class CustomPasswordResetForm(PasswordResetForm):
+    """
+    Queues the reset email on the outbox instead of sending it inside the
+    request; `queued` holds the rows so the view can start a dispatch.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queued = []
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        subject = render_to_string(subject_template_name, context)
+        # Email subject *must not* contain newlines
+        subject = ''.join(subject.splitlines())
+        body = render_to_string(email_template_name, context)
+        self.queued.append(queue_message(
+            kind="password_reset", to=[to_email], subject=subject,
+            body=strip_tags(body), html=body, from_email=from_email,
+        ))
+
+
 class CustomSetPasswordForm(SetPasswordForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -226,3 +252,34 @@ class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
         fields = ['text']
+
+
+class ShareWithUsersForm(forms.Form):
+    """Audience for the ArtPiece admin's "share with users" action."""
+    AUDIENCE_CHOICES = [
+        ("all", "All users receiving art"),
+        ("joined", "Users who joined in a date range"),
+    ]
+
+    audience = forms.ChoiceField(choices=AUDIENCE_CHOICES, initial="all")
+    joined_after = forms.DateField(required=False, help_text="Inclusive, YYYY-MM-DD.")
+    joined_before = forms.DateField(required=False, help_text="Inclusive, YYYY-MM-DD.")
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get("audience") == "joined":
+            after, before = cleaned.get("joined_after"), cleaned.get("joined_before")
+            if not after and not before:
+                raise ValidationError("Give at least one of joined after / joined before.")
+            if after and before and after > before:
+                raise ValidationError("Joined after must not be later than joined before.")
+        return cleaned
+
+    def users(self):
+        users = CustomUser.objects.filter(is_active=True, receive_art_paused=False)
+        if self.cleaned_data["audience"] == "joined":
+            if self.cleaned_data.get("joined_after"):
+                users = users.filter(date_joined__date__gte=self.cleaned_data["joined_after"])
+            if self.cleaned_data.get("joined_before"):
+                users = users.filter(date_joined__date__lte=self.cleaned_data["joined_before"])
+        return users
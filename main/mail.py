@@ -1,39 +1,60 @@
+import logging
+import re
+import secrets
+from functools import lru_cache
+from time import monotonic
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.template.loader import get_template
 from django.template import TemplateDoesNotExist
+from django.utils.html import conditional_escape
+from main.services.metrics import phase
+from main.services.rate_limit import RateLimited, send_rate_limiter
 
+logger = logging.getLogger(__name__)
 
-def send_templated_email(
+
+@lru_cache(maxsize=None)
+def _compiled(template_name):
+    """Parsed template, loaded once per process; None if it doesn't exist."""
+    try:
+        return get_template(template_name)
+    except TemplateDoesNotExist:
+        return None
+
+
+def render_email(template_base, context):
+    """
+    (text_body, html_body) for template_base; html_body is None when there's
+    no .html template or it renders blank.
+    """
+    text_template = _compiled(f"{template_base}.txt")
+    if text_template is None:
+        raise TemplateDoesNotExist(f"{template_base}.txt")
+    text_body = text_template.render(context)
+
+    html_template = _compiled(f"{template_base}.html")
+    html_body = html_template.render(context) if html_template else None
+    if html_body and not html_body.strip():
+        html_body = None
+    return text_body, html_body
+
+
+def build_email(
     to_user,
     subject,
-    template_base,
-    context,
+    text_body,
+    html_body=None,
     *,
     unsubscribe_url: str | None = None,
     reply_to: list[str] | None = None,
     bcc: list[str] | None = None,
-    fail_silently: bool = False,
     connection=None,
-):
-    """
-    template_base: e.g. 'emails/comment' -> expects:
-      templates/emails/comment.txt  (required)
-      templates/emails/comment.html (optional)
-    """
+) -> EmailMultiAlternatives:
     # allow passing either a user or an email string
     to_email = getattr(to_user, "email", None) or str(to_user)
 
-    ctx = {**context}
-    text_body = render_to_string(f"{template_base}.txt", ctx)
-
-    try:
-        html_body = render_to_string(f"{template_base}.html", ctx)
-        if html_body and not html_body.strip():
-            html_body = None
-    except TemplateDoesNotExist:
-        html_body = None
-
     headers = {}
     if unsubscribe_url:
         # Many providers recognize this and surface a native “Unsubscribe”
@@ -54,5 +75,217 @@ def send_templated_email(
     if html_body:
         # adds multipart/alternative
         msg.attach_alternative(html_body, "text/html")
+    return msg
+
+
+def send_templated_email(
+    to_user,
+    subject,
+    template_base,
+    context,
+    *,
+    unsubscribe_url: str | None = None,
+    reply_to: list[str] | None = None,
+    bcc: list[str] | None = None,
+    fail_silently: bool = False,
+    connection=None,
+):
+    """
+    template_base: e.g. 'emails/comment' -> expects:
+      templates/emails/comment.txt  (required)
+      templates/emails/comment.html (optional)
+    """
+    with phase("render"):
+        text_body, html_body = render_email(template_base, {**context})
+
+    msg = build_email(
+        to_user, subject, text_body, html_body,
+        unsubscribe_url=unsubscribe_url, reply_to=reply_to, bcc=bcc,
+        connection=connection,
+    )
+
+    with phase("send"):
+        msg.send(fail_silently=fail_silently)
+
+
+class _Placeholder:
+    """
+    Stands in for a per-recipient context value while a FanOutTemplate
+    renders: the value itself and any attribute of it render as markers.
+    """
+
+    def __init__(self, key, nonce):
+        self._key = key
+        self._nonce = nonce
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return _Placeholder(f"{self._key}.{attr}", self._nonce)
+
+    def __str__(self):
+        return f"@@fanout:{self._nonce}:{self._key}@@"
+
+
+class FanOutTemplate:
+    """
+    One email template rendered once for many recipients.
+
+    The context shared by every recipient (sender, piece, ...) is rendered
+    for real; the names in `per_recipient` render as markers that render()
+    swaps for each recipient's escaped values, so a send costs a string
+    substitution instead of two template renders. Per-recipient values may
+    only be printed ({{ recipient.first_name }}), not filtered or branched on.
+    """
+
+    def __init__(self, template_base, context, *,
+                 per_recipient=("recipient", "cta_url", "unsubscribe_url")):
+        nonce = secrets.token_hex(4)
+        self.per_recipient = tuple(per_recipient)
+        ctx = {**context, **{name: _Placeholder(name, nonce) for name in self.per_recipient}}
+        with phase("render"):
+            text, html = render_email(template_base, ctx)
+        # Split at the markers once: even items are literal text, odd items
+        # the per-recipient keys to fill in
+        marker = re.compile(rf"@@fanout:{nonce}:([\w.]+)@@")
+        self._text = marker.split(text)
+        self._html = marker.split(html) if html else None
+
+    def render(self, values: dict) -> tuple[str, str | None]:
+        """(text_body, html_body) for one recipient's per_recipient values."""
+        cache = {}
+
+        def fill(parts):
+            out = parts[:]
+            for i in range(1, len(out), 2):
+                key = out[i]
+                if key not in cache:
+                    name, *attrs = key.split(".")
+                    v = values[name]
+                    for attr in attrs:
+                        v = getattr(v, attr)
+                        if callable(v):
+                            v = v()
+                    cache[key] = conditional_escape(v)
+                out[i] = cache[key]
+            return "".join(out)
+
+        return fill(self._text), fill(self._html) if self._html else None
+
+
+class RateLimitedBackend(BaseEmailBackend):
+    """
+    EMAIL_BACKEND that makes every send, from any code path, wait for the
+    shared send-rate limiter (one token per recipient) before handing the
+    messages to the real backend, settings.EMAIL_RATE_LIMITED_BACKEND.
+    Raises RateLimited if the wait would exceed EMAIL_RATE_LIMIT_MAX_WAIT.
+    """
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.inner = get_connection(
+            getattr(settings, "EMAIL_RATE_LIMITED_BACKEND", None)
+            or "django.core.mail.backends.smtp.EmailBackend",
+            fail_silently=fail_silently, **kwargs)
+
+    def open(self):
+        return self.inner.open()
+
+    def close(self):
+        return self.inner.close()
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        send_rate_limiter().acquire(sum(len(m.recipients()) for m in email_messages))
+        return self.inner.send_messages(email_messages)
+
+
+class PooledConnection:
+    """
+    One email backend connection shared across many sends. Pass it as
+    `connection=` anywhere a Django connection is accepted.
+
+    The underlying SES/SMTP session is opened on the first send, recycled
+    after `max_messages` (settings.EMAIL_CONNECTION_MAX_MESSAGES), and on a
+    failed send is reopened and the send retried once before the error is
+    raised. stats() reports throughput and how much each connection was reused.
+    """
+
+    def __init__(self, *, max_messages=None, backend=None, **kwargs):
+        self.max_messages = max_messages or getattr(
+            settings, "EMAIL_CONNECTION_MAX_MESSAGES", 100)
+        self._backend = backend
+        self._kwargs = kwargs
+        self._conn = None
+        self._on_conn = 0
+        self._started = monotonic()
+        self.messages = 0
+        self.failures = 0
+        self.connections = 0
+        self.reconnects = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def open(self):
+        if self._conn is None:
+            self._conn = get_connection(self._backend, fail_silently=False, **self._kwargs)
+            self._conn.open()
+            self._on_conn = 0
+            self.connections += 1
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                logger.warning("mail_connection_close_failed", exc_info=True)
+            self._conn = None
+
+    def _reconnect(self):
+        self.close()
+        self.reconnects += 1
+        return self.open()
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        if self._on_conn >= self.max_messages:
+            self._reconnect()
+        conn = self.open()
+        try:
+            sent = conn.send_messages(email_messages)
+        except RateLimited:
+            # Not a connection problem; reconnecting wouldn't help
+            raise
+        except Exception:
+            self.failures += 1
+            logger.warning("mail_send_failed_reconnecting", exc_info=True)
+            try:
+                sent = self._reconnect().send_messages(email_messages)
+            except Exception:
+                self.failures += 1
+                self.close()
+                raise
+        sent = sent or 0
+        self._on_conn += sent
+        self.messages += sent
+        return sent
 
-    msg.send(fail_silently=fail_silently)
+    def stats(self) -> dict:
+        elapsed = monotonic() - self._started
+        return {
+            "messages": self.messages,
+            "failures": self.failures,
+            "connections": self.connections,
+            "reconnects": self.reconnects,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(self.messages / elapsed, 2) if elapsed else 0.0,
+            "messages_per_connection": round(self.messages / self.connections, 2) if self.connections else 0.0,
+        }
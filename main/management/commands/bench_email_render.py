@@ -0,0 +1,87 @@
+# main/management/commands/bench_email_render.py
+import json
+import re
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.factories import ArtPieceFactory, UserFactory
+from main.mail import build_email, render_email
+from main.notifications_email import SharedArtFanOut, shared_art_context
+
+UNSUB_TOKEN = re.compile(r"/u/[^/]+/")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark building shared-art emails for one piece going to many recipients: "
+        "a full template render per message vs. render-once (SharedArtFanOut). "
+        "Nothing is saved or sent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=10000,
+                            help='Recipients of the shared piece (default 10000).')
+        parser.add_argument('--json', metavar='PATH',
+                            help='Also write the results to this file as JSON.')
+
+    def handle(self, *args, **opts):
+        n = opts['recipients']
+        if n < 1:
+            raise CommandError("--recipients must be at least 1.")
+
+        # Unsaved objects with ids are all the email code reads
+        sender = UserFactory.build(id=1)
+        art = ArtPieceFactory.build(id=1, user=sender)
+        recipients = UserFactory.build_batch(n)
+        for i, u in enumerate(recipients, start=2):
+            u.id = i
+
+        def per_message():
+            for u in recipients:
+                subject, context = shared_art_context(
+                    recipient=u, sender=sender, art_piece=art, notification_id=u.id)
+                text, html = render_email("emails/shared_art", context)
+                yield build_email(u, subject, text, html)
+
+        def render_once():
+            fan_out = SharedArtFanOut(sender=sender, art_piece=art)
+            for u in recipients:
+                yield fan_out.message(u, notification_id=u.id)
+
+        # Unsubscribe tokens carry a timestamp, so compare with them masked
+        first = [next(build()) for build in (per_message, render_once)]
+        bodies = [
+            [UNSUB_TOKEN.sub("/u/-/", part) for part in (m.body, m.alternatives[0][0])]
+            for m in first
+        ]
+        if bodies[0] != bodies[1]:
+            raise CommandError("Render-once output differs from a full render.")
+
+        results = {}
+        for name, build in (("per_message", per_message), ("render_once", render_once)):
+            start = perf_counter()
+            for _ in build():
+                pass
+            seconds = perf_counter() - start
+            results[name] = {
+                "seconds": round(seconds, 3),
+                "messages_per_second": round(n / seconds, 1),
+            }
+        speedup = results["per_message"]["seconds"] / results["render_once"]["seconds"]
+
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:>12}: {r['messages_per_second']:.0f} msg/sec ({r['seconds']:.2f}s for {n})")
+        self.stdout.write(f"Speedup: {speedup:.1f}x")
+
+        if opts['json']:
+            with open(opts['json'], 'w') as fp:
+                json.dump({
+                    "created_at": timezone.now().isoformat(),
+                    "recipients": n,
+                    "results": results,
+                    "speedup": round(speedup, 2),
+                }, fp, indent=2)
+            self.stdout.write(f"Wrote {opts['json']}.")
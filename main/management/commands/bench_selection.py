@@ -0,0 +1,86 @@
+# main/management/commands/bench_selection.py
+import random
+import statistics
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.models import ArtPiece, CustomUser, SentArtPiece
+from main.services.received import rebuild_bitmaps
+from main.services.selection import (
+    eligible_art_pieces, sample_art_piece_id, sample_unreceived_id,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time choose_art_piece-style selection for one user with a large received "
+        "history: anti-join query vs. received bitmap. Builds a synthetic pool inside "
+        "a transaction that is always rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool', type=int, default=10000,
+                            help='Approved pieces in the synthetic pool (default 10000).')
+        parser.add_argument('--received', type=int, default=5000,
+                            help='How many of them the user has already received (default 5000).')
+        parser.add_argument('--samples', type=int, default=200,
+                            help='Selections timed per strategy (default 200).')
+
+    def handle(self, *args, **opts):
+        if settings.IS_PROD:
+            raise CommandError("Refusing to run a benchmark against production.")
+        if opts['received'] >= opts['pool']:
+            raise CommandError("--received must be smaller than --pool.")
+
+        with transaction.atomic():
+            user = self._build(opts['pool'], opts['received'])
+            results = {
+                "anti-join": self._time(
+                    lambda: sample_art_piece_id(eligible_art_pieces(user)), opts['samples']),
+                "bitmap": self._time(
+                    lambda: sample_unreceived_id(user), opts['samples']),
+            }
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"pool={opts['pool']} received={opts['received']} samples={opts['samples']}")
+        for name, timings in results.items():
+            ms = sorted(t * 1000 for t in timings)
+            self.stdout.write(
+                f"{name:>10}: p50 {statistics.median(ms):.2f} ms, "
+                f"p95 {ms[int(len(ms) * 0.95) - 1]:.2f} ms, max {ms[-1]:.2f} ms")
+
+    def _build(self, pool_size, received):
+        tag = random.randint(10**6, 10**7)
+        sharer = CustomUser.objects.create_user(
+            username=f"bench-sharer-{tag}", email=f"bench-sharer-{tag}@example.com", password=None,
+            first_name="Bench", last_name="Sharer")
+        user = CustomUser.objects.create_user(
+            username=f"bench-user-{tag}", email=f"bench-user-{tag}@example.com", password=None,
+            first_name="Bench", last_name="User")
+
+        pieces = ArtPiece.objects.bulk_create(
+            [ArtPiece(user=sharer, artist_name="Bench", piece_name=f"Bench {i}",
+                      piece_description="Synthetic piece.")
+             for i in range(pool_size)],
+            batch_size=1000,
+        )
+        SentArtPiece.objects.bulk_create(
+            [SentArtPiece(user=user, art_piece=p)
+             for p in random.sample(pieces, received)],
+            batch_size=1000,
+        )
+        rebuild_bitmaps([user.id])
+        return user
+
+    def _time(self, fn, samples):
+        fn()  # warm-up
+        timings = []
+        for _ in range(samples):
+            start = perf_counter()
+            fn()
+            timings.append(perf_counter() - start)
+        return timings
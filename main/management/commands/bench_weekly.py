@@ -0,0 +1,161 @@
+# main/management/commands/bench_weekly.py
+import json
+import os
+import random
+import resource
+from time import perf_counter
+
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from main.factories import ArtPieceFactory, UserFactory
+from main.models import (
+    ArtPiece, CustomUser, DistributionRun, DistributionRunEntry, Notification, SentArtPiece,
+)
+from main.services.received import rebuild_bitmaps
+
+
+# share_weekly_art arguments for each weekly path, real and dry-run
+PATHS = {
+    "per-user": (["--all"], ["--dry-run"]),
+    "bulk": (["--all", "--bulk"], ["--dry-run", "--bulk"]),
+    "assign": (["--all", "--assign"], ["--dry-run", "--assign"]),
+}
+COUNTED_MODELS = (SentArtPiece, Notification, DistributionRun, DistributionRunEntry)
+BATCH = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark share_weekly_art on a synthetic cohort (factory_boy/Faker) built "
+        "inside a transaction that is always rolled back. Reports wall time, queries "
+        "per user, peak RSS, rows written and emails, optionally as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000,
+                            help='Synthetic users (default 10000).')
+        parser.add_argument('--pieces', type=int, default=1000,
+                            help='Approved pieces, shared by a third of the users (default 1000).')
+        parser.add_argument('--history', type=int, default=20,
+                            help='Average pieces each user has already received (default 20).')
+        parser.add_argument('--path', choices=sorted(PATHS), default='per-user',
+                            help='Which weekly path to run (default per-user).')
+        parser.add_argument('--mode', choices=['dry-run', 'full', 'both'], default='both',
+                            help='Dry run, full run with locmem email, or both in that order.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the synthetic dataset (default 0).')
+        parser.add_argument('--json', metavar='PATH',
+                            help='Also write the results to this file as JSON.')
+
+    def handle(self, *args, **opts):
+        if settings.IS_PROD:
+            raise CommandError("Refusing to run a benchmark against production.")
+        if opts['history'] >= opts['pieces']:
+            raise CommandError("--history must be smaller than --pieces.")
+
+        modes = ['dry-run', 'full'] if opts['mode'] == 'both' else [opts['mode']]
+        with transaction.atomic():
+            start = perf_counter()
+            dataset = self._build(opts['users'], opts['pieces'], opts['history'], opts['seed'])
+            dataset['build_seconds'] = round(perf_counter() - start, 3)
+
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+                results = [self._run(opts['path'], mode, opts['users']) for mode in modes]
+            transaction.set_rollback(True)
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "params": {k: opts[k] for k in ('users', 'pieces', 'history', 'path', 'seed')},
+            "dataset": dataset,
+            "results": results,
+        }
+
+        self.stdout.write(
+            f"users={opts['users']} pieces={opts['pieces']} history={opts['history']} "
+            f"path={opts['path']} (dataset built in {dataset['build_seconds']:.1f}s)")
+        for r in results:
+            rows = ", ".join(f"{k}={v}" for k, v in r['rows_written'].items())
+            self.stdout.write(
+                f"{r['mode']:>8}: {r['wall_seconds']:.2f}s, {r['queries_per_user']:.2f} queries/user, "
+                f"peak RSS {r['peak_rss_mb']:.0f} MB, {r['emails']} email(s), rows: {rows}")
+
+        if opts['json']:
+            with open(opts['json'], 'w') as fp:
+                json.dump(report, fp, indent=2)
+            self.stdout.write(f"Wrote {opts['json']}.")
+
+    def _build(self, n_users, n_pieces, history, seed):
+        rng = random.Random(seed)
+        UserFactory.reset_sequence(rng.randrange(10**9))
+
+        # Only the synthetic cohort takes part; everyone else sits this one out
+        first_id = (CustomUser.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        CustomUser.objects.filter(id__lt=first_id).update(receive_art_paused=True)
+
+        for i in range(0, n_users, BATCH):
+            CustomUser.objects.bulk_create(UserFactory.build_batch(min(BATCH, n_users - i)))
+        user_ids = list(CustomUser.objects.filter(id__gte=first_id)
+                        .order_by('id').values_list('id', flat=True))
+
+        sharer_ids = user_ids[:max(1, n_users // 3)]
+        pieces = []
+        for i in range(0, n_pieces, BATCH):
+            batch = ArtPieceFactory.build_batch(min(BATCH, n_pieces - i), user=None)
+            for art in batch:
+                art.user_id = rng.choice(sharer_ids)
+            pieces += ArtPiece.objects.bulk_create(batch)
+        owners = {p.id: p.user_id for p in pieces}
+        piece_ids = list(owners)
+
+        # Received histories vary around the mean, like a real cohort of old and new users
+        sent_rows, pending = 0, []
+        for user_id in user_ids:
+            k = min(len(piece_ids) - 1, int(rng.expovariate(1 / history)) if history else 0)
+            pending += [
+                SentArtPiece(user_id=user_id, art_piece_id=piece_id, source='weekly')
+                for piece_id in rng.sample(piece_ids, k) if owners[piece_id] != user_id
+            ]
+            if len(pending) >= BATCH:
+                sent_rows += len(SentArtPiece.objects.bulk_create(pending))
+                pending = []
+        sent_rows += len(SentArtPiece.objects.bulk_create(pending))
+        rebuild_bitmaps(user_ids)
+
+        return {"users": len(user_ids), "pieces": len(pieces), "history_rows": sent_rows}
+
+    def _run(self, path, mode, n_users):
+        real_args, dry_args = PATHS[path]
+        args = dry_args if mode == 'dry-run' else real_args
+        before = {m.__name__: m.objects.count() for m in COUNTED_MODELS}
+        mail.outbox = []
+
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with open(os.devnull, 'w') as devnull, connection.execute_wrapper(count):
+            start = perf_counter()
+            call_command('share_weekly_art', *args, stdout=devnull)
+            wall = perf_counter() - start
+
+        rows = {m.__name__: m.objects.count() - before[m.__name__] for m in COUNTED_MODELS}
+        return {
+            "mode": mode,
+            "path": path,
+            "wall_seconds": round(wall, 3),
+            "queries": queries,
+            "queries_per_user": round(queries / n_users, 3) if n_users else 0.0,
+            # ru_maxrss is KiB on Linux; it's the process high-water mark so far
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "rows_written": rows,
+            "emails": len(mail.outbox),
+        }
@@ -0,0 +1,51 @@
+# main/management/commands/build_art_recommendations.py
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from main.services.recommend import (
+    DEFAULT_CHUNK_SIZE, TOP_K, TOP_NEIGHBORS, build_recommendations, refresh_recommendations,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild item-item neighbors from Like data and every user's ranked candidate "
+        "list, or with --incremental rescore only users whose likes changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only rescore stale/new users against the stored neighbors.',
+        )
+        parser.add_argument(
+            '--include-comments',
+            action='store_true',
+            default=None,
+            help='Count commenting on a piece as an interaction, like a Like.',
+        )
+        parser.add_argument('--top-k', type=int, default=TOP_K,
+                            help=f'Candidates kept per user (default {TOP_K}).')
+        parser.add_argument('--neighbors', type=int, default=TOP_NEIGHBORS,
+                            help=f'Neighbors kept per piece on a full build (default {TOP_NEIGHBORS}).')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help=f'Users scored per batch (default {DEFAULT_CHUNK_SIZE}).')
+
+    def handle(self, *args, **opts):
+        start = perf_counter()
+        if opts['incremental']:
+            written = refresh_recommendations(
+                include_comments=opts['include_comments'],
+                top_k=opts['top_k'],
+                chunk_size=opts['chunk_size'],
+            )
+        else:
+            written = build_recommendations(
+                include_comments=opts['include_comments'],
+                top_k=opts['top_k'],
+                top_neighbors=opts['neighbors'],
+                chunk_size=opts['chunk_size'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} candidate list(s) in {perf_counter() - start:.1f}s."))
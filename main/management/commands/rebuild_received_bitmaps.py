@@ -0,0 +1,47 @@
+# main/management/commands/rebuild_received_bitmaps.py
+from django.core.management.base import BaseCommand
+from main.services.received import check_bitmaps, rebuild_bitmaps
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or, with --check, verify) per-user received-art bitmaps from SentArtPiece."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            nargs='+',
+            type=int,
+            help='Only these user IDs (space-separated). Default: everyone.',
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Report users whose stored bitmap disagrees with SentArtPiece; write nothing.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Users per query batch (default 500).',
+        )
+
+    def handle(self, *args, **opts):
+        ids = opts.get('ids')
+        chunk_size = opts['chunk_size']
+
+        if opts['check']:
+            bad = 0
+            for user_id, missing, extra in check_bitmaps(ids, chunk_size=chunk_size):
+                bad += 1
+                self.stdout.write(
+                    f"[DRIFT] user {user_id}: missing {missing[:10]}{'…' if len(missing) > 10 else ''}, "
+                    f"extra {extra[:10]}{'…' if len(extra) > 10 else ''}")
+            if bad:
+                self.stdout.write(self.style.ERROR(
+                    f"{bad} user(s) out of sync. Run without --check to rebuild."))
+            else:
+                self.stdout.write(self.style.SUCCESS("All bitmaps match SentArtPiece."))
+            return
+
+        written = rebuild_bitmaps(ids, chunk_size=chunk_size)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} bitmap(s)."))
@@ -1,7 +1,17 @@
 # main/management/commands/share_weekly_art.py
+import json
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
-from main.models import CustomUser
-from main.services.sharing import share_weekly_to_user  # your new service
+from django.utils import timezone
+from main.mail import PooledConnection
+from main.models import CustomUser, DistributionRun
+from main.services.distribution import start_run, run_weekly_distribution
+from main.services.assignment import assign_weekly
+from main.services.metrics import RunMetrics
+from main.services.plans import write_plan, apply_plan
+from main.tasks import dispatch_weekly_fan_out, enqueue_notification_emails
+from main.services.sharing import share_weekly_to_user, share_weekly_bulk, weekly_shards, DEFAULT_CHUNK_SIZE
 
 
 class Command(BaseCommand):
@@ -34,13 +44,146 @@ class Command(BaseCommand):
             action='store_true',
             help='Confirm sending to everyone that matches filters (guard for non-dry runs).',
         )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Plan and write a chunk of users at a time with set-based queries.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Users per chunk in --bulk mode (default {DEFAULT_CHUNK_SIZE}).',
+        )
+        parser.add_argument(
+            '--assign',
+            action='store_true',
+            help='Solve the whole cohort at once (NumPy) with optional per-piece/per-sharer caps.',
+        )
+        parser.add_argument(
+            '--max-per-piece',
+            type=int,
+            help='In --assign mode, deliver any one piece to at most this many users.',
+        )
+        parser.add_argument(
+            '--max-per-sharer',
+            type=int,
+            help="In --assign mode, deliver at most this many of one sharer's pieces.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Seed for --assign or --plan, for a reproducible result.',
+        )
+        parser.add_argument(
+            '--plan',
+            metavar='PATH',
+            help='Write every decision to a JSON Lines plan file (with its seed) instead of sharing.',
+        )
+        parser.add_argument(
+            '--apply',
+            metavar='PATH',
+            help=('Perform the decisions in a plan file written by --plan. The plan is the '
+                  'target list, so this skips the --all guard and ignores --emails/--ids/--limit.'),
+        )
+        parser.add_argument(
+            '--offset',
+            type=int,
+            default=0,
+            help='With --apply, skip this many decisions (to resume, or to split work).',
+        )
+        parser.add_argument(
+            '--count',
+            type=int,
+            help='With --apply, perform at most this many decisions.',
+        )
+        parser.add_argument(
+            '--fan-out',
+            action='store_true',
+            help='Split the cohort into id-range shards and run one Celery task per shard.',
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            help='Users per shard in --fan-out mode (default settings.WEEKLY_SHARD_SIZE).',
+        )
+        parser.add_argument(
+            '--wait',
+            action='store_true',
+            help='In --fan-out mode, block until every shard finishes and print the totals.',
+        )
+        parser.add_argument(
+            '--queue-email',
+            action='store_true',
+            help='In --bulk/--assign mode, queue emails as batched Celery tasks instead of sending inline.',
+        )
+        parser.add_argument(
+            '--metrics',
+            metavar='PATH',
+            help='Also write the per-phase timing summary (always logged) to this JSON file.',
+        )
+        parser.add_argument(
+            '--resume',
+            metavar='RUN_ID',
+            help=('Continue a crashed run from its checkpoint, with its original targeting. '
+                  'Users whose share failed are retried, even once the run finished.'),
+        )
 
     def handle(self, *args, **opts):
+        metrics = RunMetrics()
+        try:
+            # One mail session for the whole send instead of one per email
+            with metrics.active(), PooledConnection() as connection:
+                self.connection = connection
+                return self._handle(opts)
+        except Exception as exc:
+            metrics.failures[type(exc).__name__] += 1
+            raise
+        finally:
+            self._summarize(metrics, opts.get('metrics'))
+
+    def _summarize(self, metrics, path):
+        summary = metrics.emit(path)
+        phases = ", ".join(
+            f"{name} p50 {p['p50_ms']:.1f}/p95 {p['p95_ms']:.1f}/p99 {p['p99_ms']:.1f} ms"
+            for name, p in summary['phases'].items())
+        self.stdout.write(
+            f"Timing: {phases or 'no phases recorded'}; {summary['queries']} queries"
+            + (f"; failures {summary['failures']}" if summary['failures'] else "")
+            + (f". Summary written to {path}." if path else "."))
+
+    def _handle(self, opts):
         dry_run = opts['dry_run']
         emails = opts.get('emails') or []
         ids = opts.get('ids') or []
         limit = opts.get('limit')
         all_flag = opts.get('all', False)
+        bulk = opts.get('bulk', False)
+        chunk_size = opts.get('chunk_size') or DEFAULT_CHUNK_SIZE
+        enqueue = enqueue_notification_emails if opts.get('queue_email') else None
+
+        if enqueue and not (bulk or opts.get('assign')):
+            self.stderr.write(self.style.ERROR(
+                "--queue-email only applies to --bulk and --assign."))
+            return
+
+        # The plan file is the target list, so the --all guard doesn't apply
+        if opts.get('apply'):
+            return self._apply(opts['apply'], opts, chunk_size)
+
+        run = None
+        if opts.get('resume'):
+            try:
+                run = DistributionRun.objects.get(run_id=opts['resume'])
+            except (DistributionRun.DoesNotExist, ValidationError):
+                self.stderr.write(self.style.ERROR(
+                    f"No distribution run {opts['resume']}."))
+                return
+            # The original run already passed the safety guard
+            emails = run.filters.get('emails') or []
+            ids = run.filters.get('ids') or []
+            limit = run.filters.get('limit')
+            dry_run, bulk, all_flag = False, False, True
 
         # Base: respect receive_art_paused=False
         qs = CustomUser.objects.filter(receive_art_paused=False)
@@ -50,6 +193,10 @@ class Command(BaseCommand):
         if ids:
             qs = qs.filter(id__in=ids)
 
+        # Planning writes nothing but the file
+        if opts.get('plan'):
+            dry_run = True
+
         # Safety guard: in non-dry runs, require either a target list or --all
         if not dry_run and not emails and not ids and not all_flag:
             self.stderr.write(
@@ -60,17 +207,74 @@ class Command(BaseCommand):
             )
             return
 
+        qs = qs.order_by('id')
+        if opts.get('fan_out'):
+            return self._fan_out(qs, opts)
+
+        if opts.get('plan'):
+            if limit:
+                qs = qs[:limit]
+            return self._plan(opts['plan'], qs, opts.get('seed'), chunk_size)
+
+        if opts.get('assign'):
+            if limit:
+                qs = qs[:limit]
+            self.stdout.write(
+                f"Solving assignment for {qs.count()} user(s). Dry run: {dry_run}")
+            return self._report(assign_weekly(
+                qs,
+                dry_run=dry_run,
+                max_per_piece=opts.get('max_per_piece'),
+                max_per_sharer=opts.get('max_per_sharer'),
+                seed=opts.get('seed'),
+                chunk_size=chunk_size,
+                connection=self.connection,
+                enqueue=enqueue,
+            ), dry_run=dry_run)
+
+        # Plain real runs are ledgered so a crash can be resumed (--resume)
+        # without re-selecting or re-emailing anyone.
+        if not dry_run and not bulk:
+            if run is None:
+                run = start_run(
+                    filters={'emails': emails, 'ids': ids, 'limit': limit})
+                self.stdout.write(f"Started run {run.run_id}.")
+            else:
+                self.stdout.write(
+                    f"Resuming run {run.run_id} after user {run.last_user_id}.")
+            return self._report(
+                run_weekly_distribution(run, qs, limit=limit, connection=self.connection),
+                dry_run=False, run=run)
+
         if limit:
-            qs = qs.order_by('id')[:limit]
+            qs = qs[:limit]
 
-        users = list(qs)
-        self.stdout.write(
-            f"Processing {len(users)} user(s). Dry run: {dry_run}")
+        if bulk:
+            # Stream users so memory stays flat regardless of cohort size
+            self.stdout.write(
+                f"Processing {qs.count()} user(s) in chunks of {chunk_size}. Dry run: {dry_run}")
+            results = share_weekly_bulk(
+                qs.iterator(chunk_size=chunk_size),
+                dry_run=dry_run,
+                chunk_size=chunk_size,
+                connection=self.connection,
+                enqueue=enqueue,
+            )
+        else:
+            users = list(qs)
+            self.stdout.write(
+                f"Processing {len(users)} user(s). Dry run: {dry_run}")
+            results = (
+                # returns ArtPiece | None
+                (u, share_weekly_to_user(user=u, dry_run=dry_run, connection=self.connection))
+                for u in users
+            )
+
+        self._report(results, dry_run=dry_run)
 
+    def _report(self, results, *, dry_run, run=None):
         sent = 0
-        for u in users:
-            piece = share_weekly_to_user(
-                user=u, dry_run=dry_run)  # returns ArtPiece | None
+        for u, piece in results:
             if dry_run:
                 if piece:
                     self.stdout.write(
@@ -93,3 +297,85 @@ class Command(BaseCommand):
         else:
             self.stdout.write(self.style.SUCCESS(
                 f"Shared art with {sent} user(s)."))
+
+        stats = self.connection.stats()
+        if stats['messages'] or stats['failures']:
+            self.stdout.write(
+                f"Mail: {stats['messages']} message(s) over {stats['connections']} connection(s) "
+                f"({stats['messages_per_connection']:.1f} per connection, {stats['reconnects']} reconnect(s), "
+                f"{stats['failures']} failure(s)), {stats['messages_per_second']:.1f} msg/sec.")
+
+        if run is not None:
+            run.refresh_from_db()
+            self.stdout.write(
+                f"Run {run.run_id}: {run.users_processed} user(s), "
+                f"{run.failed_count} failed, {run.users_per_second or 0:.1f} users/sec.")
+
+    def _plan(self, path, qs, seed, chunk_size):
+        total = with_art = 0
+        with open(path, 'w') as fp:
+            for _, piece in write_plan(qs, fp, seed=seed, chunk_size=chunk_size):
+                total += 1
+                with_art += piece is not None
+        with open(path) as fp:
+            seed = json.loads(fp.readline())['seed']
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {total} decision(s), {with_art} with art, to {path} (seed {seed}). "
+            f"Nothing was shared yet; run --apply {path} to send."))
+
+    def _apply(self, path, opts, chunk_size):
+        offset = opts.get('offset') or 0
+        last_line = None
+        with open(path) as fp:
+            try:
+                rows = apply_plan(fp, offset=offset, count=opts.get('count'),
+                                  chunk_size=chunk_size, connection=self.connection)
+
+                def results():
+                    nonlocal last_line
+                    for line_no, u, piece in rows:
+                        last_line = line_no
+                        yield u, piece
+
+                self._report(results(), dry_run=False)
+            except ValueError as e:
+                self.stderr.write(self.style.ERROR(str(e)))
+                return
+        if last_line is not None:
+            # Decision lines start at line 2, so line N is decision N - 1
+            self.stdout.write(
+                f"Applied through line {last_line}. To continue: --apply {path} --offset {last_line - 1}")
+
+    def _fan_out(self, qs, opts):
+        # Shard tasks re-select their users by id range, so they can only
+        # reproduce the full non-paused cohort.
+        if opts.get('emails') or opts.get('ids') or opts.get('limit'):
+            self.stderr.write(self.style.ERROR(
+                "--fan-out shards the whole cohort; it can't be combined with --emails/--ids/--limit."))
+            return
+
+        shard_size = opts.get('shard_size') or settings.WEEKLY_SHARD_SIZE
+        dry_run = opts['dry_run']
+
+        shards = weekly_shards(qs, shard_size=shard_size)
+        if not shards:
+            self.stdout.write("No users to process.")
+            return
+
+        result = dispatch_weekly_fan_out(
+            shards,
+            since=timezone.now(),
+            dry_run=dry_run,
+        )
+        self.stdout.write(
+            f"Dispatched {len(shards)} shard(s) of up to {shard_size} user(s) "
+            f"to the weekly queue. Dry run: {dry_run}. Run id: {result.id}")
+
+        if opts.get('wait'):
+            totals = result.get(disable_sync_subtasks=False)
+            self.stdout.write(self.style.SUCCESS(
+                f"Sent {totals['sent']}, skipped {totals['skipped']}, failed {totals['failed']} "
+                f"across {totals['shards']} shard(s)."))
+            if totals['failed_shards']:
+                self.stdout.write(self.style.WARNING(
+                    f"{totals['failed_shards']} shard(s) stopped early; see weekly_shard_failed in the worker log."))
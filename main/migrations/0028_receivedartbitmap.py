@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_distributionrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivedArtBitmap',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='received_bitmap', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('bits', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0028_receivedartbitmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='next_delivery_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
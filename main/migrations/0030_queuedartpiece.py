@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0029_customuser_next_delivery_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedArtPiece',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('general', 'General'), ('welcome', 'Welcome')], default='general', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('art_piece', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.artpiece')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queued_art', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='queuedartpiece',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'art_piece'), name='uniq_queued_art_user_kind_piece'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0030_queuedartpiece'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtCandidateList',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='art_candidates', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('piece_ids', models.BinaryField(default=b'')),
+                ('scores', models.BinaryField(default=b'')),
+                ('stale', models.BooleanField(db_index=True, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArtPieceNeighbors',
+            fields=[
+                ('art_piece', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbors', serialize=False, to='main.artpiece')),
+                ('neighbor_ids', models.BinaryField(default=b'')),
+                ('scores', models.BinaryField(default=b'')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
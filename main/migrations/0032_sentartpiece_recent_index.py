@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0031_art_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sentartpiece',
+            index=models.Index(fields=['user', '-sent_time'], name='idx_sentart_user_recent'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0033_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='email_digest',
+            field=models.CharField(choices=[('instant', 'As they happen'), ('hourly', 'Hourly digest'), ('daily', 'Daily digest')], default='instant', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='emailoutbox',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('digest', 'Held for digest'), ('sent', 'Sent'), ('skipped', 'Skipped'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0035_notification_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='kind',
+            field=models.CharField(choices=[('notification', 'Notification'), ('password_reset', 'Password reset'), ('feedback', 'Feedback report')], default='notification', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='message',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=5),
+        ),
+        migrations.AlterField(
+            model_name='emailoutbox',
+            name='notification',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='main.notification'),
+        ),
+    ]
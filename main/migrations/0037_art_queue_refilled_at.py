@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0036_outbox_transactional_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='art_queue_refilled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0037_art_queue_refilled_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distributionrunentry',
+            name='email_skipped',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -23,12 +23,31 @@ class CustomUser(AbstractUser):
     email_on_comment = models.BooleanField(default=True)
     email_on_like = models.BooleanField(default=False)
 
+    # Like/comment emails one by one, or collected into a periodic digest
+    # (see main/services/digest.py)
+    DIGEST_CHOICES = [
+        ("instant", "As they happen"),
+        ("hourly", "Hourly digest"),
+        ("daily", "Daily digest"),
+    ]
+    email_digest = models.CharField(
+        max_length=10, choices=DIGEST_CHOICES, default="instant")
+
     # User can pause actually receiving new art (in-app + email)
     receive_art_paused = models.BooleanField(default=False)
 
     # So you don't have to query SentArtPiece each time
     last_art_sent_at = models.DateTimeField(null=True, blank=True)
 
+    # When the delivery scheduler should next send this user art (UTC);
+    # see main/services/scheduling.py
+    next_delivery_at = models.DateTimeField(
+        null=True, blank=True, db_index=True)
+
+    # Last time the background sweep topped up this user's gift queue, so
+    # users whose pool can't fill it don't starve everyone behind them
+    art_queue_refilled_at = models.DateTimeField(null=True, blank=True)
+
     # Store IANA tz name, e.g. "America/New_York"
     timezone = models.CharField(
         max_length=64, null=True, blank=True)
@@ -178,6 +197,11 @@ class SentArtPiece(models.Model):
 
     class Meta:
         unique_together = ('user', 'art_piece')
+        indexes = [
+            # "last N deliveries" lookups for sharer-diverse selection
+            models.Index(fields=['user', '-sent_time'],
+                         name='idx_sentart_user_recent'),
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.art_piece}'
@@ -188,6 +212,91 @@ class SentArtPiece(models.Model):
     art_piece_submitter.short_description = 'Submitted By'
 
 
+class ReceivedArtBitmap(models.Model):
+    """
+    Bitset of every ArtPiece id a user has been sent (bit N <=> piece id N),
+    kept in step with SentArtPiece so eligibility checks don't have to read
+    the user's whole SentArtPiece history. See main/services/received.py.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="received_bitmap",
+    )
+    bits = models.BinaryField(default=b"")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id}: {len(self.bits)} bytes'
+
+
+class ArtPieceNeighbors(models.Model):
+    """
+    A piece's most similar pieces by who liked both (item-item cosine),
+    best first, as packed arrays: neighbor_ids int32, scores float32.
+    Written by the recommendation build; see main/services/recommend.py.
+    """
+    art_piece = models.OneToOneField(
+        ArtPiece,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="neighbors",
+    )
+    neighbor_ids = models.BinaryField(default=b"")
+    scores = models.BinaryField(default=b"")
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ArtCandidateList(models.Model):
+    """
+    A user's top-ranked unsent pieces from their likes, best first, packed
+    like ArtPieceNeighbors. `stale` is set when the user's likes change, so
+    incremental refreshes only rescore those users.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="art_candidates",
+    )
+    piece_ids = models.BinaryField(default=b"")
+    scores = models.BinaryField(default=b"")
+    stale = models.BooleanField(default=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class QueuedArtPiece(models.Model):
+    """
+    A piece drawn ahead of time for a user's next reciprocal ("general") or
+    welcome gift, so the request path can pop one instead of running
+    selection. Entries are revalidated when popped; see
+    main/services/art_queue.py.
+    """
+    KIND_CHOICES = [
+        ("general", "General"),
+        ("welcome", "Welcome"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE, related_name="queued_art")
+    art_piece = models.ForeignKey(ArtPiece, on_delete=models.CASCADE)
+    kind = models.CharField(
+        max_length=20, choices=KIND_CHOICES, default="general")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'kind', 'art_piece'],
+                name='uniq_queued_art_user_kind_piece',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} <- {self.art_piece} ({self.kind})'
+
+
 class ReciprocalGrant(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
@@ -344,6 +453,89 @@ class Notification(models.Model):
         return f'{self.sender} -> {self.recipient} ({self.notification_type})'
 
 
+class EmailOutbox(models.Model):
+    """
+    One email waiting to go out, written in the same transaction as what
+    triggered it so it can't be lost between commit and enqueue: a
+    notification's email, or a transactional message from a view (password
+    reset, feedback) carried in `message`. services.outbox.dispatch_outbox
+    claims due rows in batches, lowest priority number first; while a row
+    is "sending", available_at is its lease expiry, after which another
+    dispatcher may claim it again (at-least-once delivery).
+    """
+    PRIORITY_HIGH = 0    # someone is waiting for it, e.g. a password reset
+    PRIORITY_NORMAL = 5
+    PRIORITY_LOW = 9
+
+    KIND_CHOICES = [
+        ("notification", "Notification"),
+        ("password_reset", "Password reset"),
+        ("feedback", "Feedback report"),
+    ]
+
+    STATE_CHOICES = [
+        ("pending", "Pending"),
+        ("sending", "Sending"),
+        ("digest", "Held for digest"),
+        ("sent", "Sent"),
+        ("skipped", "Skipped"),  # recipient opted out of this kind of email
+        ("failed", "Failed"),
+    ]
+
+    notification = models.ForeignKey(
+        Notification, null=True, blank=True, on_delete=models.CASCADE, related_name="outbox")
+    kind = models.CharField(
+        max_length=20, choices=KIND_CHOICES, default="notification")
+    # to, subject, body, html, from_email of a non-notification email; only
+    # to and subject are kept once it's sent
+    message = models.JSONField(null=True, blank=True)
+    priority = models.PositiveSmallIntegerField(default=PRIORITY_NORMAL)
+    state = models.CharField(
+        max_length=20, choices=STATE_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(
+            fields=["state", "available_at"], name="idx_outbox_due")]
+
+    def __str__(self):
+        if self.notification_id:
+            return f'{self.notification_id} ({self.state})'
+        return f'{self.kind} ({self.state})'
+
+
+class NotificationDelivery(models.Model):
+    """
+    A notification's email went out on this channel. Written right after
+    the provider accepts the message and checked before every send, so a
+    retried task, a duplicate enqueue or a resumed run doesn't send it twice.
+    """
+    CHANNEL_CHOICES = [
+        ("email", "Email"),
+        ("digest", "Digest"),
+    ]
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="deliveries")
+    channel = models.CharField(max_length=20, choices=CHANNEL_CHOICES)
+    delivered_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['notification', 'channel'],
+                name='uniq_delivery_notification_channel',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.notification_id} via {self.channel}'
+
+
 class Feedback(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
@@ -355,3 +547,73 @@ class Feedback(models.Model):
 
     class Meta:
         indexes = [models.Index(fields=["created_at"])]
+
+
+class DistributionRun(models.Model):
+    """
+    Ledger for one share_weekly_art run, so a crashed run can pick up where
+    it stopped instead of walking (and emailing) the cohort again.
+    """
+    STATUS_CHOICES = [
+        ("running", "Running"),
+        ("finished", "Finished"),
+    ]
+
+    run_id = models.UUIDField(
+        default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default="running")
+    # Targeting options the run was started with; resume reuses them
+    filters = models.JSONField(default=dict, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    # Checkpoint: every user with id <= this has been handled
+    last_user_id = models.BigIntegerField(null=True, blank=True)
+    users_processed = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+
+    # Time spent actually processing, summed across resumes
+    elapsed_seconds = models.FloatField(default=0)
+    users_per_second = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["started_at"])]
+
+    def __str__(self):
+        return f'{self.run_id} ({self.status})'
+
+
+class DistributionRunEntry(models.Model):
+    """
+    Per-user outcome within a DistributionRun.
+    Written in the same transaction as the SentArtPiece/Notification rows;
+    email_sent flips only after the mail backend accepted the message;
+    email_skipped marks recipients who opted out, so resumes pass them by.
+    """
+    OUTCOME_CHOICES = [
+        ("sent", "Sent"),
+        ("skipped", "Skipped"),
+        ("failed", "Failed"),
+    ]
+
+    run = models.ForeignKey(
+        DistributionRun, on_delete=models.CASCADE, related_name="entries")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    art_piece = models.ForeignKey(
+        ArtPiece, on_delete=models.SET_NULL, null=True, blank=True)
+    notification = models.ForeignKey(
+        Notification, on_delete=models.SET_NULL, null=True, blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    email_sent = models.BooleanField(default=False)
+    email_skipped = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('run', 'user')
+
+    def __str__(self):
+        return f'{self.run_id}: {self.user} ({self.outcome})'
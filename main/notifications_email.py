@@ -1,8 +1,15 @@
+import logging
+from functools import wraps
 from django.conf import settings
 from django.urls import reverse
 from main.utils.email_unsub import make_unsub_token
-from .mail import send_templated_email
+from .mail import FanOutTemplate, build_email, send_templated_email
+from .models import Notification
 from urllib.parse import urlencode
+from main.services.delivery import delivered, record_delivery
+from main.services.metrics import phase
+
+logger = logging.getLogger(__name__)
 
 
 def _abs_url(base, path):
@@ -10,9 +17,29 @@ def _abs_url(base, path):
     return base.rstrip("/") + path
 
 
-def send_comment_email(*, recipient, comment, notification_id=None):
+def _once_per_notification(send):
+    """
+    Guard a send function against sending a notification's email twice:
+    skip it if the delivery log already has it, log it once it went out.
+    Returns True for an already-delivered notification, so callers treat
+    it as sent. Sends without a notification_id aren't tracked.
+    """
+    @wraps(send)
+    def guarded(*args, notification_id=None, **kwargs):
+        if notification_id and delivered([notification_id], channel="email"):
+            logger.info("email_already_delivered", extra={"notification_id": notification_id})
+            return True
+        sent = send(*args, notification_id=notification_id, **kwargs)
+        if sent and notification_id:
+            record_delivery([notification_id], channel="email")
+        return sent
+    return guarded
+
+
+@_once_per_notification
+def send_comment_email(*, recipient, comment, notification_id=None, connection=None):
     if not getattr(recipient, "email_on_comment", False):
-        return
+        return False
 
     token = make_unsub_token(recipient.id, "comment")
     unsubscribe_url = _abs_url(settings.SITE_URL,
@@ -49,19 +76,23 @@ def send_comment_email(*, recipient, comment, notification_id=None):
         "unsubscribe_url": unsubscribe_url,
         "body_text": body_text,
     }
-    send_templated_email(recipient, subject, "emails/comment", context)
+    send_templated_email(recipient, subject, "emails/comment", context,
+                         connection=connection)
+    return True
 
 
-def send_like_email(*, recipient, liker, art_piece, notification_id=None):
+@_once_per_notification
+def send_like_email(*, recipient, liker, art_piece, notification_id=None, connection=None):
     """
     Email the owner of an art piece when someone likes it.
     recipient: the owner (art_piece.user)
     liker: the user who clicked like
     art_piece: ArtPiece instance
     notification_id: optional int, used to mark-as-read on click
+    Returns True if an email went out, False if the recipient opted out.
     """
     if not getattr(recipient, "email_on_like", False):
-        return
+        return False
 
     # Unsubscribe link
     token = make_unsub_token(recipient.id, "like")
@@ -83,19 +114,13 @@ def send_like_email(*, recipient, liker, art_piece, notification_id=None):
     }
 
     subject = f"{liker.get_full_name()} loved a piece you shared!"
-    send_templated_email(recipient, subject, "emails/like", context)
+    send_templated_email(recipient, subject, "emails/like", context,
+                         connection=connection)
+    return True
 
 
-def send_shared_art_email(*, recipient, sender, art_piece, notification_id=None, connection=None):
-    """
-    Email a user when they receive a piece of art.
-    recipient: user who received the art (SentArtPiece.user)
-    sender:    user who shared the art (art_piece.user)
-    """
-    # Respect user preference
-    if not getattr(recipient, "email_on_art_shared", False):
-        return
-
+def shared_art_context(*, recipient, sender, art_piece, notification_id=None):
+    """(subject, template context) for one shared-art email."""
     # Unsubscribe for this category
     # kinds: "comment", "like", "art"
     token = make_unsub_token(recipient.id, "art")
@@ -121,7 +146,108 @@ def send_shared_art_email(*, recipient, sender, art_piece, notification_id=None,
         "unsubscribe_url": unsubscribe_url,
     }
 
-    subject = f"{sender.get_full_name()} shared some art with you!"
     subject = f"You have new art from {sender.get_full_name()}!"
+    return subject, context
+
+
+@_once_per_notification
+def send_shared_art_email(*, recipient, sender, art_piece, notification_id=None, connection=None):
+    """
+    Email a user when they receive a piece of art.
+    recipient: user who received the art (SentArtPiece.user)
+    sender:    user who shared the art (art_piece.user)
+    Returns True if an email went out, False if the recipient opted out.
+    """
+    # Respect user preference
+    if not getattr(recipient, "email_on_art_shared", False):
+        return False
+
+    subject, context = shared_art_context(
+        recipient=recipient, sender=sender, art_piece=art_piece,
+        notification_id=notification_id)
     send_templated_email(recipient, subject,
                          "emails/shared_art", context, connection=connection)
+    return True
+
+
+class SharedArtFanOut:
+    """
+    send_shared_art_email for many recipients of one piece: the URLs are
+    reversed and both templates rendered once, and each recipient costs
+    only a token signature and a placeholder substitution. Produces the
+    same message as send_shared_art_email.
+    """
+
+    def __init__(self, *, sender, art_piece):
+        self.subject = f"You have new art from {sender.get_full_name()}!"
+        self.art_url = _abs_url(
+            settings.SITE_URL, reverse("art_detail", args=[art_piece.public_id]))
+        self.unsub_url = _abs_url(
+            settings.SITE_URL, reverse("email_unsubscribe", args=["TOKEN"]))
+        self.template = FanOutTemplate("emails/shared_art", {
+            "sender": sender,
+            "art_piece": art_piece,
+            "share_url": _abs_url(settings.SITE_URL, reverse("share_art")),
+        })
+
+    def message(self, recipient, *, notification_id=None, connection=None):
+        """The EmailMultiAlternatives for one recipient, or None on opt-out."""
+        if not getattr(recipient, "email_on_art_shared", False):
+            return None
+        params = {"focus": "piece"}
+        if notification_id:
+            params["n"] = str(notification_id)
+        unsubscribe_url = self.unsub_url.replace(
+            "TOKEN", make_unsub_token(recipient.id, "art"))
+        text, html = self.template.render({
+            "recipient": recipient,
+            "cta_url": f"{self.art_url}?{urlencode(params)}",
+            "unsubscribe_url": unsubscribe_url,
+        })
+        return build_email(recipient, self.subject, text, html, connection=connection)
+
+    @_once_per_notification
+    def send(self, recipient, *, notification_id=None, connection=None):
+        msg = self.message(recipient, notification_id=notification_id, connection=connection)
+        if msg is None:
+            return False
+        with phase("send"):
+            msg.send()
+        return True
+
+
+def shared_art_fan_out(fan_outs, *, sender, art_piece):
+    """The SharedArtFanOut for art_piece from the fan_outs dict, made on first use."""
+    if art_piece.id not in fan_outs:
+        fan_outs[art_piece.id] = SharedArtFanOut(sender=sender, art_piece=art_piece)
+    return fan_outs[art_piece.id]
+
+
+def load_notifications(notification_ids, *, notification_type=None):
+    """
+    Notifications with everything their email needs (recipient, sender,
+    piece, comment) in one query, in id order.
+    """
+    qs = Notification.objects.filter(id__in=notification_ids).select_related(
+        "recipient", "sender", "art_piece", "comment__sender", "comment__art_piece",
+    ).order_by("id")
+    if notification_type:
+        qs = qs.filter(notification_type=notification_type)
+    return list(qs)
+
+
+def send_notification_email(n, *, connection=None, fan_outs=None):
+    """
+    The email for one Notification, whatever its type; pass one loaded by
+    load_notifications. Returns True if it went out, False on opt-out.
+    Share a fan_outs dict across a batch to render each shared piece once.
+    """
+    if n.notification_type == "shared_art" and fan_outs is not None:
+        return shared_art_fan_out(fan_outs, sender=n.sender, art_piece=n.art_piece).send(
+            n.recipient, notification_id=n.id, connection=connection)
+    kwargs = {"recipient": n.recipient, "notification_id": n.id, "connection": connection}
+    if n.notification_type == "like":
+        return send_like_email(liker=n.sender, art_piece=n.art_piece, **kwargs)
+    if n.notification_type == "comment":
+        return send_comment_email(comment=n.comment, **kwargs)
+    return send_shared_art_email(sender=n.sender, art_piece=n.art_piece, **kwargs)
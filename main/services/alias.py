@@ -0,0 +1,45 @@
+# main/services/alias.py
+from __future__ import annotations
+
+import random
+from typing import Sequence
+
+
+__all__ = ["AliasTable"]
+
+
+class AliasTable:
+    """
+    Walker/Vose alias table over len(weights) outcomes: built in O(n), then
+    each draw is one uniform index plus one coin flip, independent of the
+    weights' size. Weights must be non-negative with a positive total.
+    """
+
+    __slots__ = ("prob", "alias")
+
+    def __init__(self, weights: Sequence[float]):
+        n = len(weights)
+        total = float(sum(weights))
+        if not n or total <= 0:
+            raise ValueError("AliasTable needs at least one positive weight.")
+
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, s in enumerate(scaled) if s < 1.0]
+        large = [i for i, s in enumerate(scaled) if s >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Leftovers are 1.0 up to rounding; they keep prob 1 and alias self
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rng=random) -> int:
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else self.alias[i]
@@ -0,0 +1,114 @@
+# main/services/art_queue.py
+from __future__ import annotations
+
+from typing import Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from main.models import ArtPiece, CustomUser, QueuedArtPiece, WelcomeGrant
+from main.services.received import received_bitmap
+from main.services.selection import sample_art_piece, sample_welcome_piece
+
+
+__all__ = ["pop_queued_piece", "refill_queue", "refill_queues"]
+
+# Extra draws allowed per missing slot, since draws can repeat a queued piece
+_DRAW_ATTEMPTS = 3
+
+
+def _depth():
+    return getattr(settings, "ART_QUEUE_DEPTH", 3)
+
+
+def _still_valid(entry: QueuedArtPiece, user: CustomUser, received) -> bool:
+    art = entry.art_piece
+    if art.is_deleted or art.user_id == user.id or art.id in received:
+        return False
+    if entry.kind == "welcome":
+        return art.welcome_eligible
+    return art.approved_status
+
+
+def pop_queued_piece(user: CustomUser, *, kind: str = "general") -> Optional[ArtPiece]:
+    """
+    Take the oldest still-valid pre-drawn piece off the user's queue, or None
+    if the queue is empty or has gone stale (callers fall back to live
+    selection). Entries passed over on the way are deleted with it.
+
+    Runs inside the caller's transaction; rows are locked with SKIP LOCKED so
+    two concurrent grants for one user never pop the same entry.
+    """
+    received = received_bitmap(user.id)
+    with transaction.atomic():
+        entries = (
+            QueuedArtPiece.objects
+            .select_for_update(skip_locked=True, of=("self",))
+            .filter(user=user, kind=kind)
+            .select_related("art_piece__user")
+            .order_by("id")
+        )
+        used, piece = [], None
+        for entry in entries:
+            used.append(entry.pk)
+            if _still_valid(entry, user, received):
+                piece = entry.art_piece
+                break
+        if used:
+            QueuedArtPiece.objects.filter(pk__in=used).delete()
+    return piece
+
+
+def refill_queue(user: CustomUser, *, depth: Optional[int] = None) -> int:
+    """
+    Top the user's queues back up: `depth` general pieces, plus one welcome
+    piece while they haven't had their welcome gift. Paused users get no
+    general entries, matching share_art. Returns the number of entries added.
+    """
+    depth = _depth() if depth is None else depth
+    queued = set(QueuedArtPiece.objects.filter(user=user).values_list("kind", "art_piece_id"))
+    new = []
+
+    def draw(kind, want, sample):
+        have = {piece_id for k, piece_id in queued if k == kind}
+        for _ in range(max(0, want - len(have)) * _DRAW_ATTEMPTS):
+            if len(have) >= want:
+                break
+            art = sample(user)
+            if art is None:
+                break
+            if art.id not in have:
+                have.add(art.id)
+                new.append(QueuedArtPiece(user=user, art_piece=art, kind=kind))
+
+    if not user.receive_art_paused:
+        draw("general", depth, sample_art_piece)
+    if not WelcomeGrant.objects.filter(user=user, sent_art_piece__isnull=False).exists():
+        draw("welcome", 1, sample_welcome_piece)
+
+    QueuedArtPiece.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new)
+
+
+def refill_queues(*, limit: Optional[int] = None) -> int:
+    """
+    Background top-up for users whose general queue is short, least
+    recently topped up first, so users whose eligible pool is smaller than
+    the depth (short on every sweep) take their turn instead of the whole
+    batch. Grants refill their own user as they happen (see
+    main/signals.py), so this mainly catches new users and entries dropped
+    as stale.
+    """
+    depth = _depth()
+    limit = limit or getattr(settings, "ART_QUEUE_REFILL_BATCH", 200)
+    users = list(
+        CustomUser.objects.filter(receive_art_paused=False)
+        .annotate(queued=Count("queued_art", filter=Q(queued_art__kind="general")))
+        .filter(queued__lt=depth)
+        .order_by(F("art_queue_refilled_at").asc(nulls_first=True), "id")[:limit]
+    )
+    added = sum(refill_queue(u, depth=depth) for u in users)
+    CustomUser.objects.filter(id__in=[u.id for u in users]).update(
+        art_queue_refilled_at=timezone.now())
+    return added
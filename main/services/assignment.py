@@ -0,0 +1,224 @@
+# main/services/assignment.py
+from __future__ import annotations
+
+from itertools import islice
+from typing import Iterator, Optional
+import numpy as np
+from django.db.models import QuerySet
+
+from main.models import ArtPiece, CustomUser
+from main.services.metrics import phase
+from main.services.received import received_bitmaps
+from main.services.sharing import DEFAULT_CHUNK_SIZE, write_weekly_shares
+
+
+__all__ = ["Cohort", "load_cohort", "solve_assignment", "assign_weekly"]
+
+# Random candidates tried per user before the exact per-user pass
+DEFAULT_ROUNDS = 32
+
+
+class Cohort:
+    """
+    Eligibility structure for one weekly run, as flat NumPy arrays.
+
+    user_ids[u]      CustomUser.id for user index u
+    piece_ids[p]     ArtPiece.id for piece index p (approved, active pool)
+    piece_owner[p]   user index of the piece's sharer, or -1 if the sharer
+                     isn't in the cohort (so it can never be their own piece)
+    piece_sharer[p]  dense sharer index, for per-sharer caps
+    sent_keys        sorted u * n_pieces + p for every already-sent pair
+    """
+
+    def __init__(self, user_ids, piece_ids, piece_owner_ids, sent_pairs=()):
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.piece_ids = np.asarray(piece_ids, dtype=np.int64)
+        owner_ids = np.asarray(piece_owner_ids, dtype=np.int64)
+
+        user_index = {int(user_id): u for u, user_id in enumerate(self.user_ids)}
+        self.piece_owner = np.array(
+            [user_index.get(int(o), -1) for o in owner_ids], dtype=np.int64)
+        _, self.piece_sharer = np.unique(owner_ids, return_inverse=True)
+        self.n_sharers = int(self.piece_sharer.max()) + 1 if owner_ids.size else 0
+
+        keys = [np.asarray(k, dtype=np.int64) for k in sent_pairs]
+        self.sent_keys = np.unique(np.concatenate(keys)) if keys else np.empty(0, np.int64)
+
+    @property
+    def n_users(self):
+        return self.user_ids.size
+
+    @property
+    def n_pieces(self):
+        return self.piece_ids.size
+
+    def is_sent(self, users, pieces):
+        if not self.sent_keys.size:
+            return np.zeros(users.shape, dtype=bool)
+        keys = users * self.n_pieces + pieces
+        pos = np.minimum(np.searchsorted(self.sent_keys, keys), self.sent_keys.size - 1)
+        return self.sent_keys[pos] == keys
+
+    def sent_to(self, u):
+        lo, hi = np.searchsorted(
+            self.sent_keys, [u * self.n_pieces, (u + 1) * self.n_pieces])
+        return self.sent_keys[lo:hi] - u * self.n_pieces
+
+
+def load_cohort(users: QuerySet, *, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Cohort:
+    """
+    Snapshot the cohort (users, possibly sliced) and the approved pool.
+    Already-sent pairs come from the received bitmaps, unpacked straight
+    into piece indexes.
+    """
+    user_ids = np.fromiter(
+        users.values_list("id", flat=True).iterator(chunk_size=chunk_size),
+        dtype=np.int64)
+    pool = np.array(
+        list(ArtPiece.active.filter(approved_status=True)
+             .order_by("id").values_list("id", "user_id")),
+        dtype=np.int64).reshape(-1, 2)
+    piece_ids, owner_ids = pool[:, 0], pool[:, 1]
+
+    # piece id -> piece index (-1: not in the pool)
+    id_to_idx = np.full(int(piece_ids.max()) + 1 if piece_ids.size else 1, -1, np.int64)
+    id_to_idx[piece_ids] = np.arange(piece_ids.size)
+
+    sent_pairs = []
+    ids = iter(enumerate(user_ids.tolist()))
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if not chunk:
+            break
+        bitmaps = received_bitmaps([user_id for _, user_id in chunk])
+        for u, user_id in chunk:
+            bits = bitmaps[user_id].to_bytes()
+            if not bits:
+                continue
+            sent = np.flatnonzero(np.unpackbits(
+                np.frombuffer(bits, dtype=np.uint8), bitorder="little"))
+            sent = id_to_idx[sent[sent < id_to_idx.size]]
+            sent_pairs.append(u * piece_ids.size + sent[sent >= 0])
+
+    return Cohort(user_ids, piece_ids, owner_ids, sent_pairs)
+
+
+def _rank_within(keys):
+    """0-based position of each element among equal keys, in array order."""
+    if not keys.size:
+        return keys
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    run = np.diff(np.r_[starts, keys.size])
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(keys.size) - np.repeat(starts, run)
+    return ranks
+
+
+def solve_assignment(
+    cohort: Cohort,
+    *,
+    max_per_piece: Optional[int] = None,
+    max_per_sharer: Optional[int] = None,
+    rounds: int = DEFAULT_ROUNDS,
+    seed=None,
+) -> np.ndarray:
+    """
+    At most one piece per user, never their own or one already sent, with
+    each piece delivered at most max_per_piece times and each sharer's pieces
+    at most max_per_sharer times this week. Returns a piece index per user
+    (-1: nothing assignable).
+
+    Every round, each unassigned user proposes one uniformly random piece;
+    proposals are accepted in random order up to the remaining capacity of
+    the piece and its sharer. Users left after `rounds` (heavy receivers, or
+    caps nearly exhausted) get an exact pick over their remaining eligible set.
+    """
+    rng = np.random.default_rng(seed)
+    n_users, n_pieces = cohort.n_users, cohort.n_pieces
+    choice = np.full(n_users, -1, dtype=np.int64)
+    if not n_users or not n_pieces:
+        return choice
+
+    piece_left = np.full(n_pieces, max_per_piece or n_users, dtype=np.int64)
+    sharer_left = np.full(cohort.n_sharers, max_per_sharer or n_users, dtype=np.int64)
+
+    pending = np.arange(n_users)
+    for _ in range(rounds):
+        if not pending.size:
+            break
+        cand = rng.integers(0, n_pieces, size=pending.size)
+        ok = cohort.piece_owner[cand] != pending
+        ok &= piece_left[cand] > 0
+        ok &= sharer_left[cohort.piece_sharer[cand]] > 0
+        ok &= ~cohort.is_sent(pending, cand)
+
+        order = rng.permutation(int(ok.sum()))
+        users, pieces = pending[ok][order], cand[ok][order]
+        keep = _rank_within(pieces) < piece_left[pieces]
+        users, pieces = users[keep], pieces[keep]
+        sharers = cohort.piece_sharer[pieces]
+        keep = _rank_within(sharers) < sharer_left[sharers]
+        users, pieces, sharers = users[keep], pieces[keep], sharers[keep]
+
+        choice[users] = pieces
+        piece_left -= np.bincount(pieces, minlength=n_pieces)
+        sharer_left -= np.bincount(sharers, minlength=cohort.n_sharers)
+        pending = pending[choice[pending] < 0]
+
+    for u in rng.permutation(pending):
+        ok = (piece_left > 0) & (sharer_left[cohort.piece_sharer] > 0)
+        if not ok.any():
+            break  # capacity is gone for everyone still waiting
+        ok &= cohort.piece_owner != u
+        ok[cohort.sent_to(u)] = False
+        eligible = np.flatnonzero(ok)
+        if not eligible.size:
+            continue
+        p = eligible[rng.integers(eligible.size)]
+        choice[u] = p
+        piece_left[p] -= 1
+        sharer_left[cohort.piece_sharer[p]] -= 1
+
+    return choice
+
+
+def assign_weekly(
+    users: QuerySet,
+    *,
+    dry_run: bool = False,
+    max_per_piece: Optional[int] = None,
+    max_per_sharer: Optional[int] = None,
+    seed=None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    connection=None,
+    enqueue=None,
+) -> Iterator[tuple[CustomUser, Optional[ArtPiece]]]:
+    """
+    Solve the whole cohort's weekly assignment at once, then write it chunk by
+    chunk with the bulk writer used by share_weekly_bulk.
+    Yields (user, ArtPiece | None) like share_weekly_bulk.
+    """
+    with phase("select"):
+        cohort = load_cohort(users, chunk_size=chunk_size)
+        choice = solve_assignment(
+            cohort, max_per_piece=max_per_piece, max_per_sharer=max_per_sharer, seed=seed)
+    assigned = {
+        int(user_id): int(cohort.piece_ids[p])
+        for user_id, p in zip(cohort.user_ids, choice) if p >= 0
+    }
+
+    it = users.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        pieces = ArtPiece.objects.select_related("user").in_bulk(
+            {assigned[u.id] for u in chunk if u.id in assigned})
+        plan = [(u, pieces.get(assigned.get(u.id))) for u in chunk]
+        if not dry_run:
+            write_weekly_shares(
+                [(u, art) for u, art in plan if art is not None],
+                connection=connection, enqueue=enqueue)
+        yield from plan
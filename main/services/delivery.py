@@ -0,0 +1,32 @@
+# main/services/delivery.py
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+from main.models import NotificationDelivery
+
+
+__all__ = ["delivered", "record_delivery"]
+
+
+def delivered(notification_ids: Iterable[int], *, channel: Optional[str] = None) -> set[int]:
+    """
+    Which of these notifications have already gone out, on channel or (with
+    no channel) on any channel. One query however many ids.
+    """
+    qs = NotificationDelivery.objects.filter(notification_id__in=list(notification_ids))
+    if channel:
+        qs = qs.filter(channel=channel)
+    return set(qs.values_list("notification_id", flat=True))
+
+
+def record_delivery(notification_ids: Iterable[int], *, channel: str) -> None:
+    """
+    Log that these notifications went out on channel. Call as soon as the
+    provider has accepted the message. A single INSERT that skips ids
+    already logged, so a racing duplicate send can't make it fail.
+    """
+    NotificationDelivery.objects.bulk_create(
+        [NotificationDelivery(notification_id=i, channel=channel) for i in notification_ids],
+        ignore_conflicts=True,
+    )
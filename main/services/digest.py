@@ -0,0 +1,188 @@
+# main/services/digest.py
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from itertools import groupby
+from typing import Optional
+from urllib.parse import urlencode
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from main.mail import send_templated_email
+from main.models import EmailOutbox
+from main.services.delivery import delivered, record_delivery
+from main.services.outbox import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS
+from main.services.rate_limit import RateLimited
+from main.utils.email_unsub import make_unsub_token
+
+
+__all__ = ["send_digests"]
+
+logger = logging.getLogger(__name__)
+
+# Users whose rows one claim takes; each gets one email
+DEFAULT_BATCH_USERS = 200
+# Items listed in one digest; the rest are summed up as "and N more"
+DEFAULT_MAX_ITEMS = 20
+
+
+def _abs_url(path):
+    return settings.SITE_URL.rstrip("/") + path
+
+
+def _claim(frequency, *, batch_users, lease):
+    """
+    Lock the held rows of up to batch_users recipients on this frequency and
+    lease them, like outbox.claim_batch. Users who went back to instant
+    emails are flushed by the hourly run.
+    """
+    frequencies = ("hourly", "instant") if frequency == "hourly" else (frequency,)
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(state="digest", available_at__lte=now,
+                    notification__recipient__email_digest__in=frequencies)
+            .order_by("notification__recipient_id", "id")
+            .values_list("id", "notification__recipient_id")
+        )
+        recipients, ids = set(), []
+        for row_id, recipient_id in rows:
+            if recipient_id not in recipients:
+                if len(recipients) == batch_users:
+                    break
+                recipients.add(recipient_id)
+            ids.append(row_id)
+        if ids:
+            EmailOutbox.objects.filter(id__in=ids).update(
+                state="sending", available_at=now + timedelta(seconds=lease))
+    return ids
+
+
+def _item(n):
+    params = {"n": str(n.id)}
+    if n.notification_type == "comment":
+        params.update({"focus": "thread", "other": str(n.sender_id)})
+    else:
+        params["focus"] = "piece"
+    return {
+        "type": n.notification_type,
+        "sender_name": n.sender.get_full_name(),
+        "piece_name": n.art_piece.piece_name if n.art_piece_id else "",
+        "text": n.comment.text if n.comment_id else "",
+        "url": _abs_url(
+            f"{reverse('art_detail', args=[n.art_piece.public_id])}?{urlencode(params)}")
+        if n.art_piece_id else _abs_url(reverse("notifications")),
+    }
+
+
+def _send_digest(recipient, notifications, *, connection, max_items):
+    likes = sum(n.notification_type == "like" for n in notifications)
+    comments = len(notifications) - likes
+    parts = []
+    if comments:
+        parts.append(f"{comments} new message{'s' if comments != 1 else ''}")
+    if likes:
+        parts.append(f"{likes} new like{'s' if likes != 1 else ''}")
+    summary = " and ".join(parts)
+
+    context = {
+        "recipient": recipient,
+        "summary": summary,
+        "items": [_item(n) for n in notifications[:max_items]],
+        "more": max(0, len(notifications) - max_items),
+        "cta_url": _abs_url(reverse("notifications")),
+        "unsubscribe_like_url": _abs_url(reverse(
+            "email_unsubscribe", args=[make_unsub_token(recipient.id, "like")])) if likes else None,
+        "unsubscribe_comment_url": _abs_url(reverse(
+            "email_unsubscribe", args=[make_unsub_token(recipient.id, "comment")])) if comments else None,
+    }
+    send_templated_email(recipient, f"You have {summary} on Omnivore",
+                         "emails/digest", context, connection=connection)
+
+
+def send_digests(
+    frequency: str,
+    *,
+    connection=None,
+    batch_users: Optional[int] = None,
+    max_items: Optional[int] = None,
+) -> dict:
+    """
+    One email per user on this digest frequency summing up their held like
+    and comment notifications. Notifications the user has already read,
+    whose kind they've since turned off, or that already went out (the
+    delivery log) are dropped. Each batch of users is loaded with one
+    query, grouped by recipient.
+    """
+    batch_users = batch_users or getattr(settings, "EMAIL_DIGEST_BATCH_USERS", DEFAULT_BATCH_USERS)
+    max_items = max_items or getattr(settings, "EMAIL_DIGEST_MAX_ITEMS", DEFAULT_MAX_ITEMS)
+    lease = getattr(settings, "EMAIL_OUTBOX_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)
+    max_attempts = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    counts = {"digests": 0, "notifications": 0, "skipped": 0, "failed": 0}
+
+    while True:
+        ids = _claim(frequency, batch_users=batch_users, lease=lease)
+        if not ids:
+            return counts
+
+        rows = list(EmailOutbox.objects.filter(id__in=ids).select_related(
+            "notification__recipient", "notification__sender",
+            "notification__art_piece", "notification__comment",
+        ).order_by("notification__recipient_id", "notification__timestamp"))
+        already = delivered(r.notification_id for r in rows)
+
+        for recipient_id, group in groupby(rows, key=lambda r: r.notification.recipient_id):
+            group = list(group)
+            recipient = group[0].notification.recipient
+            wanted = [
+                r for r in group
+                if r.notification_id not in already
+                and not r.notification.is_read and getattr(
+                    recipient, f"email_on_{r.notification.notification_type}", False)
+            ]
+            now = timezone.now()
+            if not wanted:
+                EmailOutbox.objects.filter(id__in=[r.id for r in group]).update(
+                    state="skipped", sent_at=now)
+                counts["skipped"] += len(group)
+                continue
+            try:
+                _send_digest(recipient, [r.notification for r in wanted],
+                             connection=connection, max_items=max_items)
+            except RateLimited as exc:
+                # Out of send quota: hand back everything still leased and
+                # let a later run pick it up
+                counts["throttled"] = EmailOutbox.objects.filter(id__in=ids, state="sending").update(
+                    state="digest", available_at=now + timedelta(seconds=exc.retry_after))
+                return counts
+            except SoftTimeLimitExceeded:
+                # Leased rows come back once their lease runs out
+                raise
+            except Exception as exc:
+                logger.warning("email_digest_failed", exc_info=True,
+                               extra={"user_id": recipient_id})
+                for r in group:
+                    # Back in the digest queue, but not before the next run
+                    r.attempts += 1
+                    r.last_error = f"{type(exc).__name__}: {exc}"[:1000]
+                    r.state = "failed" if r.attempts >= max_attempts else "digest"
+                    r.available_at = now + timedelta(minutes=30)
+                EmailOutbox.objects.bulk_update(
+                    group, ["attempts", "last_error", "state", "available_at"])
+                counts["failed"] += 1
+                continue
+
+            record_delivery([r.notification_id for r in wanted], channel="digest")
+            wanted_ids = {r.id for r in wanted}
+            EmailOutbox.objects.filter(id__in=wanted_ids).update(state="sent", sent_at=now)
+            EmailOutbox.objects.filter(
+                id__in=[r.id for r in group if r.id not in wanted_ids]
+            ).update(state="skipped", sent_at=now)
+            counts["digests"] += 1
+            counts["notifications"] += len(wanted)
+            counts["skipped"] += len(group) - len(wanted)
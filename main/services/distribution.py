@@ -0,0 +1,186 @@
+# main/services/distribution.py
+from __future__ import annotations
+
+import logging
+from time import monotonic
+from typing import Iterator, Optional
+from django.db import transaction
+from django.db.models import Count, QuerySet
+from django.utils import timezone
+
+from main.models import ArtPiece, CustomUser, DistributionRun, DistributionRunEntry
+from main.notifications_email import send_shared_art_email
+from main.services.metrics import phase, record_failure
+from main.services.sharing import persist_weekly_share
+from main.views import choose_art_piece
+
+
+__all__ = ["start_run", "run_weekly_distribution"]
+
+logger = logging.getLogger(__name__)
+
+# Users handled between ledger checkpoints
+CHECKPOINT_EVERY = 50
+
+
+def start_run(*, filters: Optional[dict] = None) -> DistributionRun:
+    return DistributionRun.objects.create(filters=filters or {})
+
+
+def run_weekly_distribution(
+    run: DistributionRun,
+    users: QuerySet,
+    *,
+    limit: Optional[int] = None,
+    connection=None,
+    checkpoint_every: int = CHECKPOINT_EVERY,
+) -> Iterator[tuple[CustomUser, Optional[ArtPiece]]]:
+    """
+    Ledgered weekly share, resumable from run.last_user_id.
+
+    For each user the DB writes and the DistributionRunEntry commit together,
+    then the email goes out and entry.email_sent is set. On resume:
+      - entries whose email never went out are sent (only those)
+      - users whose share failed get another go, even once the run finished
+      - users with a sent or skipped entry are never re-selected or re-written
+    so nobody gets a second piece or a second email for the same run.
+
+    `users` must be unsliced; `limit` caps the whole run, across resumes.
+    Yields (user, ArtPiece | None) for users handled in this call.
+    """
+    _flush_pending_emails(run, connection=connection)
+    clock = monotonic()
+    retried = yield from _retry_failed(run, users, connection=connection)
+    if run.status == "finished":
+        if retried:
+            _checkpoint(run, last_user_id=run.last_user_id,
+                        elapsed=monotonic() - clock, finished=True)
+        return
+
+    qs = users.order_by("id")
+    if run.last_user_id is not None:
+        qs = qs.filter(id__gt=run.last_user_id)
+    if limit is not None:
+        qs = qs[:max(0, limit - run.users_processed)]
+
+    # Entries written after the last checkpoint, before a crash
+    done = set(run.entries.filter(
+        user_id__gt=run.last_user_id or 0).values_list("user_id", flat=True))
+
+    last_user_id = run.last_user_id
+    since_checkpoint = 0
+    for u in qs.iterator():
+        last_user_id = u.id
+        if u.id in done:
+            continue
+
+        art, entry = _share_one(run, u)
+        if entry.outcome == "sent":
+            _send_entry_email(entry, recipient=u, art=art,
+                              connection=connection)
+        yield u, art
+
+        since_checkpoint += 1
+        if since_checkpoint >= checkpoint_every:
+            now = monotonic()
+            _checkpoint(run, last_user_id=last_user_id, elapsed=now - clock)
+            clock, since_checkpoint = now, 0
+
+    _checkpoint(run, last_user_id=last_user_id,
+                elapsed=monotonic() - clock, finished=True)
+
+
+def _share_one(run, user):
+    try:
+        with phase("select"):
+            art = choose_art_piece(user)
+        with phase("persist"), transaction.atomic():
+            n = persist_weekly_share(user=user, art=art) if art else None
+            # Replaces the entry of an earlier failed attempt, if any
+            entry, _ = DistributionRunEntry.objects.update_or_create(
+                run=run,
+                user=user,
+                defaults={
+                    "art_piece": art,
+                    "notification": n,
+                    "outcome": "sent" if art else "skipped",
+                },
+            )
+        return art, entry
+    except Exception as exc:
+        logger.exception("weekly_share_failed", extra={
+            "run_id": str(run.run_id), "user_id": user.id})
+        record_failure(exc)
+        entry, _ = DistributionRunEntry.objects.get_or_create(
+            run=run, user=user, defaults={"outcome": "failed"})
+        return None, entry
+
+
+def _retry_failed(run, users, *, connection=None):
+    """Another go for users whose share failed earlier in this run."""
+    failed = users.filter(id__in=run.entries.filter(
+        outcome="failed").values("user_id")).order_by("id")
+    retried = 0
+    for u in failed.iterator():
+        art, entry = _share_one(run, u)
+        if entry.outcome == "sent":
+            _send_entry_email(entry, recipient=u, art=art,
+                              connection=connection)
+        retried += 1
+        yield u, art
+    return retried
+
+
+def _send_entry_email(entry, *, recipient, art, connection=None):
+    try:
+        sent = send_shared_art_email(
+            recipient=recipient,
+            sender=art.user,
+            art_piece=art,
+            notification_id=entry.notification_id,
+            connection=connection,
+        )
+    except Exception as exc:
+        # Rows are committed; the email stays pending for the next resume
+        logger.exception("weekly_email_failed", extra={
+            "run_id": str(entry.run.run_id), "user_id": recipient.id})
+        record_failure(exc)
+        return
+    if sent:
+        DistributionRunEntry.objects.filter(
+            pk=entry.pk).update(email_sent=True)
+    else:
+        # Recipient opted out; a resume has nothing to send either
+        DistributionRunEntry.objects.filter(
+            pk=entry.pk).update(email_skipped=True)
+
+
+def _flush_pending_emails(run, *, connection=None):
+    pending = run.entries.filter(
+        outcome="sent", email_sent=False, email_skipped=False, art_piece__isnull=False,
+    ).select_related("user", "art_piece", "art_piece__user")
+    for entry in pending:
+        _send_entry_email(entry, recipient=entry.user,
+                          art=entry.art_piece, connection=connection)
+
+
+def _checkpoint(run, *, last_user_id, elapsed, finished=False):
+    counts = dict(run.entries.order_by().values_list(
+        "outcome").annotate(n=Count("id")))
+
+    run.last_user_id = last_user_id
+    run.sent_count = counts.get("sent", 0)
+    run.skipped_count = counts.get("skipped", 0)
+    run.failed_count = counts.get("failed", 0)
+    run.users_processed = sum(counts.values())
+    run.elapsed_seconds += elapsed
+    if run.elapsed_seconds > 0:
+        run.users_per_second = run.users_processed / run.elapsed_seconds
+
+    fields = ["last_user_id", "sent_count", "skipped_count", "failed_count",
+              "users_processed", "elapsed_seconds", "users_per_second"]
+    if finished:
+        run.status = "finished"
+        run.finished_at = timezone.now()
+        fields += ["status", "finished_at"]
+    run.save(update_fields=fields)
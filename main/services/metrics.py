@@ -0,0 +1,118 @@
+# main/services/metrics.py
+from __future__ import annotations
+
+import json
+import logging
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+from django.db import connection
+
+
+__all__ = ["RunMetrics", "phase", "record_failure"]
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in milliseconds (the last bucket is open)
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_current: ContextVar[Optional["RunMetrics"]] = ContextVar("run_metrics", default=None)
+
+
+class RunMetrics:
+    """
+    Per-phase timings, query count and failures for one weekly run.
+
+    While `with metrics.active():` is open, phase("select" | "persist" |
+    "render" | "send") blocks anywhere in the weekly path add their duration
+    here, every query on the default connection is counted, and
+    record_failure() tallies exceptions by type. Outside it those hooks are
+    no-ops. The per-user path times each user; the bulk paths time select
+    and persist once per chunk.
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.failures = Counter()
+        self.queries = 0
+        self._started = None
+        self._elapsed = 0.0
+
+    @contextmanager
+    def active(self):
+        token = _current.set(self)
+        start = perf_counter()
+        try:
+            with connection.execute_wrapper(self._count_query):
+                yield self
+        finally:
+            self._elapsed += perf_counter() - start
+            _current.reset(token)
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.timings[name].append(seconds)
+
+    def summary(self) -> dict:
+        phases = {}
+        for name, values in self.timings.items():
+            ms = sorted(v * 1000 for v in values)
+            hist = Counter(bisect_left(BUCKETS_MS, v) for v in ms)
+            phases[name] = {
+                "count": len(ms),
+                "total_ms": round(sum(ms), 3),
+                "p50_ms": round(_percentile(ms, 50), 3),
+                "p95_ms": round(_percentile(ms, 95), 3),
+                "p99_ms": round(_percentile(ms, 99), 3),
+                "max_ms": round(ms[-1], 3),
+                "histogram": {
+                    (f"le_{BUCKETS_MS[i]}ms" if i < len(BUCKETS_MS) else f"gt_{BUCKETS_MS[-1]}ms"): n
+                    for i, n in sorted(hist.items())
+                },
+            }
+        return {
+            "elapsed_seconds": round(self._elapsed, 3),
+            "queries": self.queries,
+            "phases": phases,
+            "failures": dict(self.failures),
+        }
+
+    def emit(self, path: Optional[str] = None) -> dict:
+        """Log the summary as one JSON line, and write it to `path` if given."""
+        summary = self.summary()
+        logger.info("weekly_run_summary %s", json.dumps(summary, sort_keys=True))
+        if path:
+            with open(path, "w") as fp:
+                json.dump(summary, fp, indent=2, sort_keys=True)
+        return summary
+
+
+@contextmanager
+def phase(name: str):
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, perf_counter() - start)
+
+
+def record_failure(exc: BaseException) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.failures[type(exc).__name__] += 1
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
@@ -0,0 +1,264 @@
+# main/services/outbox.py
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from time import monotonic
+from typing import Iterable, Optional
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import CustomUser, EmailOutbox, Notification
+from main.notifications_email import send_notification_email
+from main.services.rate_limit import RateLimited
+
+
+__all__ = ["queue_emails", "queue_message", "claim_batch", "send_outbox_rows", "dispatch_outbox", "outbox_backlog"]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+# How long a claimed row stays reserved before another dispatcher may retry it
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+# Comment emails wait this long for the thread to go quiet, and never more
+# than the max after the first message of the burst
+DEFAULT_DEBOUNCE_SECONDS = 120
+DEFAULT_DEBOUNCE_MAX_SECONDS = 600
+
+
+# Notification types a recipient can take as a periodic digest instead
+DIGEST_TYPES = ("like", "comment")
+
+
+def queue_emails(notifications: Iterable[Notification]) -> list[EmailOutbox]:
+    """
+    Outbox rows for these notifications. Call in the same transaction that
+    creates them; nothing touches the broker. Likes and comments for users
+    on a digest are held for services.digest instead of sent one by one,
+    and comment emails are debounced per thread (see _debounce_comment).
+    """
+    rows, debounced = [], []
+    for n in notifications:
+        if n.notification_type in DIGEST_TYPES and n.recipient.email_digest != "instant":
+            rows.append(EmailOutbox(notification=n, state="digest"))
+        elif n.notification_type == "comment" and _debounce_window()[0]:
+            debounced.append(_debounce_comment(n))
+        else:
+            rows.append(EmailOutbox(notification=n))
+    return EmailOutbox.objects.bulk_create(rows) + debounced
+
+
+def queue_message(
+    *,
+    kind: str,
+    to: list[str],
+    subject: str,
+    body: str,
+    html: Optional[str] = None,
+    from_email: Optional[str] = None,
+    priority: int = EmailOutbox.PRIORITY_HIGH,
+) -> EmailOutbox:
+    """
+    Outbox row for a transactional email that isn't a notification, so a
+    view can hand it off instead of talking to the provider in the request.
+    Rows go out ahead of any with a larger priority number.
+    """
+    return EmailOutbox.objects.create(
+        kind=kind,
+        priority=priority,
+        message={"to": list(to), "subject": subject, "body": body,
+                 "html": html, "from_email": from_email},
+    )
+
+
+def _send_message(row: EmailOutbox, *, connection=None) -> bool:
+    """
+    Send a queue_message row. Only to and subject are kept afterwards; the
+    body may hold a password-reset link.
+    """
+    m = row.message
+    msg = EmailMultiAlternatives(
+        m["subject"], m["body"], m.get("from_email") or settings.DEFAULT_FROM_EMAIL,
+        m["to"], connection=connection)
+    if m.get("html"):
+        msg.attach_alternative(m["html"], "text/html")
+    msg.send()
+    row.message = {"to": m["to"], "subject": m["subject"]}
+    row.save(update_fields=["message"])
+    return True
+
+
+def _debounce_window():
+    return (
+        getattr(settings, "COMMENT_EMAIL_DEBOUNCE_SECONDS", DEFAULT_DEBOUNCE_SECONDS),
+        getattr(settings, "COMMENT_EMAIL_DEBOUNCE_MAX_SECONDS", DEFAULT_DEBOUNCE_MAX_SECONDS),
+    )
+
+
+def _debounce_comment(n: Notification) -> EmailOutbox:
+    """
+    One email per burst of messages in an (art_piece, sender, recipient)
+    thread. The first message's row waits out the quiet window; a message
+    arriving while it still waits takes the row over (so the email shows
+    the latest message) and restarts the window, but never past
+    max_seconds after the first message.
+    """
+    quiet, max_seconds = _debounce_window()
+    now = timezone.now()
+    # The signal may fire in autocommit (e.g. a reply saved outside atomic);
+    # the row lock needs a transaction of its own then
+    with transaction.atomic():
+        # Serialize on the recipient's row, which always exists: with no
+        # pending outbox row yet there is nothing else to lock, and two first
+        # messages would each create one. NO KEY so it doesn't wait on the
+        # key-share locks that inserting comments for this user takes.
+        list(CustomUser.objects.select_for_update(no_key=True)
+             .filter(pk=n.recipient_id).values_list("pk", flat=True))
+        row = (
+            EmailOutbox.objects.select_for_update()
+            .filter(state="pending", available_at__gt=now,
+                    notification__notification_type="comment",
+                    notification__recipient_id=n.recipient_id,
+                    notification__sender_id=n.sender_id,
+                    notification__art_piece_id=n.art_piece_id)
+            .order_by("-id").first()
+        )
+        if row is None:
+            return EmailOutbox.objects.create(
+                notification=n, available_at=now + timedelta(seconds=quiet))
+        row.notification = n
+        row.available_at = min(now + timedelta(seconds=quiet),
+                               row.created_at + timedelta(seconds=max_seconds))
+        row.save(update_fields=["notification", "available_at"])
+    return row
+
+
+def claim_batch(*, batch_size: int = DEFAULT_BATCH_SIZE, lease_seconds: Optional[int] = None) -> list[int]:
+    """
+    Claim up to batch_size due rows, highest priority first: pending ones,
+    and "sending" ones whose lease ran out (their dispatcher died). Rows
+    another dispatcher is claiming right now are skipped, not waited on.
+    Returns the claimed ids.
+    """
+    lease = lease_seconds or getattr(
+        settings, "EMAIL_OUTBOX_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(state__in=("pending", "sending"), available_at__lte=now)
+            .order_by("priority", "available_at", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if ids:
+            EmailOutbox.objects.filter(id__in=ids).update(
+                state="sending", available_at=now + timedelta(seconds=lease))
+    return ids
+
+
+def send_outbox_rows(ids: list[int], *, connection=None) -> dict:
+    """
+    Send claimed rows over one connection and record each outcome. A failed
+    row goes back to pending with exponential backoff until it has used
+    EMAIL_OUTBOX_MAX_ATTEMPTS, then stays failed. If the send-rate limiter
+    gives up waiting, this row and the rest go back to pending until the
+    quota refills, without using an attempt.
+    """
+    max_attempts = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    counts = {"sent": 0, "skipped": 0, "failed": 0, "retrying": 0, "throttled": 0}
+    rows = EmailOutbox.objects.filter(id__in=ids).select_related(
+        "notification__recipient", "notification__sender",
+        "notification__art_piece", "notification__comment__art_piece",
+        "notification__comment__sender",
+    ).order_by("priority", "id")
+
+    done, skipped, fan_outs = [], [], {}
+    processed = set()
+    for row in rows:
+        try:
+            if row.notification_id is None:
+                sent = _send_message(row, connection=connection)
+            else:
+                sent = send_notification_email(
+                    row.notification, connection=connection, fan_outs=fan_outs)
+        except RateLimited as exc:
+            # Hand back only this row and the ones not reached yet; rows that
+            # failed or were set to retry earlier keep their state
+            unsent = [i for i in ids if i not in processed]
+            EmailOutbox.objects.filter(id__in=unsent).update(
+                state="pending",
+                available_at=timezone.now() + timedelta(seconds=exc.retry_after))
+            counts["throttled"] = len(unsent)
+            break
+        except SoftTimeLimitExceeded:
+            # The task is out of time: keep what went out, and leave the
+            # rest leased for a later dispatch rather than failing them
+            _mark_sent(done, skipped)
+            raise
+        except Exception as exc:
+            logger.warning("outbox_send_failed", exc_info=True, extra={
+                "outbox_id": row.id, "kind": row.kind, "notification_id": row.notification_id})
+            row.attempts += 1
+            row.last_error = f"{type(exc).__name__}: {exc}"[:1000]
+            if row.attempts >= max_attempts:
+                row.state = "failed"
+                counts["failed"] += 1
+            else:
+                row.state = "pending"
+                row.available_at = timezone.now() + timedelta(seconds=30 * 2 ** row.attempts)
+                counts["retrying"] += 1
+            row.save(update_fields=["attempts", "last_error", "state", "available_at"])
+            processed.add(row.id)
+            continue
+        (done if sent else skipped).append(row.id)
+        processed.add(row.id)
+
+    _mark_sent(done, skipped)
+    counts["sent"], counts["skipped"] = len(done), len(skipped)
+    return counts
+
+
+def _mark_sent(done, skipped):
+    now = timezone.now()
+    if done:
+        EmailOutbox.objects.filter(id__in=done).update(state="sent", sent_at=now)
+    if skipped:
+        EmailOutbox.objects.filter(id__in=skipped).update(state="skipped", sent_at=now)
+
+
+def dispatch_outbox(
+    *,
+    batch_size: Optional[int] = None,
+    budget_seconds: Optional[float] = None,
+    connection=None,
+) -> dict:
+    """
+    Claim and send due outbox rows batch by batch until none are left,
+    budget_seconds have passed (checked between batches) or the send rate
+    is exhausted. Safe to run from several workers at once.
+    """
+    batch_size = batch_size or getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    budget = budget_seconds or getattr(settings, "EMAIL_OUTBOX_BUDGET_SECONDS", 60)
+    totals = {"batches": 0, "sent": 0, "skipped": 0, "failed": 0, "retrying": 0, "throttled": 0}
+    start = monotonic()
+    while monotonic() - start < budget:
+        ids = claim_batch(batch_size=batch_size)
+        if not ids:
+            break
+        counts = send_outbox_rows(ids, connection=connection)
+        totals["batches"] += 1
+        for key, value in counts.items():
+            totals[key] += value
+        if counts["throttled"]:
+            break
+    return totals
+
+
+def outbox_backlog() -> int:
+    """Rows due now; a steadily growing number means dispatch can't keep up."""
+    return EmailOutbox.objects.filter(
+        state__in=("pending", "sending"), available_at__lte=timezone.now()).count()
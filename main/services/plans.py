@@ -0,0 +1,122 @@
+# main/services/plans.py
+from __future__ import annotations
+
+import json
+import random
+from itertools import islice
+from typing import IO, Iterator, Optional
+from django.db.models import Exists, OuterRef, QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.models import ArtPiece, CustomUser, SentArtPiece
+from main.services.sharing import DEFAULT_CHUNK_SIZE, share_weekly_bulk, write_weekly_shares
+
+
+__all__ = ["write_plan", "read_plan", "apply_plan"]
+
+PLAN_VERSION = 1
+
+
+def write_plan(
+    users: QuerySet,
+    fp: IO[str],
+    *,
+    seed: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple[CustomUser, Optional[ArtPiece]]]:
+    """
+    Decide the weekly share for every user in `users` (ordered by id) and
+    stream it to fp as JSON Lines. Writes nothing to the DB and sends nothing.
+
+    Line 1 is a header recording the seed; every following line is one
+    decision, {"user_id": ..., "art_piece_id": ... | null}. The same seed over
+    the same users and DB state reproduces the same plan.
+    Yields (user, ArtPiece | None) as each decision is written.
+    """
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+
+    header = {"plan": "weekly", "version": PLAN_VERSION, "seed": seed,
+              "created_at": timezone.now().isoformat()}
+    fp.write(json.dumps(header) + "\n")
+
+    for u, art in share_weekly_bulk(
+        users.iterator(chunk_size=chunk_size),
+        dry_run=True,
+        chunk_size=chunk_size,
+        rng=random.Random(seed),
+    ):
+        fp.write(json.dumps(
+            {"user_id": u.id, "art_piece_id": art.id if art else None}) + "\n")
+        yield u, art
+
+
+def read_plan(fp: IO[str], *, offset: int = 0, count: Optional[int] = None) -> Iterator[tuple[int, int, Optional[int]]]:
+    """
+    Stream (line_no, user_id, art_piece_id) decisions from a plan file.
+    offset skips that many decisions (not counting the header); count caps
+    how many are read. line_no is 1-based and counts the header.
+    """
+    _read_header(fp)
+    yield from _read_decisions(fp, offset=offset, count=count)
+
+
+def _read_header(fp: IO[str]) -> dict:
+    header = json.loads(fp.readline() or "{}")
+    if header.get("plan") != "weekly" or header.get("version") != PLAN_VERSION:
+        raise ValueError("Not a weekly plan file (missing or unknown header).")
+    return header
+
+
+def _read_decisions(fp, *, offset, count):
+    stop = None if count is None else offset + count
+    for i, line in enumerate(islice(fp, offset, stop), start=offset + 2):
+        row = json.loads(line)
+        yield i, row["user_id"], row["art_piece_id"]
+
+
+def apply_plan(
+    fp: IO[str],
+    *,
+    offset: int = 0,
+    count: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    connection=None,
+) -> Iterator[tuple[int, CustomUser, Optional[ArtPiece]]]:
+    """
+    Perform a plan's decisions chunk by chunk: two lookups per chunk, then the
+    same bulk writes and emails as share_weekly_bulk. Disjoint offset/count
+    ranges can be applied in parallel, and a crashed apply resumes from the
+    last line it reported.
+
+    Decisions that went stale since planning are skipped: the user paused or
+    was deleted, got a weekly piece some other way after the plan was written
+    (the scheduler, a ledgered or bulk run), or the piece was deleted or
+    unapproved. Re-applying a line is idempotent on (user, art_piece).
+    Yields (line_no, user, ArtPiece | None) after each chunk is written.
+    """
+    planned_at = parse_datetime(_read_header(fp).get("created_at") or "")
+    if planned_at is None:
+        raise ValueError("Plan header has no created_at.")
+    decisions = _read_decisions(fp, offset=offset, count=count)
+    while True:
+        chunk = list(islice(decisions, chunk_size))
+        if not chunk:
+            return
+
+        users = CustomUser.objects.filter(receive_art_paused=False).exclude(
+            last_art_sent_at__gt=planned_at,
+        ).exclude(Exists(SentArtPiece.objects.filter(
+            user=OuterRef("pk"), source="weekly", sent_time__gt=planned_at,
+        ))).in_bulk({user_id for _, user_id, _ in chunk})
+        pieces = ArtPiece.active.filter(approved_status=True).select_related("user").in_bulk(
+            {piece_id for _, _, piece_id in chunk if piece_id is not None})
+
+        plan = [
+            (line_no, users[user_id], pieces.get(piece_id))
+            for line_no, user_id, piece_id in chunk if user_id in users
+        ]
+        write_weekly_shares(
+            [(u, art) for _, u, art in plan if art is not None], connection=connection)
+        yield from plan
@@ -0,0 +1,188 @@
+# main/services/rate_limit.py
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Optional
+import redis
+from django.conf import settings
+
+from main.services.metrics import phase
+
+
+__all__ = ["RateLimited", "TokenBucket", "LocalTokenBucket", "send_rate_limiter"]
+
+logger = logging.getLogger(__name__)
+
+# SES's default sending quota for a production account, messages/second
+DEFAULT_SEND_RATE = 14.0
+
+
+class RateLimited(Exception):
+    """The send quota is exhausted; try again in retry_after seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"email send rate exceeded; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class _Bucket(ABC):
+    """
+    Token bucket: `rate` tokens a second, holding at most `burst`. A send
+    takes one token per recipient. acquire() sleeps until the tokens are
+    there, or raises RateLimited if that would take longer than max_wait.
+    A send to more recipients than the burst takes the whole burst.
+    """
+
+    def __init__(self, *, rate: float, burst: Optional[float] = None, max_wait: float = 30.0):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.max_wait = max_wait
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    @abstractmethod
+    def _take(self, n: float) -> float:
+        """Take n tokens and return 0, or return how long until there are n."""
+
+    def acquire(self, n: int = 1, *, max_wait: Optional[float] = None) -> None:
+        max_wait = self.max_wait if max_wait is None else max_wait
+        # The bucket never holds more than burst, so more could never be taken
+        n = min(n, self.burst)
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._take(n)
+            if wait <= 0:
+                return
+            self.throttled += 1
+            if time.monotonic() + wait > deadline:
+                raise RateLimited(wait)
+            with phase("throttle"):
+                time.sleep(wait)
+            self.waited_seconds += wait
+
+    @abstractmethod
+    def fill(self) -> float:
+        """Tokens available now."""
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "tokens": round(self.fill(), 2),
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
+
+
+class LocalTokenBucket(_Bucket):
+    """In-process bucket, for development and single-process deployments."""
+
+    def __init__(self, *, clock=time.monotonic, **kwargs):
+        super().__init__(**kwargs)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._ts = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+
+    def _take(self, n):
+        with self._lock:
+            self._refill()
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0.0
+            return (n - self._tokens) / self.rate
+
+    def fill(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+# Refill and take atomically on the Redis server, using its clock so every
+# worker agrees on time. Returns the wait as a string (Lua numbers would be
+# truncated to integers).
+_TAKE = """
+local rate, burst, n = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= n then
+  tokens = tokens - n
+else
+  wait = (n - tokens) / rate
+  redis.call('HINCRBY', KEYS[1], 'throttled', 1)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], 86400)
+return tostring(wait)
+"""
+
+
+class TokenBucket(_Bucket):
+    """
+    Cluster-wide bucket in Redis, shared by every worker, web process and
+    management command. If Redis can't be reached the send is let through
+    (and logged) rather than blocking email on a Redis outage.
+    """
+
+    def __init__(self, *, client, key: str = "omnivore:email:bucket", **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.key = key
+        self._script = client.register_script(_TAKE)
+
+    def _take(self, n):
+        try:
+            return float(self._script(keys=[self.key], args=[self.rate, self.burst, n]))
+        except Exception:
+            logger.warning("email_rate_limiter_unavailable", exc_info=True)
+            return 0.0
+
+    def fill(self):
+        try:
+            tokens, ts, _ = self.client.hmget(self.key, "tokens", "ts", "throttled")
+            seconds, micros = self.client.time()
+        except Exception:
+            return float("nan")
+        if tokens is None:
+            return self.burst
+        now = seconds + micros / 1e6
+        return min(self.burst, float(tokens) + max(0.0, now - float(ts)) * self.rate)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        try:
+            stats["throttled_total"] = int(self.client.hget(self.key, "throttled") or 0)
+        except Exception:
+            pass
+        return stats
+
+
+@lru_cache(maxsize=None)
+def send_rate_limiter() -> _Bucket:
+    """
+    The process's limiter for outgoing email, per settings.EMAIL_SEND_RATE
+    (the SES max send rate) and EMAIL_SEND_BURST. Shared through Redis when
+    EMAIL_RATE_LIMIT_REDIS_URL is set, otherwise per process.
+    """
+    kwargs = {
+        "rate": getattr(settings, "EMAIL_SEND_RATE", DEFAULT_SEND_RATE),
+        "burst": getattr(settings, "EMAIL_SEND_BURST", None),
+        "max_wait": getattr(settings, "EMAIL_RATE_LIMIT_MAX_WAIT", 30.0),
+    }
+    url = getattr(settings, "EMAIL_RATE_LIMIT_REDIS_URL", None)
+    if url:
+        return TokenBucket(client=redis.Redis.from_url(url), **kwargs)
+    return LocalTokenBucket(**kwargs)
@@ -0,0 +1,205 @@
+# main/services/received.py
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Iterable, Mapping, Optional
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import ReceivedArtBitmap, SentArtPiece
+
+
+__all__ = [
+    "PieceBitmap",
+    "received_bitmap",
+    "received_bitmaps",
+    "mark_received",
+    "unmark_received",
+    "rebuild_bitmaps",
+    "check_bitmaps",
+]
+
+
+class PieceBitmap:
+    """
+    Set of piece ids packed one bit per id. 10k pieces fit in 1.25 KB, and
+    membership is a byte index plus a mask.
+    """
+    __slots__ = ("_bits",)
+
+    def __init__(self, data: bytes = b""):
+        self._bits = bytearray(data)
+
+    @classmethod
+    def from_ids(cls, piece_ids: Iterable[int]) -> "PieceBitmap":
+        bm = cls()
+        for piece_id in piece_ids:
+            bm.add(piece_id)
+        return bm
+
+    def __contains__(self, piece_id) -> bool:
+        i = piece_id >> 3
+        return i < len(self._bits) and bool(self._bits[i] & (1 << (piece_id & 7)))
+
+    def add(self, piece_id: int) -> None:
+        i = piece_id >> 3
+        if i >= len(self._bits):
+            self._bits.extend(bytes(i + 1 - len(self._bits)))
+        self._bits[i] |= 1 << (piece_id & 7)
+
+    def discard(self, piece_id: int) -> None:
+        i = piece_id >> 3
+        if i < len(self._bits):
+            self._bits[i] &= ~(1 << (piece_id & 7)) & 0xFF
+
+    def __iter__(self):
+        for i, byte in enumerate(self._bits):
+            while byte:
+                low = byte & -byte
+                yield (i << 3) + low.bit_length() - 1
+                byte ^= low
+
+    def __len__(self) -> int:
+        return sum(byte.bit_count() for byte in self._bits)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits.rstrip(b"\0"))
+
+
+def _from_sent(user_ids) -> dict[int, PieceBitmap]:
+    bitmaps = defaultdict(PieceBitmap)
+    for user_id, piece_id in SentArtPiece.objects.filter(
+        user_id__in=user_ids
+    ).values_list("user_id", "art_piece_id").iterator():
+        bitmaps[user_id].add(piece_id)
+    return {user_id: bitmaps[user_id] for user_id in user_ids}
+
+
+def received_bitmaps(user_ids: Iterable[int]) -> dict[int, PieceBitmap]:
+    """
+    {user_id: PieceBitmap} in one query. Users without a stored bitmap yet
+    are built from SentArtPiece and saved, so the next read is a single row.
+    """
+    user_ids = list(user_ids)
+    found = {
+        user_id: PieceBitmap(bits)
+        for user_id, bits in ReceivedArtBitmap.objects.filter(
+            user_id__in=user_ids).values_list("user_id", "bits")
+    }
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        built = _from_sent(missing)
+        # A concurrent mark_received may have created the row meanwhile; its
+        # copy already includes everything we saw, so keep it.
+        ReceivedArtBitmap.objects.bulk_create(
+            [ReceivedArtBitmap(user_id=user_id, bits=bm.to_bytes())
+             for user_id, bm in built.items()],
+            ignore_conflicts=True,
+        )
+        found.update(built)
+    return found
+
+
+def received_bitmap(user_id: int) -> PieceBitmap:
+    return received_bitmaps([user_id])[user_id]
+
+
+def mark_received(pairs: Mapping[int, Iterable[int]]) -> None:
+    """
+    Record newly created SentArtPiece rows: {user_id: [art_piece_id, ...]}.
+    Call in the same transaction as the inserts. Rows are locked while
+    updated, so concurrent grants to one user can't drop each other's bits.
+    """
+    _apply(pairs, add=True)
+
+
+def unmark_received(pairs: Mapping[int, Iterable[int]]) -> None:
+    _apply(pairs, add=False)
+
+
+def _apply(pairs, *, add):
+    if not pairs:
+        return
+    with transaction.atomic():
+        rows = ReceivedArtBitmap.objects.select_for_update().in_bulk(list(pairs))
+        missing = [user_id for user_id in pairs if user_id not in rows]
+
+        for user_id, row in rows.items():
+            bm = PieceBitmap(row.bits)
+            for piece_id in pairs[user_id]:
+                if add:
+                    bm.add(piece_id)
+                else:
+                    bm.discard(piece_id)
+            row.bits = bm.to_bytes()
+            row.updated_at = timezone.now()  # bulk_update skips auto_now
+        ReceivedArtBitmap.objects.bulk_update(rows.values(), ["bits", "updated_at"])
+
+        # First write for these users: SentArtPiece (including the rows being
+        # recorded) is the source of truth. On unmark there's nothing to
+        # clear, and the user may be mid-delete (their bitmap cascaded first).
+        if missing and add:
+            rebuild_bitmaps(missing)
+
+
+def rebuild_bitmaps(user_ids: Optional[Iterable[int]] = None, *, chunk_size: int = 500) -> int:
+    """
+    Recompute stored bitmaps from SentArtPiece. user_ids=None rebuilds every
+    user that has received anything. Returns the number of users written.
+    """
+    if user_ids is None:
+        user_ids = SentArtPiece.objects.order_by("user_id").values_list(
+            "user_id", flat=True).distinct().iterator(chunk_size=chunk_size)
+
+    written = 0
+    chunk = []
+    for user_id in user_ids:
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            written += _store(_from_sent(chunk))
+            chunk = []
+    if chunk:
+        written += _store(_from_sent(chunk))
+    return written
+
+
+def _store(bitmaps):
+    ReceivedArtBitmap.objects.bulk_create(
+        [ReceivedArtBitmap(user_id=user_id, bits=bm.to_bytes())
+         for user_id, bm in bitmaps.items()],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["bits", "updated_at"],
+    )
+    return len(bitmaps)
+
+
+def check_bitmaps(user_ids: Optional[Iterable[int]] = None, *, chunk_size: int = 500):
+    """
+    Compare stored bitmaps against SentArtPiece.
+    Yields (user_id, missing_ids, extra_ids) for each user that disagrees;
+    users with no stored bitmap yet are skipped (they're built on first read).
+    """
+    if user_ids is None:
+        user_ids = ReceivedArtBitmap.objects.order_by("user_id").values_list(
+            "user_id", flat=True).iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for user_id in user_ids:
+        chunk.append(user_id)
+        if len(chunk) >= chunk_size:
+            yield from _diff(chunk)
+            chunk = []
+    if chunk:
+        yield from _diff(chunk)
+
+
+def _diff(user_ids):
+    stored = dict(ReceivedArtBitmap.objects.filter(
+        user_id__in=user_ids).values_list("user_id", "bits"))
+    truth = _from_sent([user_id for user_id in user_ids if user_id in stored])
+    for user_id, expected in truth.items():
+        actual = set(PieceBitmap(stored[user_id]))
+        expected = set(expected)
+        if actual != expected:
+            yield user_id, sorted(expected - actual), sorted(actual - expected)
@@ -0,0 +1,387 @@
+# main/services/recommend.py
+from __future__ import annotations
+
+import random
+from itertools import chain, islice
+from typing import Iterable, Optional
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from main.models import ArtCandidateList, ArtPiece, ArtPieceNeighbors, Comment, CustomUser, Like
+from main.services.received import received_bitmap, received_bitmaps
+
+
+__all__ = [
+    "NeighborTable",
+    "load_interactions",
+    "build_neighbors",
+    "build_recommendations",
+    "refresh_recommendations",
+    "candidate_lists",
+    "pick_candidate",
+    "recommended_piece",
+]
+
+TOP_K = 50                  # candidates kept per user
+TOP_NEIGHBORS = 50          # neighbors kept per piece
+MAX_PER_USER = 500          # newest interactions per user used for co-occurrence
+DEFAULT_CHUNK_SIZE = 1000   # users scored/written per batch
+SERVE_WINDOW = 10           # best still-valid candidates a pick is drawn from
+_PAIR_BUDGET = 5_000_000    # co-occurrence pairs materialised per batch
+
+
+def _rate():
+    return getattr(settings, "ART_RECOMMENDATION_RATE", 0.0)
+
+
+def _include_comments():
+    return getattr(settings, "ART_RECOMMENDATIONS_INCLUDE_COMMENTS", False)
+
+
+def _unpack(ids, scores):
+    return (np.frombuffer(bytes(ids), dtype="<i4").tolist(),
+            np.frombuffer(bytes(scores), dtype="<f4").tolist())
+
+
+def _pairs(qs):
+    flat = chain.from_iterable(qs.iterator(chunk_size=10000))
+    return np.fromiter(flat, dtype=np.int64).reshape(-1, 2)
+
+
+def load_interactions(*, user_ids: Optional[Iterable[int]] = None, include_comments: Optional[bool] = None):
+    """
+    Distinct (user_id, piece_id) interactions as two int64 arrays sorted by
+    user, then piece: every Like, plus (include_comments) every piece a user
+    commented on that isn't their own. Each user keeps their MAX_PER_USER
+    highest piece ids (roughly the newest), which bounds co-occurrence cost.
+    """
+    include_comments = _include_comments() if include_comments is None else include_comments
+    likes = Like.objects.all()
+    comments = Comment.objects.exclude(sender=F("art_piece__user"))
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        likes = likes.filter(user_id__in=user_ids)
+        comments = comments.filter(sender_id__in=user_ids)
+
+    parts = [_pairs(likes.values_list("user_id", "art_piece_id"))]
+    if include_comments:
+        parts.append(_pairs(comments.values_list("sender_id", "art_piece_id")))
+    pairs = np.unique(np.concatenate(parts), axis=0)
+    users, pieces = pairs[:, 0], pairs[:, 1]
+
+    starts, sizes = _groups(users)
+    from_end = np.repeat(starts + sizes, sizes) - np.arange(users.size)
+    keep = from_end <= MAX_PER_USER
+    return users[keep], pieces[keep]
+
+
+def _groups(keys):
+    """(start, size) of each run of equal values in a sorted array."""
+    if not keys.size:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return starts, np.diff(np.r_[starts, keys.size])
+
+
+class NeighborTable:
+    """
+    Item-item neighbors as dense arrays over piece indexes:
+    piece_ids[i] is the ArtPiece.id of index i; nbr[i] holds up to M
+    neighbor indexes best first (-1 padded) and sim[i] their similarities.
+    owner[i] is the sharer's user id once load_owners() has run, or -1 for
+    pieces that aren't active and approved (never candidates).
+    """
+
+    def __init__(self, piece_ids, nbr, sim):
+        self.piece_ids = np.asarray(piece_ids, dtype=np.int64)
+        self.nbr = nbr
+        self.sim = sim
+        self.owner = np.full(self.piece_ids.size, -1, np.int64)
+        size = int(self.piece_ids.max()) + 1 if self.piece_ids.size else 1
+        self.index = np.full(size, -1, np.int64)
+        self.index[self.piece_ids] = np.arange(self.piece_ids.size)
+
+    def indexes(self, piece_ids):
+        """Index of each piece id, -1 for pieces the table doesn't know."""
+        piece_ids = np.asarray(piece_ids, dtype=np.int64)
+        out = np.full(piece_ids.shape, -1, np.int64)
+        known = piece_ids < self.index.size
+        out[known] = self.index[piece_ids[known]]
+        return out
+
+    def load_owners(self) -> "NeighborTable":
+        pool = _pairs(ArtPiece.active.filter(approved_status=True).values_list("id", "user_id"))
+        idx = self.indexes(pool[:, 0])
+        self.owner[idx[idx >= 0]] = pool[idx >= 0, 1]
+        return self
+
+    @classmethod
+    def from_db(cls) -> "NeighborTable":
+        rows = [
+            (art_piece_id, *_unpack(ids, scores))
+            for art_piece_id, ids, scores in ArtPieceNeighbors.objects.values_list(
+                "art_piece_id", "neighbor_ids", "scores").iterator()
+        ]
+        piece_ids = np.unique(np.fromiter(
+            chain.from_iterable([row[0], *row[1]] for row in rows), dtype=np.int64))
+        width = max((len(row[1]) for row in rows), default=0)
+        table = cls(piece_ids, np.full((piece_ids.size, width), -1, np.int64),
+                    np.zeros((piece_ids.size, width), np.float32))
+        for art_piece_id, ids, scores in rows:
+            i = table.index[art_piece_id]
+            table.nbr[i, :len(ids)] = table.index[ids]
+            table.sim[i, :len(ids)] = scores
+        return table
+
+
+def _cooccurrence(users, items, n_items):
+    """Sparse co-occurrence counts as (i * n_items + j keys, counts), i != j."""
+    starts, sizes = _groups(users)
+    cost = np.cumsum(sizes * sizes)
+    acc_keys, acc_counts = [], []
+
+    def merge():
+        keys = np.concatenate(acc_keys)
+        counts = np.concatenate(acc_counts)
+        uk, inv = np.unique(keys, return_inverse=True)
+        acc_keys[:], acc_counts[:] = [uk], [np.bincount(inv, weights=counts)]
+
+    g0 = 0
+    while g0 < starts.size:
+        g1 = max(g0 + 1, int(np.searchsorted(cost, (cost[g0 - 1] if g0 else 0) + _PAIR_BUDGET)))
+        st, sz = starts[g0:g1], sizes[g0:g1]
+        entry_size = np.repeat(sz, sz)
+        a = np.repeat(np.arange(st[0], st[-1] + sz[-1]), entry_size)
+        offs = np.arange(a.size) - np.repeat(np.cumsum(entry_size) - entry_size, entry_size)
+        b = np.repeat(np.repeat(st, sz), entry_size) + offs
+        keep = a != b
+        keys, counts = np.unique(items[a[keep]] * n_items + items[b[keep]], return_counts=True)
+        acc_keys.append(keys)
+        acc_counts.append(counts.astype(np.float64))
+        if sum(k.size for k in acc_keys) > _PAIR_BUDGET:
+            merge()
+        g0 = g1
+
+    if not acc_keys:
+        return np.empty(0, np.int64), np.empty(0, np.float64)
+    merge()
+    return acc_keys[0], acc_counts[0]
+
+
+def _top_per_group(groups, values, k):
+    """Positions of the k largest values within each group, best first."""
+    order = np.lexsort((-values, groups))
+    starts, sizes = _groups(groups[order])
+    rank = np.arange(order.size) - np.repeat(starts, sizes)
+    return order[rank < k]
+
+
+def build_neighbors(users, pieces, *, top_neighbors: int = TOP_NEIGHBORS, store: bool = True) -> NeighborTable:
+    """
+    Cosine similarity between pieces over the users who interacted with
+    both, keeping each piece's top_neighbors. store=True replaces the
+    ArtPieceNeighbors table with the result in one transaction, so readers
+    see the old table until the new one is complete and a failure partway
+    leaves the old one in place.
+    """
+    piece_ids, items = np.unique(pieces, return_inverse=True)
+    n = piece_ids.size
+    keys, counts = _cooccurrence(users, items, n)
+    degree = np.bincount(items, minlength=n).astype(np.float64)
+    i, j = keys // n, keys % n
+    sim = counts / np.sqrt(degree[i] * degree[j]) if keys.size else counts
+
+    top = _top_per_group(i, sim, top_neighbors)
+    i, j, sim = i[top], j[top], sim[top]
+    starts, sizes = _groups(i)
+    col = np.arange(i.size) - np.repeat(starts, sizes)
+    width = int(sizes.max()) if sizes.size else 0
+    nbr = np.full((n, width), -1, np.int64)
+    sims = np.zeros((n, width), np.float32)
+    nbr[i, col], sims[i, col] = j, sim
+
+    table = NeighborTable(piece_ids, nbr, sims)
+    if store:
+        with transaction.atomic():
+            ArtPieceNeighbors.objects.all().delete()
+            ArtPieceNeighbors.objects.bulk_create([
+                ArtPieceNeighbors(
+                    art_piece_id=int(piece_ids[row]),
+                    neighbor_ids=piece_ids[nbr[row, :size]].astype("<i4").tobytes(),
+                    scores=sims[row, :size].astype("<f4").tobytes(),
+                )
+                for row, size in zip(i[starts].tolist(), sizes.tolist())
+            ], batch_size=1000)
+    return table
+
+
+def _score_chunk(table, user_ids, users, pieces, *, top_k):
+    """
+    Rank candidates for one batch of users: sum of neighbor similarities
+    over everything they interacted with, minus those pieces themselves,
+    their own pieces, anything already sent, and anything not active and
+    approved. Returns {user_id: (piece_ids, scores)} for every user_id.
+    """
+    lists = {user_id: ([], []) for user_id in user_ids}
+    if not table.nbr.size or not users.size:
+        return lists
+    n = table.piece_ids.size
+    local = {user_id: u for u, user_id in enumerate(user_ids)}
+    owner = table.owner
+
+    eu = np.fromiter((local[x] for x in users.tolist()), np.int64, users.size)
+    ei = table.indexes(pieces)
+    eu, ei = eu[ei >= 0], ei[ei >= 0]
+
+    cand = table.nbr[ei].ravel()
+    weight = table.sim[ei].ravel()
+    cu = np.repeat(eu, table.nbr.shape[1])
+    ok = cand >= 0
+    cand, weight, cu = cand[ok], weight[ok], cu[ok]
+    ok = owner[cand] >= 0  # active, approved
+    cand, weight, cu = cand[ok], weight[ok], cu[ok]
+
+    keys, inv = np.unique(cu * n + cand, return_inverse=True)
+    score = np.bincount(inv, weights=weight)
+    cu, cand = keys // n, keys % n
+
+    seen = [eu * n + ei]
+    bitmaps = received_bitmaps(user_ids)
+    for u, user_id in enumerate(user_ids):
+        bits = bitmaps[user_id].to_bytes()
+        if bits:
+            sent = np.flatnonzero(np.unpackbits(np.frombuffer(bits, np.uint8), bitorder="little"))
+            sent = table.indexes(sent)
+            seen.append(u * n + sent[sent >= 0])
+    ok = ~np.isin(keys, np.concatenate(seen))
+    ok &= owner[cand] != np.asarray(user_ids, dtype=np.int64)[cu]
+    cu, cand, score = cu[ok], cand[ok], score[ok]
+
+    top = _top_per_group(cu, score, top_k)
+    for u, c, s in zip(cu[top].tolist(), table.piece_ids[cand[top]].tolist(), score[top].tolist()):
+        lists[user_ids[u]][0].append(c)
+        lists[user_ids[u]][1].append(s)
+    return lists
+
+
+def _store(lists):
+    ArtCandidateList.objects.bulk_create(
+        [ArtCandidateList(
+            user_id=user_id,
+            piece_ids=np.asarray(ids, dtype="<i4").tobytes(),
+            scores=np.asarray(scores, dtype="<f4").tobytes(),
+            stale=False,
+        ) for user_id, (ids, scores) in lists.items()],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["piece_ids", "scores", "stale", "updated_at"],
+    )
+    return len(lists)
+
+
+def build_recommendations(
+    *,
+    include_comments: Optional[bool] = None,
+    top_k: int = TOP_K,
+    top_neighbors: int = TOP_NEIGHBORS,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    Full rebuild: load every interaction once, recompute item neighbors,
+    then rank candidates for every user with interactions, chunk by chunk.
+    Lists of users who no longer have any interactions are dropped.
+    Returns the number of candidate lists written.
+    """
+    started = timezone.now()
+    users, pieces = load_interactions(include_comments=include_comments)
+    table = build_neighbors(users, pieces, top_neighbors=top_neighbors).load_owners()
+
+    written = 0
+    starts, sizes = _groups(users)
+    for g in range(0, starts.size, chunk_size):
+        st, sz = starts[g:g + chunk_size], sizes[g:g + chunk_size]
+        lo, hi = st[0], st[-1] + sz[-1]
+        written += _store(_score_chunk(
+            table, users[st].tolist(), users[lo:hi], pieces[lo:hi], top_k=top_k))
+
+    ArtCandidateList.objects.filter(updated_at__lt=started).delete()
+    return written
+
+
+def refresh_recommendations(
+    *,
+    include_comments: Optional[bool] = None,
+    top_k: int = TOP_K,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> int:
+    """
+    Incremental refresh against the stored neighbors: rescore users whose
+    list is marked stale (their likes changed) and users with likes but no
+    list yet. Neighbors themselves only change on a full build.
+    """
+    stale = ArtCandidateList.objects.filter(stale=True).values_list("user_id", flat=True)
+    new = (Like.objects.filter(user__art_candidates__isnull=True)
+           .values_list("user_id", flat=True).distinct())
+    user_ids = sorted(set(stale.iterator()) | set(new.iterator()))
+    if not user_ids:
+        return 0
+
+    table = NeighborTable.from_db().load_owners()
+    written = 0
+    ids = iter(user_ids)
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if not chunk:
+            return written
+        users, pieces = load_interactions(user_ids=chunk, include_comments=include_comments)
+        written += _store(_score_chunk(table, chunk, users, pieces, top_k=top_k))
+
+
+def candidate_lists(user_ids: Iterable[int]) -> dict[int, list[tuple[int, float]]]:
+    """{user_id: [(piece_id, score), ...] best first} in one query; users without a list are absent."""
+    return {
+        user_id: list(zip(*_unpack(ids, scores)))
+        for user_id, ids, scores in ArtCandidateList.objects.filter(
+            user_id__in=list(user_ids)).values_list("user_id", "piece_ids", "scores")
+    }
+
+
+def pick_candidate(candidates, *, allowed, rng=random) -> Optional[int]:
+    """
+    Score-weighted pick among the SERVE_WINDOW best candidates that pass
+    allowed(piece_id), so users see variety rather than the same top hit.
+    """
+    window = []
+    for piece_id, score in candidates:
+        if allowed(piece_id):
+            window.append((piece_id, score))
+            if len(window) >= SERVE_WINDOW:
+                break
+    if not window:
+        return None
+    return rng.choices([p for p, _ in window], weights=[max(s, 1e-6) for _, s in window])[0]
+
+
+def recommended_piece(user: CustomUser, *, rng=random) -> Optional[ArtPiece]:
+    """
+    A piece from the user's precomputed candidate list, or None (no list,
+    nothing still valid, or the ART_RECOMMENDATION_RATE coin chose uniform
+    exploration this time). Three queries: the list, the received bitmap and
+    the window of candidate pieces.
+    """
+    if rng.random() >= _rate():
+        return None
+    candidates = candidate_lists([user.id]).get(user.id)
+    if not candidates:
+        return None
+
+    received = received_bitmap(user.id)
+    fresh = [(piece_id, score) for piece_id, score in candidates if piece_id not in received]
+    pieces = ArtPiece.active.filter(
+        approved_status=True, id__in=[piece_id for piece_id, _ in fresh[:SERVE_WINDOW * 2]],
+    ).exclude(user=user).select_related("user").in_bulk()
+    piece_id = pick_candidate(fresh, allowed=pieces.__contains__, rng=rng)
+    return pieces.get(piece_id)
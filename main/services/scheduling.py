@@ -0,0 +1,134 @@
+# main/services/scheduling.py
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import CustomUser
+from main.notifications_email import send_shared_art_email
+from main.services.metrics import phase
+from main.services.outbox import queue_emails
+from main.services.sharing import persist_weekly_share
+from main.views import choose_art_piece
+
+
+__all__ = ["next_delivery_after", "schedule_unscheduled", "deliver_due"]
+
+logger = logging.getLogger(__name__)
+
+# How long a tick holds a claimed user before another tick may retry them
+CLAIM_LEASE = timedelta(minutes=30)
+
+
+def _cadence():
+    return timedelta(days=getattr(settings, "ART_DELIVERY_CADENCE_DAYS", 7))
+
+
+def _user_tz(user):
+    try:
+        return ZoneInfo(user.timezone) if user.timezone else dt_timezone.utc
+    except (ZoneInfoNotFoundError, ValueError):
+        return dt_timezone.utc
+
+
+def _local_slot(user, day: datetime) -> datetime:
+    """
+    ART_DELIVERY_LOCAL_HOUR on day's local date, in UTC. The minute comes
+    from the user id so a timezone's users don't all land on :00.
+    """
+    hour = getattr(settings, "ART_DELIVERY_LOCAL_HOUR", 9)
+    local = day.astimezone(_user_tz(user)).replace(
+        hour=hour, minute=user.id % 60, second=0, microsecond=0)
+    return local.astimezone(dt_timezone.utc)
+
+
+def next_delivery_after(user: CustomUser, *, after: datetime, cadence: Optional[timedelta] = None) -> datetime:
+    """
+    First local delivery slot on or after `after + cadence`.
+    cadence=timedelta(0) gives the next slot from `after` itself.
+    """
+    earliest = after + (_cadence() if cadence is None else cadence)
+    slot = _local_slot(user, earliest)
+    if slot < earliest:
+        slot = _local_slot(user, earliest + timedelta(days=1))
+    return slot
+
+
+def schedule_unscheduled(*, now: Optional[datetime] = None, limit: int = 500) -> int:
+    """
+    Give users without a next_delivery_at one: a cadence after their last
+    delivery, or the next local slot if they've never had one or are overdue.
+    """
+    now = now or timezone.now()
+    users = list(CustomUser.objects.filter(
+        next_delivery_at__isnull=True).order_by("id")[:limit])
+    for u in users:
+        due = next_delivery_after(u, after=now, cadence=timedelta(0))
+        if u.last_art_sent_at:
+            due = max(due, next_delivery_after(u, after=u.last_art_sent_at))
+        u.next_delivery_at = due
+    CustomUser.objects.bulk_update(users, ["next_delivery_at"])
+    return len(users)
+
+
+def deliver_due(*, now: Optional[datetime] = None, batch_size: Optional[int] = None, connection=None) -> dict:
+    """
+    One scheduler tick: share with at most batch_size users whose
+    next_delivery_at has passed, oldest first, then move each one a cadence on.
+
+    Each user is claimed with a conditional UPDATE that pushes
+    next_delivery_at out by CLAIM_LEASE, so overlapping ticks never deliver
+    to the same user twice; a user whose share fails is retried once the
+    lease runs out. The share and the move to the next slot commit
+    together; if the email then fails it goes to the outbox to be retried
+    there, so a bad address can't earn the user a new piece every lease.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, "ART_DELIVERY_TICK_BATCH", 200)
+    counts = {"sent": 0, "skipped": 0, "failed": 0, "scheduled": 0, "email_queued": 0}
+
+    counts["scheduled"] = schedule_unscheduled(now=now, limit=batch_size)
+
+    due = CustomUser.objects.filter(
+        receive_art_paused=False, next_delivery_at__lte=now,
+    ).order_by("next_delivery_at")[:batch_size]
+
+    for u in due:
+        claimed = CustomUser.objects.filter(
+            pk=u.pk, next_delivery_at=u.next_delivery_at,
+        ).update(next_delivery_at=now + CLAIM_LEASE)
+        if not claimed:
+            continue
+
+        try:
+            with phase("select"):
+                art = choose_art_piece(u)
+            sent_at = timezone.now()
+            fields = {"next_delivery_at": next_delivery_after(u, after=sent_at)}
+            with transaction.atomic():
+                if art:
+                    n = persist_weekly_share(user=u, art=art)
+                    fields["last_art_sent_at"] = sent_at
+                CustomUser.objects.filter(pk=u.pk).update(**fields)
+        except Exception:
+            logger.exception("scheduled_share_failed", extra={"user_id": u.id})
+            counts["failed"] += 1
+            continue
+        counts["sent" if art else "skipped"] += 1
+        if not art:
+            continue
+
+        try:
+            send_shared_art_email(recipient=u, sender=art.user, art_piece=art,
+                                  notification_id=n.id, connection=connection)
+        except Exception:
+            logger.warning("scheduled_email_failed", exc_info=True, extra={"user_id": u.id})
+            queue_emails([n])
+            counts["email_queued"] += 1
+
+    return counts
@@ -0,0 +1,341 @@
+# main/services/selection.py
+from __future__ import annotations
+
+import math
+import random
+from typing import Iterable, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, QuerySet, Window
+from django.db.models.functions import RowNumber
+
+from main.models import ArtPiece, SentArtPiece, CustomUser
+from main.services.alias import AliasTable
+from main.services.received import received_bitmap
+
+
+__all__ = [
+    "eligible_art_pieces",
+    "sample_art_piece_id",
+    "sample_unreceived_id",
+    "sample_art_piece",
+    "recent_sharers",
+    "sharer_pool",
+    "draw_sharers",
+    "sample_diverse_piece",
+    "welcome_pool",
+    "invalidate_welcome_pool",
+    "sample_welcome_piece",
+]
+
+# Pool ids fetched per probe when filtering against the received bitmap,
+# and how many we look at before handing over to the anti-join query.
+_SCAN_BATCH = 64
+_MAX_SCAN = 512
+# A keyed-random pick lands on the piece after the pivot, so a piece that
+# follows k ineligible ids is k+1 times as likely as one that doesn't. Past
+# this many skipped ids the pick is redone exactly, which caps that bias.
+_MAX_GAP = 32
+
+# Cached alias table for the welcome pool, and redraws before exact fallback
+_WELCOME_CACHE_KEY = "main:welcome_pool"
+_WELCOME_CACHE_TTL = 60 * 60
+_WELCOME_REJECT_TRIES = 32
+
+# Cached alias table over sharers, and sharers drawn before going uniform
+_SHARER_CACHE_KEY = "main:sharer_pool"
+_SHARER_CACHE_TTL = 10 * 60
+_SHARER_TRIES = 8
+
+
+def _diverse() -> bool:
+    return getattr(settings, "ART_SELECTION_MODE", "uniform") == "diverse"
+
+
+def _recent_window() -> int:
+    return getattr(settings, "ART_DIVERSITY_RECENT", 3)
+
+
+def eligible_art_pieces(user: CustomUser, *, welcome: bool = False) -> QuerySet:
+    """
+    Active pieces the user didn't submit and hasn't been sent yet.
+    welcome=True narrows to the curated welcome pool instead of approved art.
+
+    The "already sent" check is a NOT EXISTS anti-join against the
+    (user, art_piece) unique index rather than NOT IN over a subquery.
+    """
+    if welcome:
+        qs = ArtPiece.active.filter(welcome_eligible=True)
+    else:
+        qs = ArtPiece.active.filter(approved_status=True)
+
+    already_sent = SentArtPiece.objects.filter(
+        user=user, art_piece=OuterRef("pk"))
+    return qs.exclude(user=user).filter(~Exists(already_sent))
+
+
+def sample_art_piece_id(qs: QuerySet) -> Optional[int]:
+    """
+    Keyed-random pick: draw a pivot in the id range, take the first eligible id
+    at or after it, wrapping to the lowest eligible id. Each probe is an
+    ordered primary-key scan with LIMIT 1, so cost doesn't grow with the pool.
+
+    A piece's chance grows with the run of ineligible ids before it (unsent
+    but unapproved, deleted or already received pieces), up to _MAX_GAP + 1
+    times the chance of a piece with an eligible neighbour. When the pivot
+    lands further than _MAX_GAP ids from the pick, a COUNT/OFFSET pick over
+    the whole queryset replaces it.
+    """
+    bounds = _id_bounds()
+    if bounds is None:
+        return None
+    pivot = random.randint(*bounds)
+
+    ids = qs.order_by("id").values_list("id", flat=True)
+    hit = ids.filter(id__gte=pivot).first() or ids.filter(id__lt=pivot).first()
+    if hit is None or _gap(pivot, hit, bounds) <= _MAX_GAP:
+        return hit
+    return _exact_pick(ids)
+
+
+def _exact_pick(ids: QuerySet) -> Optional[int]:
+    """Uniform over an ordered id queryset; scans it, so only as a fallback."""
+    n = ids.count()
+    return ids[random.randrange(n)] if n else None
+
+
+def _gap(pivot, hit, bounds) -> int:
+    """Ids skipped walking from pivot to hit, wrapping past the top of the range."""
+    lo, hi = bounds
+    return hit - pivot if hit >= pivot else (hi - pivot) + (hit - lo) + 1
+
+
+def sample_unreceived_id(user: CustomUser) -> Optional[int]:
+    """
+    Same keyed-random walk as sample_art_piece_id, but the "already sent"
+    check happens in memory against the user's received bitmap, so the pool
+    query never touches SentArtPiece. When the walk skips more than _MAX_GAP
+    ids (long received runs, or a sparse pool) the pick is redone exactly
+    with the anti-join, which also bounds the scan.
+    """
+    bounds = _id_bounds()
+    if bounds is None:
+        return None
+    pivot = random.randint(*bounds)
+
+    received = received_bitmap(user.id)
+    pool = ArtPiece.active.filter(approved_status=True).exclude(
+        user=user).order_by("id").values_list("id", flat=True)
+
+    scanned = 0
+    for segment in (pool.filter(id__gte=pivot), pool.filter(id__lt=pivot)):
+        after = None
+        while scanned < _MAX_SCAN:
+            page = segment if after is None else segment.filter(id__gt=after)
+            batch = list(page[:_SCAN_BATCH])
+            scanned += len(batch)
+            for piece_id in batch:
+                if piece_id not in received:
+                    if _gap(pivot, piece_id, bounds) <= _MAX_GAP:
+                        return piece_id
+                    return _exact_unreceived(user)
+            if len(batch) < _SCAN_BATCH:
+                break
+            after = batch[-1]
+
+    if scanned >= _MAX_SCAN:
+        return _exact_unreceived(user)
+    return None
+
+
+def _exact_unreceived(user):
+    return _exact_pick(eligible_art_pieces(user).order_by("id").values_list("id", flat=True))
+
+
+def sample_art_piece(user: CustomUser, *, welcome: bool = False) -> Optional[ArtPiece]:
+    if welcome:
+        piece_id = sample_art_piece_id(eligible_art_pieces(user, welcome=True))
+    elif _diverse():
+        return sample_diverse_piece(user)
+    else:
+        piece_id = sample_unreceived_id(user)
+    if piece_id is None:
+        return None
+    return ArtPiece.objects.select_related("user").get(pk=piece_id)
+
+
+def recent_sharers(user_ids: Iterable[int], *, last: Optional[int] = None) -> dict[int, set[int]]:
+    """
+    {user_id: sharer ids of that user's `last` most recent deliveries} in one
+    query, served by the (user, -sent_time) index.
+    """
+    last = _recent_window() if last is None else last
+    found = {user_id: set() for user_id in user_ids}
+    if not last or not found:
+        return found
+    rows = SentArtPiece.objects.filter(user_id__in=list(found)).annotate(
+        recency=Window(RowNumber(), partition_by=F("user_id"), order_by=F("sent_time").desc()),
+    ).filter(recency__lte=last).values_list("user_id", "art_piece__user_id")
+    for user_id, sharer_id in rows:
+        found[user_id].add(sharer_id)
+    return found
+
+
+def sharer_pool() -> dict:
+    """
+    Sharers with active approved art and an AliasTable over them, weighted
+    by the square root of their piece count so prolific sharers still come
+    up more often, just not in proportion. Cached for _SHARER_CACHE_TTL;
+    a stale entry only costs a wasted draw.
+    """
+    pool = cache.get(_SHARER_CACHE_KEY)
+    if pool is None:
+        rows = list(ArtPiece.active.filter(approved_status=True)
+                    .values("user_id").annotate(n=Count("id"))
+                    .order_by("user_id").values_list("user_id", "n"))
+        weights = [math.sqrt(n) for _, n in rows]
+        pool = {
+            "sharer_ids": [sharer_id for sharer_id, _ in rows],
+            "weights": weights,
+            "table": AliasTable(weights) if rows else None,
+        }
+        cache.set(_SHARER_CACHE_KEY, pool, _SHARER_CACHE_TTL)
+    return pool
+
+
+def _sample_from_sharer(sharer_id, received, rng) -> Optional[int]:
+    """An unreceived approved piece of one sharer: at most two short indexed probes."""
+    pivot = _random_pivot() or 1
+    pieces = ArtPiece.active.filter(
+        approved_status=True, user_id=sharer_id).order_by("id").values_list("id", flat=True)
+    for segment in (pieces.filter(id__gte=pivot), pieces.filter(id__lt=pivot)):
+        fresh = [piece_id for piece_id in segment[:_SCAN_BATCH] if piece_id not in received]
+        if fresh:
+            return rng.choice(fresh)
+    return None
+
+
+def draw_sharers(pool, skip, rng):
+    """
+    Yield weighted sharer draws not in `skip` (which the caller may grow):
+    alias-table draws first, then exact draws over what's left, at most
+    _SHARER_TRIES of each.
+    """
+    sharer_ids, weights = pool["sharer_ids"], pool["weights"]
+    for _ in range(_SHARER_TRIES):
+        sharer_id = sharer_ids[pool["table"].sample(rng)]
+        if sharer_id not in skip:
+            yield sharer_id
+    for _ in range(_SHARER_TRIES):
+        rest = [i for i, sharer_id in enumerate(sharer_ids) if sharer_id not in skip]
+        if not rest:
+            return
+        yield sharer_ids[rng.choices(rest, weights=[weights[i] for i in rest])[0]]
+
+
+def sample_diverse_piece(user: CustomUser, *, last: Optional[int] = None, rng=random) -> Optional[ArtPiece]:
+    """
+    Pick a sharer first (sharer_pool weights), skipping the user and the
+    sharers of their `last` most recent deliveries, then one of that
+    sharer's pieces the user hasn't had. A sharer with nothing left for the
+    user is skipped from then on.
+
+    Draws come from the alias table while they mostly land; after
+    _SHARER_TRIES misses the remaining sharers are drawn from exactly. If
+    that finds nothing either, selection falls back to uniform, recent
+    sharers included.
+    """
+    pool = sharer_pool()
+    if not pool["sharer_ids"]:
+        return None
+
+    skip = recent_sharers([user.id], last=last)[user.id] | {user.id}
+    received = received_bitmap(user.id)
+    for sharer_id in draw_sharers(pool, skip, rng):
+        piece_id = _sample_from_sharer(sharer_id, received, rng)
+        if piece_id is not None:
+            return ArtPiece.objects.select_related("user").get(pk=piece_id)
+        skip.add(sharer_id)
+
+    piece_id = sample_unreceived_id(user)
+    return ArtPiece.objects.select_related("user").get(pk=piece_id) if piece_id else None
+
+
+def welcome_pool() -> dict:
+    """
+    The curated welcome pool as parallel lists (ids, owners, weights) plus an
+    AliasTable over the weights, cached until invalidate_welcome_pool() runs
+    (signals on welcome_eligible / welcome_weight / is_deleted changes) or
+    the TTL lapses.
+    """
+    pool = cache.get(_WELCOME_CACHE_KEY)
+    if pool is None:
+        rows = list(ArtPiece.active.filter(welcome_eligible=True)
+                    .order_by("id").values_list("id", "user_id", "welcome_weight"))
+        weights = [max(1, w) for _, _, w in rows]
+        pool = {
+            "ids": [piece_id for piece_id, _, _ in rows],
+            "owners": [owner_id for _, owner_id, _ in rows],
+            "weights": weights,
+            "table": AliasTable(weights) if rows else None,
+        }
+        cache.set(_WELCOME_CACHE_KEY, pool, _WELCOME_CACHE_TTL)
+    return pool
+
+
+def invalidate_welcome_pool() -> None:
+    cache.delete(_WELCOME_CACHE_KEY)
+
+
+def sample_welcome_piece(user: CustomUser, *, rng=random) -> Optional[ArtPiece]:
+    """
+    Weighted pick (welcome_weight, minimum 1) from the cached welcome pool,
+    minus the user's own pieces and what they already have.
+
+    Exclusion is by rejection: redraw from the alias table up to
+    _WELCOME_REJECT_TRIES times, then pick exactly over whatever is left.
+    A drawn piece that no longer qualifies means the cached table is stale
+    (changed in another process), so it's rebuilt and we draw once more.
+
+    In "diverse" ART_SELECTION_MODE, pieces from the sharers of the user's
+    most recent deliveries are avoided too, unless nothing else is left.
+    """
+    received = received_bitmap(user.id)
+    avoid = recent_sharers([user.id])[user.id] if _diverse() else set()
+    for _ in range(2):
+        pool = welcome_pool()
+        ids, owners, weights = pool["ids"], pool["owners"], pool["weights"]
+        if not ids:
+            return None
+
+        def allowed(i, avoid=avoid):
+            return owners[i] != user.id and owners[i] not in avoid and ids[i] not in received
+
+        for _ in range(_WELCOME_REJECT_TRIES):
+            i = pool["table"].sample(rng)
+            if allowed(i):
+                break
+        else:
+            rest = ([i for i in range(len(ids)) if allowed(i)]
+                    or [i for i in range(len(ids)) if allowed(i, avoid=())])
+            if not rest:
+                return None
+            i = rng.choices(rest, weights=[weights[j] for j in rest])[0]
+
+        art = ArtPiece.active.filter(
+            pk=ids[i], welcome_eligible=True).select_related("user").first()
+        if art is not None:
+            return art
+        invalidate_welcome_pool()
+    return None
+
+
+def _id_bounds() -> Optional[tuple[int, int]]:
+    """Lowest and highest ArtPiece id (both ends of the primary key index)."""
+    bounds = ArtPiece.objects.aggregate(lo=Min("id"), hi=Max("id"))
+    return None if bounds["hi"] is None else (bounds["lo"], bounds["hi"])
+
+
+def _random_pivot() -> Optional[int]:
+    bounds = _id_bounds()
+    return random.randint(*bounds) if bounds else None
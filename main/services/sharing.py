@@ -1,18 +1,71 @@
 # main/services/sharing.py
 from __future__ import annotations
 
+import logging
 import random
-from typing import Optional
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+from celery.exceptions import SoftTimeLimitExceeded
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.conf import settings
 
 from main.models import ArtPiece, SentArtPiece, Notification, CustomUser
-from main.notifications_email import send_shared_art_email
+from main.notifications_email import send_shared_art_email, shared_art_fan_out
+from main.services.alias import AliasTable
+from main.services.metrics import phase, record_failure
+from main.services.outbox import queue_emails
+from main.services.received import mark_received, received_bitmaps
+from main.services.recommend import candidate_lists, pick_candidate
+from main.services.selection import draw_sharers, recent_sharers
 from main.views import choose_art_piece
 
 
-__all__ = ["share_weekly_to_user"]
+__all__ = [
+    "share_weekly_to_user",
+    "share_weekly_bulk",
+    "write_weekly_shares",
+    "weekly_shards",
+    "share_weekly_range",
+    "share_piece_with_users",
+]
+
+logger = logging.getLogger(__name__)
+
+# How many users the bulk engine plans and writes per round trip
+DEFAULT_CHUNK_SIZE = 500
+
+# Recipients written per transaction by share_piece_with_users
+MANUAL_CHUNK_SIZE = 1000
+
+# Random draws from the pool before falling back to an explicit diff
+_REJECTION_TRIES = 8
+
+
+def shared_art_message(sharer) -> str:
+    return f"🎁 {sharer.first_name} {sharer.last_name} shared some art with you!"
+
+
+def persist_weekly_share(*, user: CustomUser, art: ArtPiece) -> Notification:
+    """
+    Idempotent DB half of a weekly share: SentArtPiece(source='weekly') plus
+    its shared_art Notification. Call inside a transaction.
+    """
+    SentArtPiece.objects.get_or_create(
+        user=user, art_piece=art, defaults={"source": "weekly"}
+    )
+    n, _ = Notification.objects.get_or_create(
+        recipient=user,
+        sender=art.user,
+        notification_type="shared_art",
+        art_piece=art,
+        defaults={
+            "message": shared_art_message(art.user)
+        },
+    )
+    return n
 
 
 def share_weekly_to_user(*, user: CustomUser, dry_run: bool = False, connection=None) -> Optional[ArtPiece]:
@@ -27,7 +80,8 @@ def share_weekly_to_user(*, user: CustomUser, dry_run: bool = False, connection=
     if getattr(user, "receive_art_paused", False) is True:
         return None
 
-    art = choose_art_piece(user)
+    with phase("select"):
+        art = choose_art_piece(user)
     if not art:
         return None
 
@@ -35,19 +89,8 @@ def share_weekly_to_user(*, user: CustomUser, dry_run: bool = False, connection=
         return art
 
     # Write models idempotently and then send
-    with transaction.atomic():
-        sent_row, _ = SentArtPiece.objects.get_or_create(
-            user=user, art_piece=art, defaults={"source": "weekly"}
-        )
-        n, _ = Notification.objects.get_or_create(
-            recipient=user,
-            sender=art.user,
-            notification_type="shared_art",
-            art_piece=art,
-            defaults={
-                "message": f"🎁 {art.user.first_name} {art.user.last_name} shared some art with you!"
-            },
-        )
+    with phase("persist"), transaction.atomic():
+        n = persist_weekly_share(user=user, art=art)
 
     # Respect email preference inside the mail helper
     send_shared_art_email(
@@ -59,3 +102,332 @@ def share_weekly_to_user(*, user: CustomUser, dry_run: bool = False, connection=
     )
 
     return art
+
+
+def share_weekly_bulk(
+    users: Iterable[CustomUser],
+    *,
+    dry_run: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    connection=None,
+    rng: Optional[random.Random] = None,
+    enqueue=None,
+) -> Iterator[tuple[CustomUser, Optional[ArtPiece]]]:
+    """
+    Set-based version of share_weekly_to_user for a whole cohort.
+
+    Users are consumed in chunks; each chunk costs a fixed number of queries
+    (received pairs, eligible pool, chosen pieces, bulk writes) no matter how
+    many users it holds. Yields (user, ArtPiece | None) in input order, after
+    that chunk's rows are committed and its emails sent.
+
+    Pass a queryset's .iterator(chunk_size=...) to keep memory flat.
+    Pass a seeded rng (with users in a stable order) to make picks reproducible.
+    Pass enqueue to hand emails to a task queue instead (see write_weekly_shares).
+    """
+    rng = rng or random.Random()
+    it = iter(users)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield from _share_weekly_chunk(
+            chunk, dry_run=dry_run, connection=connection, rng=rng, enqueue=enqueue)
+
+
+def _share_weekly_chunk(chunk, *, dry_run, connection, rng, enqueue=None):
+    # Same guard as the per-user path
+    users = [u for u in chunk if getattr(u, "receive_art_paused", False) is not True]
+    user_ids = [u.id for u in users]
+
+    with phase("select"):
+        received = received_bitmaps(user_ids)
+
+        pool = list(
+            ArtPiece.active.filter(approved_status=True)
+            .order_by("id").values_list("id", "user_id")
+        )
+
+        owners = dict(pool)
+        candidates = candidate_lists(user_ids)
+        rate = getattr(settings, "ART_RECOMMENDATION_RATE", 0.0)
+        sharers = None
+        if getattr(settings, "ART_SELECTION_MODE", "uniform") == "diverse":
+            sharers = _SharerPool(pool)
+            recent = recent_sharers(user_ids)
+
+        chosen_ids = {}
+        for u in users:
+            piece_id = None
+            # Same split as choose_art_piece: mostly recommendations, some exploration
+            if u.id in candidates and rng.random() < rate:
+                piece_id = pick_candidate(
+                    candidates[u.id], rng=rng,
+                    allowed=lambda p, u=u: owners.get(p, u.id) != u.id and p not in received[u.id])
+            if piece_id is None and sharers is not None:
+                piece_id = sharers.pick(
+                    skip=recent[u.id] | {u.id}, received=received[u.id], rng=rng)
+            if piece_id is None:
+                piece_id = _pick_from_pool(
+                    pool, user_id=u.id, received=received[u.id], rng=rng)
+            if piece_id is not None:
+                chosen_ids[u.id] = piece_id
+
+        pieces = ArtPiece.objects.select_related("user").in_bulk(set(chosen_ids.values()))
+    plan = [(u, pieces.get(chosen_ids.get(u.id))) for u in chunk]
+    pairs = [(u, art) for u, art in plan if art is not None]
+
+    if not dry_run:
+        write_weekly_shares(pairs, connection=connection, enqueue=enqueue)
+
+    yield from plan
+
+
+def write_weekly_shares(pairs, *, connection=None, enqueue=None) -> None:
+    """
+    Bulk write-and-send half of the weekly share for already-chosen
+    (user, ArtPiece) pairs; same rows and emails as share_weekly_to_user.
+    Pieces should come with select_related('user').
+
+    With enqueue, nothing is sent here: once the rows commit,
+    enqueue("shared_art", notification_ids) is called for the recipients who
+    want the email (e.g. tasks.enqueue_notification_emails).
+    """
+    if not pairs:
+        return
+
+    with phase("persist"), transaction.atomic():
+        # ignore_conflicts makes this the bulk twin of get_or_create on the
+        # (user, art_piece) unique constraint.
+        SentArtPiece.objects.bulk_create(
+            [SentArtPiece(user=u, art_piece=art, source="weekly") for u, art in pairs],
+            ignore_conflicts=True,
+        )
+        # bulk_create skips post_save, so keep the bitmaps in step by hand
+        mark_received({u.id: [art.id] for u, art in pairs})
+        notification_ids = _get_or_create_notifications(pairs)
+        if enqueue is not None:
+            wanted = [notification_ids[(u.id, art.id)]
+                      for u, art in pairs if u.email_on_art_shared]
+            if wanted:
+                transaction.on_commit(lambda: enqueue("shared_art", wanted))
+            return
+
+    # Each piece is rendered once for all of this chunk's recipients
+    fan_outs = {}
+    for u, art in pairs:
+        shared_art_fan_out(fan_outs, sender=art.user, art_piece=art).send(
+            u, notification_id=notification_ids[(u.id, art.id)], connection=connection)
+
+
+def _pick_from_pool(pool, *, user_id, received, rng):
+    """
+    Uniform pick of a piece id from pool that user_id neither owns nor has received.
+    """
+    if not pool:
+        return None
+
+    # Most users have received a small fraction of the pool, so a few blind
+    # draws almost always land; only fall back to the full diff when they don't.
+    for _ in range(_REJECTION_TRIES):
+        piece_id, owner_id = rng.choice(pool)
+        if owner_id != user_id and piece_id not in received:
+            return piece_id
+
+    eligible = [
+        piece_id for piece_id, owner_id in pool
+        if owner_id != user_id and piece_id not in received
+    ]
+    return rng.choice(eligible) if eligible else None
+
+
+class _SharerPool:
+    """
+    In-memory twin of selection.sample_diverse_piece for one chunk's pool:
+    sharer first (sqrt of piece count), then a piece of theirs.
+    """
+
+    def __init__(self, pool):
+        self.by_sharer = {}
+        for piece_id, owner_id in pool:
+            self.by_sharer.setdefault(owner_id, []).append(piece_id)
+        weights = [len(ids) ** 0.5 for ids in self.by_sharer.values()]
+        self.pool = {
+            "sharer_ids": list(self.by_sharer),
+            "weights": weights,
+            "table": AliasTable(weights) if pool else None,
+        }
+
+    def pick(self, *, skip, received, rng):
+        if self.pool["table"] is None:
+            return None
+        skip = set(skip)
+        for sharer_id in draw_sharers(self.pool, skip, rng):
+            fresh = [p for p in self.by_sharer[sharer_id] if p not in received]
+            if fresh:
+                return rng.choice(fresh)
+            skip.add(sharer_id)
+        return None
+
+
+def _get_or_create_notifications(pairs):
+    """
+    Bulk get_or_create of shared_art notifications.
+    Returns {(recipient_id, art_piece_id): notification_id}.
+    """
+    existing = {}
+    for recipient_id, sender_id, art_piece_id, n_id in Notification.objects.filter(
+        notification_type="shared_art",
+        recipient_id__in={u.id for u, _ in pairs},
+        art_piece_id__in={art.id for _, art in pairs},
+    ).values_list("recipient_id", "sender_id", "art_piece_id", "id"):
+        existing.setdefault((recipient_id, sender_id, art_piece_id), n_id)
+
+    ids = {}
+    to_create = []
+    for u, art in pairs:
+        n_id = existing.get((u.id, art.user_id, art.id))
+        if n_id is not None:
+            ids[(u.id, art.id)] = n_id
+        else:
+            to_create.append(Notification(
+                recipient=u,
+                sender=art.user,
+                notification_type="shared_art",
+                art_piece=art,
+                message=shared_art_message(art.user),
+            ))
+
+    for n in Notification.objects.bulk_create(to_create):
+        ids[(n.recipient_id, n.art_piece_id)] = n.id
+
+    return ids
+
+
+def weekly_shards(users, *, shard_size: int) -> list[tuple[int, int]]:
+    """
+    Split a user queryset into inclusive (first_id, last_id) ranges holding
+    at most shard_size users each. Only ids are streamed.
+    """
+    ids = users.order_by("id").values_list("id", flat=True).iterator(
+        chunk_size=shard_size)
+    shards = []
+    while True:
+        chunk = list(islice(ids, shard_size))
+        if not chunk:
+            return shards
+        shards.append((chunk[0], chunk[-1]))
+
+
+def share_weekly_range(
+    *,
+    first_id: int,
+    last_id: int,
+    since: Optional[datetime] = None,
+    dry_run: bool = False,
+    connection=None,
+    counts: Optional[dict] = None,
+) -> dict:
+    """
+    Run share_weekly_to_user for every non-paused user with first_id <= id <= last_id.
+
+    since: start of the run. Users who already got a weekly piece at or after
+    it are skipped, so a retried or re-dispatched shard never hands out a
+    second piece (get_or_create alone only dedupes the *same* piece).
+
+    Returns {"sent": n, "skipped": n, "failed": n}. One user's failure is
+    logged and counted, not raised. Pass counts to have them tallied in
+    place, so a caller still has the partial counts if the range is cut short.
+    """
+    if counts is None:
+        counts = {}
+    for key in ("sent", "skipped", "failed"):
+        counts.setdefault(key, 0)
+
+    users = CustomUser.objects.filter(
+        receive_art_paused=False, id__gte=first_id, id__lte=last_id,
+    ).order_by("id")
+    if since is not None:
+        users = users.annotate(already_shared=Exists(SentArtPiece.objects.filter(
+            user=OuterRef("pk"), source="weekly", sent_time__gte=since,
+        )))
+
+    for u in users.iterator():
+        if getattr(u, "already_shared", False):
+            counts["skipped"] += 1
+            continue
+        try:
+            art = share_weekly_to_user(
+                user=u, dry_run=dry_run, connection=connection)
+        except SoftTimeLimitExceeded:
+            # Out of time; the shard fails now rather than at the hard kill
+            raise
+        except Exception as exc:
+            logger.exception("weekly_share_failed", extra={"user_id": u.id})
+            record_failure(exc)
+            counts["failed"] += 1
+            continue
+        counts["sent" if art else "skipped"] += 1
+
+    return counts
+
+
+def share_piece_with_users(
+    art: ArtPiece,
+    users,
+    *,
+    chunk_size: Optional[int] = None,
+) -> dict:
+    """
+    Manual share of one piece to a whole audience (a CustomUser queryset).
+
+    Set-based twin of creating SentArtPiece(source='manual') rows one by one:
+    each chunk of recipients costs a fixed handful of queries, committed in
+    its own transaction. Paused users, the piece's owner and anyone who
+    already has the piece are skipped. bulk_create bypasses
+    create_sent_art_notification, so the Notifications and the email outbox
+    rows (for recipients who want shared-art email) are bulk-created here.
+
+    Returns {"sent": n, "skipped": n}.
+    """
+    chunk_size = chunk_size or getattr(
+        settings, "MANUAL_SHARE_CHUNK_SIZE", MANUAL_CHUNK_SIZE)
+    counts = {"sent": 0, "skipped": 0}
+
+    rows = (
+        users.filter(receive_art_paused=False).exclude(id=art.user_id)
+        .order_by("id").values_list("id", "email_on_art_shared")
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        chunk = dict(islice(rows, chunk_size))
+        if not chunk:
+            return counts
+
+        with phase("persist"), transaction.atomic():
+            already = set(SentArtPiece.objects.filter(
+                art_piece=art, user_id__in=list(chunk),
+            ).values_list("user_id", flat=True))
+            new_ids = [user_id for user_id in chunk if user_id not in already]
+            counts["skipped"] += len(already)
+            if not new_ids:
+                continue
+
+            SentArtPiece.objects.bulk_create(
+                [SentArtPiece(user_id=user_id, art_piece=art, source="manual")
+                 for user_id in new_ids],
+                ignore_conflicts=True,
+            )
+            mark_received({user_id: [art.id] for user_id in new_ids})
+            notifications = Notification.objects.bulk_create([
+                Notification(
+                    recipient_id=user_id,
+                    sender_id=art.user_id,
+                    notification_type="shared_art",
+                    art_piece=art,
+                    message=shared_art_message(art.user),
+                )
+                for user_id in new_ids
+            ])
+            queue_emails(n for n in notifications if chunk[n.recipient_id])
+            counts["sent"] += len(new_ids)
@@ -1,12 +1,11 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction
-from .tasks import (
-    send_like_email_task,
-    send_comment_email_task,
-    send_shared_art_email_task,
-)  # Celery tasks
-from .models import Like, Notification, Comment, SentArtPiece
+from .tasks import refill_art_queue_soon  # Celery tasks
+from .models import Like, Notification, Comment, SentArtPiece, CustomUser, ArtPiece, ArtCandidateList
+from .services.outbox import queue_emails
+from .services.received import mark_received, unmark_received
+from .services.selection import invalidate_welcome_pool
 
 
 @receiver(post_save, sender=Like)
@@ -31,13 +30,8 @@ def on_like_created(sender, instance, created, **kwargs):
         message=f"❤️ {liker.first_name} {liker.last_name} loved a piece you shared: {art_piece.piece_name}"
     )
 
-    # Enqueue the email AFTER the transaction commits successfully
-    transaction.on_commit(lambda: send_like_email_task.delay(
-        recipient_id=recipient.id,
-        liker_id=liker.id,
-        art_piece_id=art_piece.id,
-        notification_id=n.id,
-    ))
+    # The email goes out through the outbox, committed along with n
+    queue_emails([n])
 
 
 @receiver(post_save, sender=Comment)
@@ -64,15 +58,11 @@ def create_comment_notification(sender, instance, created, **kwargs):
         sender=sender_user,
         notification_type='comment',
         message=message,
-        art_piece=art_piece
+        art_piece=art_piece,
+        comment=instance,
     )
 
-    # enqueue email after DB commit
-    transaction.on_commit(lambda: send_comment_email_task.delay(
-        recipient_id=recipient_user.id,
-        comment_id=instance.id,
-        notification_id=n.id,
-    ))
+    queue_emails([n])
 
 
 @receiver(post_save, sender=SentArtPiece)
@@ -99,9 +89,59 @@ def create_sent_art_notification(sender, instance, created, **kwargs):
         message=f"🎁 {sender_user.first_name} {sender_user.last_name} shared some art with you!"
     )
 
-    transaction.on_commit(lambda: send_shared_art_email_task.delay(
-        recipient_id=recipient.id,
-        sender_id=sender_user.id,
-        art_piece_id=art_piece.id,
-        notification_id=n.id,
-    ))
+    queue_emails([n])
+
+
+@receiver(post_save, sender=SentArtPiece)
+def update_received_bitmap(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # Same transaction as the insert, so the bitmap never runs ahead of the row
+    mark_received({instance.user_id: [instance.art_piece_id]})
+
+
+@receiver(post_delete, sender=SentArtPiece)
+def clear_received_bit(sender, instance, **kwargs):
+    unmark_received({instance.user_id: [instance.art_piece_id]})
+
+
+@receiver(post_save, sender=CustomUser)
+def queue_art_for_new_user(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # Have a welcome piece (and reciprocal gifts) ready before they need one
+    transaction.on_commit(lambda: refill_art_queue_soon(instance.id))
+
+
+@receiver(post_save, sender=SentArtPiece)
+def refill_after_gift(sender, instance, created, **kwargs):
+    if not created or instance.source not in ("reciprocal", "welcome"):
+        return
+    transaction.on_commit(lambda: refill_art_queue_soon(instance.user_id))
+
+
+_WELCOME_POOL_FIELDS = {"welcome_eligible", "welcome_weight", "is_deleted"}
+
+
+@receiver(post_save, sender=ArtPiece)
+def refresh_welcome_pool(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not _WELCOME_POOL_FIELDS & set(update_fields):
+        return
+    if created and not instance.welcome_eligible:
+        return
+    transaction.on_commit(invalidate_welcome_pool)
+
+
+@receiver(post_delete, sender=ArtPiece)
+def drop_from_welcome_pool(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_welcome_pool)
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def mark_candidates_stale(sender, instance, created=True, **kwargs):
+    if not created:
+        return
+    # The next incremental refresh rescores this user's recommendations
+    ArtCandidateList.objects.filter(
+        user_id=instance.user_id, stale=False).update(stale=True)
@@ -1,13 +1,28 @@
-from celery import shared_task
+import logging
+from celery import shared_task, chord
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils.dateparse import parse_datetime
+from .mail import PooledConnection
 from .models import ArtPiece, Comment
 from .notifications_email import (
+    load_notifications,
     send_like_email,
     send_comment_email,
+    send_notification_email,
     send_shared_art_email,
 )
+from .services.digest import send_digests
+from .services.outbox import dispatch_outbox, outbox_backlog
+from .services.rate_limit import RateLimited, send_rate_limiter
+from .services.sharing import share_weekly_range
+from .services.scheduling import deliver_due
+from .services.art_queue import refill_queue, refill_queues
+from .services.recommend import build_recommendations, refresh_recommendations
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 @shared_task(bind=True, max_retries=3)
@@ -61,3 +76,258 @@ def send_shared_art_email_task(self, *, recipient_id, sender_id, art_piece_id, n
         )
     except Exception as exc:
         raise self.retry(exc=exc)
+
+
+def _send_notification_batch(task, notification_ids, notification_type):
+    """
+    Emails for many notifications of one type: one query loads every
+    recipient, sender, piece and comment, and all sends share one
+    connection. Only the notifications whose send failed are retried. If
+    the send-rate limiter gives up waiting, the unsent rest is re-queued
+    once the quota has refilled, without using up a retry.
+    """
+    failed, unsent, fan_outs, throttled = [], [], {}, None
+    with PooledConnection() as connection:
+        notifications = load_notifications(notification_ids, notification_type=notification_type)
+        for i, n in enumerate(notifications):
+            try:
+                send_notification_email(n, connection=connection, fan_outs=fan_outs)
+            except RateLimited as exc:
+                throttled = exc
+                unsent = [m.id for m in notifications[i:]]
+                break
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception:
+                logger.warning("notification_email_failed", exc_info=True,
+                               extra={"notification_id": n.id})
+                failed.append(n.id)
+    logger.info("notification_email_batch", extra={
+        "notification_type": notification_type,
+        "notifications": len(notification_ids), "failed": len(failed),
+        "throttled": len(unsent),
+        **{f"mail_{k}": v for k, v in connection.stats().items()},
+        **{f"rate_{k}": v for k, v in send_rate_limiter().stats().items()}})
+    if unsent:
+        # Waiting on the quota isn't a failure: the rest goes out as its own
+        # task at the same retry count, while real failures below use one up
+        task.apply_async(kwargs={"notification_ids": unsent},
+                         countdown=throttled.retry_after, retries=task.request.retries)
+    if failed:
+        raise task.retry(kwargs={"notification_ids": failed})
+    return len(notification_ids)
+
+
+@shared_task(bind=True, max_retries=3,
+             time_limit=getattr(settings, "EMAIL_TASK_BATCH_TIME_LIMIT", 120),
+             soft_time_limit=getattr(settings, "EMAIL_TASK_BATCH_SOFT_TIME_LIMIT", 110))
+def send_like_batch_task(self, *, notification_ids):
+    return _send_notification_batch(self, notification_ids, "like")
+
+
+@shared_task(bind=True, max_retries=3,
+             time_limit=getattr(settings, "EMAIL_TASK_BATCH_TIME_LIMIT", 120),
+             soft_time_limit=getattr(settings, "EMAIL_TASK_BATCH_SOFT_TIME_LIMIT", 110))
+def send_comment_batch_task(self, *, notification_ids):
+    return _send_notification_batch(self, notification_ids, "comment")
+
+
+@shared_task(bind=True, max_retries=3,
+             time_limit=getattr(settings, "EMAIL_TASK_BATCH_TIME_LIMIT", 120),
+             soft_time_limit=getattr(settings, "EMAIL_TASK_BATCH_SOFT_TIME_LIMIT", 110))
+def send_shared_art_batch_task(self, *, notification_ids):
+    return _send_notification_batch(self, notification_ids, "shared_art")
+
+
+_BATCH_TASKS = {
+    "like": send_like_batch_task,
+    "comment": send_comment_batch_task,
+    "shared_art": send_shared_art_batch_task,
+}
+
+
+def enqueue_notification_emails(notification_type, notification_ids):
+    """
+    Queue emails for notifications of one type, EMAIL_TASK_BATCH_SIZE per
+    task instead of one task per email.
+    """
+    size = getattr(settings, "EMAIL_TASK_BATCH_SIZE", 200)
+    task = _BATCH_TASKS[notification_type]
+    for i in range(0, len(notification_ids), size):
+        task.delay(notification_ids=list(notification_ids[i:i + size]))
+
+
+@shared_task(time_limit=getattr(settings, "EMAIL_OUTBOX_TIME_LIMIT", 120),
+             soft_time_limit=getattr(settings, "EMAIL_OUTBOX_SOFT_TIME_LIMIT", 110))
+def dispatch_email_outbox_task():
+    """
+    Beat-driven: send whatever the email outbox has due, over one pooled
+    connection. Overlapping runs are fine; each claims different rows.
+    """
+    with PooledConnection() as connection:
+        counts = dispatch_outbox(connection=connection)
+    if counts["batches"]:
+        logger.info("email_outbox_dispatched", extra={
+            **counts, "backlog": outbox_backlog(),
+            **{f"mail_{k}": v for k, v in connection.stats().items()},
+            **{f"rate_{k}": v for k, v in send_rate_limiter().stats().items()}})
+    return counts
+
+
+def dispatch_email_outbox_now(priority=None):
+    """
+    Run a dispatch right away instead of at the next beat tick, for emails
+    someone is waiting on; call from transaction.on_commit. Best effort:
+    if the broker can't take it, the beat tick still sends the row.
+    """
+    try:
+        dispatch_email_outbox_task.apply_async(priority=priority, retry=False)
+    except Exception:
+        logger.warning("email_outbox_kick_failed", exc_info=True)
+
+
+@shared_task(time_limit=getattr(settings, "EMAIL_DIGEST_TIME_LIMIT", 1800),
+             soft_time_limit=getattr(settings, "EMAIL_DIGEST_SOFT_TIME_LIMIT", 1770))
+def send_email_digests_task(*, frequency):
+    """Beat-driven: one like/comment digest per user on this frequency."""
+    with PooledConnection() as connection:
+        counts = send_digests(frequency, connection=connection)
+    logger.info("email_digests_sent", extra={
+        "frequency": frequency, **counts,
+        **{f"mail_{k}": v for k, v in connection.stats().items()}})
+    return counts
+
+
+def _add_counts(*results):
+    totals = {"sent": 0, "skipped": 0, "failed": 0, "shards": 0, "failed_shards": 0}
+    for r in results:
+        for key, value in (r or {}).items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+@shared_task(
+    time_limit=getattr(settings, "WEEKLY_SHARD_TIME_LIMIT", 600),
+    soft_time_limit=getattr(settings, "WEEKLY_SHARD_SOFT_TIME_LIMIT", 570),
+)
+def share_weekly_shard_task(*, first_id, last_id, since=None, dry_run=False):
+    """
+    Weekly share for one id-range shard of the cohort.
+    Never raises: a shard that dies partway (soft time limit, database
+    error) returns what it got through plus failed_shards=1, so the chord
+    callback still reports and the other shards are unaffected.
+    """
+    counts = {"shards": 1}
+    with PooledConnection() as connection:
+        try:
+            share_weekly_range(
+                first_id=first_id,
+                last_id=last_id,
+                since=parse_datetime(since) if since else None,
+                dry_run=dry_run,
+                connection=connection,
+                counts=counts,
+            )
+        except Exception:
+            # SoftTimeLimitExceeded included
+            logger.exception("weekly_shard_failed", extra={
+                "first_id": first_id, "last_id": last_id})
+            counts["failed_shards"] = 1
+    logger.info("weekly_shard_done", extra={
+        "first_id": first_id, "last_id": last_id, **counts,
+        **{f"mail_{k}": v for k, v in connection.stats().items()}})
+    return counts
+
+
+@shared_task
+def summarize_weekly_run_task(results):
+    totals = _add_counts(*results)
+    logger.info("weekly_run_done", extra=totals)
+    return totals
+
+
+@shared_task
+def weekly_run_failed_task(request, exc, traceback):
+    """Chord errback: a shard was killed outright (hard time limit, lost worker)."""
+    logger.error("weekly_run_failed", extra={"task_id": request.id, "error": repr(exc)})
+
+
+def dispatch_weekly_fan_out(shards, *, since, dry_run=False):
+    """
+    One share_weekly_shard_task per (first_id, last_id) shard, with
+    summarize_weekly_run_task as the chord callback.
+
+    Shards go to the "weekly" queue (CELERY_TASK_ROUTES), so how many run at
+    once is the concurrency of the worker consuming it; each shard stands
+    alone, and one failing never holds back the rest.
+    """
+    sigs = [
+        share_weekly_shard_task.s(
+            first_id=first_id, last_id=last_id,
+            since=since.isoformat(), dry_run=dry_run,
+        )
+        for first_id, last_id in shards
+    ]
+    return chord(sigs)(summarize_weekly_run_task.s().on_error(weekly_run_failed_task.s()))
+
+
+@shared_task(
+    time_limit=getattr(settings, "WEEKLY_SHARD_TIME_LIMIT", 600),
+    soft_time_limit=getattr(settings, "WEEKLY_SHARD_SOFT_TIME_LIMIT", 570),
+)
+def deliver_due_art_task():
+    """
+    Beat-driven scheduler tick (CELERY_BEAT_SCHEDULE): deliver to the users
+    whose local delivery slot has passed, a bounded batch at a time.
+    """
+    with PooledConnection() as connection:
+        counts = deliver_due(connection=connection)
+    logger.info("deliver_due_art", extra={
+        **counts, **{f"mail_{k}": v for k, v in connection.stats().items()}})
+    return counts
+
+
+@shared_task
+def refill_art_queue_task(*, user_id):
+    """Top up one user's pre-drawn gift queue (after signup or a grant)."""
+    user = User.objects.filter(id=user_id).first()
+    return refill_queue(user) if user else 0
+
+
+def refill_art_queue_soon(user_id):
+    """
+    Queue refill_art_queue_task from a request path; call from
+    transaction.on_commit. Best effort: a broker outage must not fail the
+    request, and the beat sweep (refill_art_queues_task) tops the user up.
+    """
+    try:
+        refill_art_queue_task.apply_async(kwargs={"user_id": user_id}, retry=False)
+    except Exception:
+        logger.warning("art_queue_refill_enqueue_failed", exc_info=True,
+                       extra={"user_id": user_id})
+
+
+@shared_task
+def refill_art_queues_task():
+    """Beat-driven top-up for users whose pre-drawn gift queue runs short."""
+    added = refill_queues()
+    logger.info("refill_art_queues", extra={"added": added})
+    return added
+
+
+@shared_task(time_limit=getattr(settings, "ART_RECOMMENDATION_TIME_LIMIT", 1800),
+             soft_time_limit=getattr(settings, "ART_RECOMMENDATION_SOFT_TIME_LIMIT", 1770))
+def rebuild_recommendations_task():
+    """Full rebuild of item neighbors and every user's candidate list."""
+    written = build_recommendations()
+    logger.info("rebuild_recommendations", extra={"lists": written})
+    return written
+
+
+@shared_task(time_limit=getattr(settings, "ART_RECOMMENDATION_TIME_LIMIT", 1800),
+             soft_time_limit=getattr(settings, "ART_RECOMMENDATION_SOFT_TIME_LIMIT", 1770))
+def refresh_recommendations_task():
+    """Rescore users whose likes changed since their list was built."""
+    written = refresh_recommendations()
+    logger.info("refresh_recommendations", extra={"lists": written})
+    return written
@@ -24,6 +24,13 @@ def _plain_staticfiles_storage(settings):
         )
 
 
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    """Cached tables (e.g. the welcome pool) mustn't leak ids between tests."""
+    from django.core.cache import cache
+    cache.clear()
+
+
 @pytest.fixture
 def user_a(db):
     return User.objects.create_user(
@@ -86,6 +93,8 @@ def _mute_celery_email_tasks(monkeypatch):
             task = getattr(signals, task_attr, None)
             if task and hasattr(task, "delay"):
                 monkeypatch.setattr(task, "delay", lambda *a, **k: None)
+        if hasattr(signals, "refill_art_queue_soon"):
+            monkeypatch.setattr(signals, "refill_art_queue_soon", lambda *a, **k: None)
     except Exception:
         # If import paths change, don't fail tests because of the monkeypatch.
         pass
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from django.contrib.auth import get_user_model
+from django.core import mail
+from main.models import ArtPiece, Notification, SentArtPiece
+from main.services.assignment import Cohort, assign_weekly, solve_assignment
+
+
+User = get_user_model()
+
+
+def _cohort(n_users, owners, sent=()):
+    n_pieces = len(owners)
+    keys = [u * n_pieces + p for u, p in sent]
+    return Cohort(range(1, n_users + 1), range(1, n_pieces + 1), owners, [keys])
+
+
+def test_never_assigns_own_or_sent_piece():
+    # user index 0 (id 1) owns piece 0; it has already been sent piece 1
+    cohort = _cohort(3, owners=[1, 2, 99], sent=[(0, 1)])
+
+    for seed in range(20):
+        choice = solve_assignment(cohort, seed=seed)
+        assert choice[0] == 2
+        assert choice[1] != 1
+
+
+def test_respects_piece_and_sharer_caps():
+    cohort = _cohort(50, owners=[100] * 5 + [200] * 5)
+
+    choice = solve_assignment(cohort, max_per_piece=3, max_per_sharer=12, seed=1)
+
+    assigned = choice[choice >= 0]
+    assert np.bincount(assigned, minlength=10).max() <= 3
+    assert (assigned < 5).sum() <= 12 and (assigned >= 5).sum() <= 12
+    assert assigned.size == 24
+
+
+def test_heavy_receiver_falls_back_to_exact_pick():
+    n_pieces = 200
+    cohort = _cohort(1, owners=[7] * n_pieces, sent=[(0, p) for p in range(n_pieces) if p != 123])
+
+    assert solve_assignment(cohort, rounds=2, seed=0)[0] == 123
+
+
+@pytest.mark.django_db
+def test_assign_weekly_writes_like_the_per_user_path(user_a, user_b, user_c, art_by_a, art_by_b):
+    SentArtPiece.objects.create(user=user_c, art_piece=art_by_b, source="welcome")
+
+    results = dict(assign_weekly(User.objects.order_by("id"), chunk_size=2, seed=3))
+
+    assert results == {user_a: art_by_b, user_b: art_by_a, user_c: art_by_a}
+    assert SentArtPiece.objects.filter(source="weekly").count() == 3
+    assert Notification.objects.filter(notification_type="shared_art").count() == 3
+    assert len(mail.outbox) == 3
+
+
+@pytest.mark.django_db
+def test_assign_weekly_dry_run_writes_nothing(user_a, art_by_b):
+    results = dict(assign_weekly(User.objects.order_by("id"), dry_run=True))
+
+    assert results[user_a] == art_by_b
+    assert SentArtPiece.objects.count() == 0
+    assert ArtPiece.objects.count() == 1
@@ -0,0 +1,47 @@
+import io
+from time import perf_counter
+
+import numpy as np
+import pytest
+from django.core.management import call_command
+from main.models import SentArtPiece
+from main.services.capacity import Snapshot, simulate, take_snapshot
+
+
+def test_users_run_dry_when_nothing_new_arrives():
+    snap = Snapshot(received=[0, 2, 4], own=[1, 0, 0], active=[True, True, False],
+                    emails=[True, False, True], pool_size=5)
+    weeks = simulate(snap, weeks=5, submissions_per_week=0, signups_per_week=0)
+
+    assert [w["weekly"] for w in weeks] == [2, 2, 2, 1, 0]
+    assert [w["empty_pool"] for w in weeks] == [0, 0, 0, 1, 2]
+    assert [w["emails"] for w in weeks] == [1, 1, 1, 1, 0]
+    assert weeks[0]["rows_written"] == 4
+
+
+def test_100k_users_for_a_year_in_seconds():
+    rng = np.random.default_rng(0)
+    n = 100_000
+    snap = Snapshot(received=rng.integers(0, 500, n), own=np.zeros(n, np.int64),
+                    active=np.ones(n, bool), emails=np.ones(n, bool), pool_size=520)
+    start = perf_counter()
+    weeks = simulate(snap, weeks=52, submissions_per_week=0.5, signups_per_week=200, seed=1)
+
+    assert perf_counter() - start < 5
+    assert weeks[-1]["users"] > n
+    assert weeks[-1]["empty_pool"] > weeks[0]["empty_pool"]
+
+
+@pytest.mark.django_db
+def test_snapshot_counts_only_the_approved_pool(user_a, user_b, art_by_a, art_by_b):
+    SentArtPiece.objects.create(user=user_a, art_piece=art_by_b, source="welcome")
+    art_by_b.soft_delete()
+
+    snap = take_snapshot()
+    assert snap.pool_size == 1
+    assert snap.received.tolist() == [0, 0]
+    assert snap.own.tolist() == [1, 0]
+
+    out = io.StringIO()
+    call_command("simulate_capacity", "--weeks", "2", "--seed", "1", stdout=out)
+    assert "Snapshot" in out.getvalue()
@@ -0,0 +1,212 @@
+from datetime import timedelta
+
+import pytest
+from celery.exceptions import SoftTimeLimitExceeded
+from django.core import mail
+from django.db import connection
+from django.utils import timezone
+from main.models import Comment, EmailOutbox, Like
+from main.services.digest import send_digests
+from main.services.outbox import claim_batch, dispatch_outbox, send_outbox_rows
+from main.services.rate_limit import RateLimited
+
+
+@pytest.mark.django_db
+class TestEmailOutbox:
+    def test_signals_write_outbox_rows_instead_of_tasks(self, user_a, user_b, art_by_a):
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="hi")
+
+        rows = EmailOutbox.objects.select_related("notification").order_by("id")
+        assert [r.notification.notification_type for r in rows] == ["like", "comment"]
+        assert {r.state for r in rows} == {"pending"}
+
+    def test_dispatch_sends_and_marks_rows(self, settings, user_a, user_b, art_by_a):
+        settings.COMMENT_EMAIL_DEBOUNCE_SECONDS = 0
+        # email_on_like is off by default, so only the comment goes out
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="hi")
+
+        counts = dispatch_outbox()
+
+        assert counts["sent"] == 1 and counts["skipped"] == 1 and counts["batches"] == 1
+        assert len(mail.outbox) == 1 and mail.outbox[0].to == [user_a.email]
+        assert sorted(EmailOutbox.objects.values_list("state", flat=True)) == ["sent", "skipped"]
+        assert dispatch_outbox()["batches"] == 0
+
+    def test_claims_skip_leased_rows_until_the_lease_expires(self, user_b, art_by_a):
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+
+        ids = claim_batch()
+        assert len(ids) == 1 and claim_batch() == []
+
+        EmailOutbox.objects.filter(id__in=ids).update(
+            available_at=timezone.now() - timedelta(seconds=1))
+        assert claim_batch() == ids
+
+    def test_soft_time_limit_is_not_a_send_failure(self, monkeypatch, user_b, art_by_a):
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+
+        def out_of_time(**kwargs):
+            raise SoftTimeLimitExceeded()
+        monkeypatch.setattr("main.notifications_email.send_like_email", out_of_time)
+
+        row = EmailOutbox.objects.get()
+        with pytest.raises(SoftTimeLimitExceeded):
+            send_outbox_rows([row.id])
+        row.refresh_from_db()
+        assert row.attempts == 0 and row.last_error == ""
+
+    def test_failures_back_off_then_give_up(self, monkeypatch, settings, user_b, art_by_a):
+        settings.EMAIL_OUTBOX_MAX_ATTEMPTS = 2
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+
+        def boom(**kwargs):
+            raise ConnectionResetError("SES down")
+        monkeypatch.setattr("main.notifications_email.send_like_email", boom)
+
+        row = EmailOutbox.objects.get()
+        assert send_outbox_rows([row.id])["retrying"] == 1
+        row.refresh_from_db()
+        assert row.state == "pending" and row.available_at > timezone.now()
+        assert "SES down" in row.last_error
+
+        assert send_outbox_rows([row.id])["failed"] == 1
+        row.refresh_from_db()
+        assert row.state == "failed" and row.attempts == 2
+
+
+@pytest.mark.django_db
+class TestEmailDigest:
+    def _on_digest(self, user, frequency="hourly"):
+        user.email_digest = frequency
+        user.email_on_like = True
+        user.save()
+
+    def test_digest_users_get_one_email_for_many_events(self, user_a, user_b, user_c, art_by_a):
+        self._on_digest(user_a)
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+        Like.objects.create(user=user_c, art_piece=art_by_a)
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="Lovely")
+
+        assert set(EmailOutbox.objects.values_list("state", flat=True)) == {"digest"}
+        assert dispatch_outbox()["batches"] == 0
+        assert send_digests("daily")["digests"] == 0
+
+        counts = send_digests("hourly")
+
+        assert counts == {"digests": 1, "notifications": 3, "skipped": 0, "failed": 0}
+        assert len(mail.outbox) == 1
+        msg = mail.outbox[0]
+        assert msg.subject == "You have 1 new message and 2 new likes on Omnivore"
+        assert "Lovely" in msg.body and "C User loved" in msg.body
+        assert set(EmailOutbox.objects.values_list("state", flat=True)) == {"sent"}
+        assert send_digests("hourly")["digests"] == 0
+
+    def test_throttled_digest_hands_back_its_rows(self, monkeypatch, user_a, user_b, user_c, art_by_a):
+        from main.services import digest
+        self._on_digest(user_a)
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+        Like.objects.create(user=user_c, art_piece=art_by_a)
+
+        def throttled(*args, **kwargs):
+            raise RateLimited(30)
+        monkeypatch.setattr(digest, "_send_digest", throttled)
+
+        assert send_digests("hourly")["throttled"] == 2
+        assert set(EmailOutbox.objects.values_list("state", flat=True)) == {"digest"}
+
+    def test_read_and_turned_off_notifications_are_dropped(self, user_a, user_b, art_by_a):
+        self._on_digest(user_a, "daily")
+        Like.objects.create(user=user_b, art_piece=art_by_a)
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="hi")
+        user_a.notifications.filter(notification_type="comment").update(is_read=True)
+        user_a.email_on_like = False
+        user_a.save()
+
+        assert send_digests("daily") == {"digests": 0, "notifications": 0, "skipped": 2, "failed": 0}
+        assert mail.outbox == []
+
+    def test_instant_users_keep_individual_emails(self, user_a, user_b, art_by_a):
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="hi")
+        assert EmailOutbox.objects.get().state == "pending"
+
+
+@pytest.mark.django_db
+class TestCommentDebounce:
+    def _reply(self, sender, recipient, art, text):
+        return Comment.objects.create(sender=sender, recipient=recipient, art_piece=art, text=text,
+                                      parent_comment=Comment.objects.filter(
+                                          art_piece=art, parent_comment=None).first())
+
+    def test_burst_in_a_thread_sends_one_email_with_latest_message(self, user_a, user_b, user_c, art_by_a):
+        self._reply(user_b, user_a, art_by_a, "first")
+        self._reply(user_b, user_a, art_by_a, "second")
+        self._reply(user_c, user_a, art_by_a, "other thread")
+
+        rows = EmailOutbox.objects.select_related("notification__comment").order_by("id")
+        assert [r.notification.comment.text for r in rows] == ["second", "other thread"]
+        assert all(r.available_at > timezone.now() for r in rows)
+        assert dispatch_outbox()["batches"] == 0
+
+        EmailOutbox.objects.update(available_at=timezone.now())
+        dispatch_outbox()
+        assert len(mail.outbox) == 2
+        assert "second" in mail.outbox[0].body and "first" not in mail.outbox[0].body
+
+        # The next message after the email went out starts a new burst
+        self._reply(user_b, user_a, art_by_a, "third")
+        assert EmailOutbox.objects.filter(state="pending").count() == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_reply_saved_outside_a_transaction(self, monkeypatch, user_a, user_b, art_by_a):
+        # Behave like Postgres: SELECT FOR UPDATE refused in autocommit
+        monkeypatch.setattr(connection.features, "has_select_for_update", True)
+        monkeypatch.setattr(connection.features, "has_select_for_no_key_update", True)
+        monkeypatch.setattr(connection.ops, "for_update_sql", lambda *a, **kw: "")
+        self._reply(user_b, user_a, art_by_a, "first")
+        self._reply(user_b, user_a, art_by_a, "second")
+
+        assert EmailOutbox.objects.get().notification.comment.text == "second"
+
+    def test_extensions_stop_at_the_max_window(self, settings, user_a, user_b, art_by_a):
+        settings.COMMENT_EMAIL_DEBOUNCE_MAX_SECONDS = 150
+        self._reply(user_b, user_a, art_by_a, "first")
+        row = EmailOutbox.objects.get()
+        EmailOutbox.objects.update(created_at=row.created_at - timedelta(seconds=100))
+
+        self._reply(user_b, user_a, art_by_a, "second")
+
+        row = EmailOutbox.objects.get()
+        assert row.available_at == row.created_at + timedelta(seconds=150)
+
+
+@pytest.mark.django_db
+class TestTransactionalEmails:
+    def test_feedback_is_queued_not_sent_in_the_request(self, client, settings):
+        resp = client.post("/feedback", {"message": "broken", "page": "/x"})
+
+        assert resp.status_code == 200 and mail.outbox == []
+        row = EmailOutbox.objects.get()
+        assert row.kind == "feedback" and row.priority == EmailOutbox.PRIORITY_LOW
+
+        assert dispatch_outbox()["sent"] == 1
+        assert mail.outbox[0].to == ["support@omnivorearts.com"] and "broken" in mail.outbox[0].body
+
+    def test_password_reset_goes_out_first_and_keeps_no_link(
+            self, monkeypatch, client, django_capture_on_commit_callbacks, user_a, user_b, art_by_a):
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="hi")
+        kicked = []
+        monkeypatch.setattr("main.tasks.dispatch_email_outbox_now", lambda **kw: kicked.append(kw))
+
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post("/password_reset/", {"email": user_a.email})
+
+        assert mail.outbox == [] and kicked == [{"priority": EmailOutbox.PRIORITY_HIGH}]
+        reset = EmailOutbox.objects.get(kind="password_reset")
+        assert claim_batch(batch_size=1) == [reset.id]
+
+        send_outbox_rows([reset.id])
+        assert mail.outbox[0].to == [user_a.email] and "/reset/" in mail.outbox[0].body
+        reset.refresh_from_db()
+        assert reset.state == "sent" and set(reset.message) == {"to", "subject"}
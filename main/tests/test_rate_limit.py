@@ -0,0 +1,114 @@
+import pytest
+from django.core import mail
+from django.utils import timezone
+from main.mail import PooledConnection, RateLimitedBackend
+from main.models import Comment, EmailOutbox
+from main.services.outbox import dispatch_outbox, send_outbox_rows
+from main.services.rate_limit import LocalTokenBucket, RateLimited, send_rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _msg(*to):
+    return mail.EmailMessage("s", "body", "from@example.com", list(to))
+
+
+@pytest.fixture
+def limiter(settings):
+    settings.EMAIL_SEND_RATE = 2
+    settings.EMAIL_SEND_BURST = 2
+    settings.EMAIL_RATE_LIMIT_MAX_WAIT = 0
+    settings.EMAIL_RATE_LIMIT_REDIS_URL = None
+    settings.EMAIL_RATE_LIMITED_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+    send_rate_limiter.cache_clear()
+    yield send_rate_limiter()
+    send_rate_limiter.cache_clear()
+
+
+class TestTokenBucket:
+    def test_spends_burst_then_refills_at_rate(self):
+        clock = FakeClock()
+        bucket = LocalTokenBucket(rate=2, burst=4, max_wait=0, clock=clock)
+
+        bucket.acquire(4)
+        with pytest.raises(RateLimited) as exc:
+            bucket.acquire(1)
+        assert exc.value.retry_after == pytest.approx(0.5)
+
+        clock.now = 1.0
+        bucket.acquire(2)
+        clock.now = 100.0
+        assert bucket.fill() == 4  # never more than the burst
+        assert bucket.stats()["throttled"] == 1
+
+    def test_send_larger_than_burst_takes_the_whole_burst(self):
+        clock = FakeClock()
+        bucket = LocalTokenBucket(rate=2, burst=4, max_wait=0, clock=clock)
+
+        bucket.acquire(50)
+        assert bucket.fill() == 0
+
+
+class TestRateLimitedBackend:
+    def test_takes_a_token_per_recipient(self, limiter):
+        backend = RateLimitedBackend()
+        assert backend.send_messages([_msg("a@example.com", "b@example.com")]) == 1
+
+        with pytest.raises(RateLimited):
+            backend.send_messages([_msg("c@example.com")])
+        assert len(mail.outbox) == 1
+
+    def test_pooled_connection_does_not_reconnect_when_throttled(self, limiter):
+        with PooledConnection(backend="main.mail.RateLimitedBackend") as conn:
+            conn.send_messages([_msg("a@example.com", "b@example.com")])
+            with pytest.raises(RateLimited):
+                conn.send_messages([_msg("c@example.com")])
+        assert conn.stats()["reconnects"] == 0 and conn.stats()["failures"] == 0
+
+
+@pytest.mark.django_db
+def test_throttled_outbox_rows_wait_without_using_an_attempt(
+        settings, limiter, user_a, user_b, user_c, art_by_a, art_by_b):
+    settings.COMMENT_EMAIL_DEBOUNCE_SECONDS = 0
+    Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="one")
+    Comment.objects.create(sender=user_c, recipient=user_a, art_piece=art_by_a, text="two")
+    Comment.objects.create(sender=user_a, recipient=user_b, art_piece=art_by_b, text="three")
+
+    with PooledConnection(backend="main.mail.RateLimitedBackend") as conn:
+        counts = dispatch_outbox(connection=conn)
+
+    assert counts["sent"] == 2 and counts["throttled"] == 1 and counts["batches"] == 1
+    row = EmailOutbox.objects.get(state="pending")
+    assert row.attempts == 0 and row.available_at > timezone.now()
+
+
+@pytest.mark.django_db
+def test_throttle_leaves_earlier_failures_alone(
+        monkeypatch, settings, limiter, user_a, user_b, user_c, art_by_a, art_by_b):
+    settings.COMMENT_EMAIL_DEBOUNCE_SECONDS = 0
+    settings.EMAIL_OUTBOX_MAX_ATTEMPTS = 1
+    for sender, recipient, art in ((user_b, user_a, art_by_a), (user_c, user_a, art_by_a),
+                                   (user_a, user_b, art_by_b)):
+        Comment.objects.create(sender=sender, recipient=recipient, art_piece=art, text="hi")
+    first, second, third = EmailOutbox.objects.order_by("id")
+    calls = []
+
+    def send(n, **kwargs):
+        calls.append(n.id)
+        if len(calls) == 1:
+            raise ConnectionResetError("rejected")
+        raise RateLimited(5)
+    monkeypatch.setattr("main.services.outbox.send_notification_email", send)
+
+    counts = send_outbox_rows([first.id, second.id, third.id])
+
+    assert counts["failed"] == 1 and counts["throttled"] == 2
+    assert EmailOutbox.objects.get(id=first.id).state == "failed"
+    assert set(EmailOutbox.objects.filter(state="pending").values_list("id", flat=True)) == {
+        second.id, third.id}
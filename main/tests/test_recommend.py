@@ -0,0 +1,81 @@
+import pytest
+from django.contrib.auth import get_user_model
+from main.models import ArtCandidateList, ArtPiece, ArtPieceNeighbors, Like, SentArtPiece
+from main.services.recommend import (
+    build_recommendations, candidate_lists, load_interactions, recommended_piece,
+    refresh_recommendations,
+)
+
+
+User = get_user_model()
+
+
+def _users(n):
+    return [User.objects.create_user(email=f"r{i}@example.com", username=f"r{i}", password="x")
+            for i in range(n)]
+
+
+def _pieces(owner, n):
+    return [ArtPiece.objects.create(user=owner, artist_name="X", piece_name=f"P{i}",
+                                    piece_description="-") for i in range(n)]
+
+
+@pytest.mark.django_db
+class TestRecommendations:
+    def _taste(self):
+        sharer, fan, u1, u2 = _users(4)
+        p = _pieces(sharer, 4)
+        # p0 and p1 are liked together; p2/p3 by someone else
+        for u in (u1, u2):
+            Like.objects.create(user=u, art_piece=p[0])
+            Like.objects.create(user=u, art_piece=p[1])
+        Like.objects.create(user=u2, art_piece=p[2])
+        Like.objects.create(user=fan, art_piece=p[0])
+        return sharer, fan, p
+
+    def test_ranks_co_liked_pieces_first_and_skips_seen(self, settings):
+        settings.ART_RECOMMENDATION_RATE = 1.0
+        sharer, fan, p = self._taste()
+        SentArtPiece.objects.create(user=fan, art_piece=p[2], source="welcome")
+
+        assert build_recommendations() == 3  # fan, u1, u2
+        ids = [piece_id for piece_id, _ in candidate_lists([fan.id])[fan.id]]
+        assert ids == [p[1].id]  # p0 liked, p2 already sent, p3 never co-liked
+        assert recommended_piece(fan) == p[1]
+        assert candidate_lists([sharer.id]) == {}
+
+    def test_likes_mark_stale_and_incremental_refresh_rescores(self):
+        sharer, fan, p = self._taste()
+        build_recommendations()
+        Like.objects.create(user=fan, art_piece=p[1])
+        assert ArtCandidateList.objects.get(user=fan).stale
+
+        assert refresh_recommendations() == 1
+        row = ArtCandidateList.objects.get(user=fan)
+        assert not row.stale
+        assert [piece_id for piece_id, _ in candidate_lists([fan.id])[fan.id]] == [p[2].id]
+
+    def test_failed_neighbor_rebuild_keeps_the_old_table(self, monkeypatch):
+        self._taste()
+        build_recommendations()
+        before = set(ArtPieceNeighbors.objects.values_list("art_piece_id", flat=True))
+        assert before
+
+        def boom(*args, **kwargs):
+            raise RuntimeError("insert failed")
+        monkeypatch.setattr(ArtPieceNeighbors.objects, "bulk_create", boom)
+        with pytest.raises(RuntimeError):
+            build_recommendations()
+
+        assert set(ArtPieceNeighbors.objects.values_list("art_piece_id", flat=True)) == before
+
+    def test_caps_interactions_per_user(self, monkeypatch):
+        from main.services import recommend
+        monkeypatch.setattr(recommend, "MAX_PER_USER", 2)
+        sharer, fan = _users(2)
+        for art in _pieces(sharer, 5):
+            Like.objects.create(user=fan, art_piece=art)
+
+        users, pieces = load_interactions()
+        assert users.tolist() == [fan.id, fan.id]
+        assert pieces.tolist() == sorted(pieces.tolist())[-2:]
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+from django.core import mail
+from main.models import EmailOutbox, SentArtPiece
+from main.services.scheduling import deliver_due, next_delivery_after
+
+
+UTC = dt_timezone.utc
+
+
+@pytest.mark.django_db
+class TestNextDelivery:
+    def test_lands_on_local_hour_a_cadence_later(self, settings, user_a):
+        settings.ART_DELIVERY_LOCAL_HOUR = 9
+        user_a.timezone = "America/New_York"
+
+        after = datetime(2025, 1, 6, 14, 0, tzinfo=UTC)  # Monday 9:00 in New York
+        due = next_delivery_after(user_a, after=after)
+
+        local = due.astimezone(ZoneInfo("America/New_York"))
+        assert (local.date().isoformat(), local.hour, local.minute) == ("2025-01-13", 9, user_a.id % 60)
+
+    def test_unknown_timezone_falls_back_to_utc(self, user_a):
+        user_a.timezone = "Not/AZone"
+        after = datetime(2025, 1, 6, 0, 0, tzinfo=UTC)
+
+        assert next_delivery_after(user_a, after=after, cadence=timedelta(0)).hour == 9
+
+
+@pytest.mark.django_db
+class TestDeliverDue:
+    def test_only_due_users_get_art_and_move_a_cadence_on(self, user_a, user_b, art_by_a, art_by_b):
+        now = datetime(2025, 1, 6, 12, 0, tzinfo=UTC)
+        user_a.next_delivery_at = now - timedelta(minutes=1)
+        user_a.save()
+        user_b.next_delivery_at = now + timedelta(hours=1)
+        user_b.save()
+
+        counts = deliver_due(now=now)
+
+        assert counts["sent"] == 1
+        assert SentArtPiece.objects.get().user == user_a
+        assert len(mail.outbox) == 1
+        user_a.refresh_from_db()
+        assert user_a.last_art_sent_at is not None
+        assert user_a.next_delivery_at > user_a.last_art_sent_at + timedelta(days=6)
+
+        # Nothing is due any more
+        assert deliver_due(now=now)["sent"] == 0
+
+    def test_unscheduled_users_get_a_slot_not_art(self, user_a, art_by_b):
+        counts = deliver_due(now=datetime(2025, 1, 6, 12, 0, tzinfo=UTC))
+
+        assert counts["scheduled"] == 2 and counts["sent"] == 0  # art_by_b's owner too
+        user_a.refresh_from_db()
+        assert user_a.next_delivery_at is not None
+
+    def test_failed_email_still_moves_the_user_on(self, monkeypatch, user_a, art_by_b):
+        now = datetime(2025, 1, 6, 12, 0, tzinfo=UTC)
+        user_a.next_delivery_at = now - timedelta(minutes=1)
+        user_a.save()
+
+        def reject(**kwargs):
+            raise ConnectionResetError("rejected")
+        monkeypatch.setattr("main.services.scheduling.send_shared_art_email", reject)
+
+        counts = deliver_due(now=now)
+
+        assert counts["sent"] == 1 and counts["email_queued"] == 1
+        user_a.refresh_from_db()
+        assert user_a.next_delivery_at > now + timedelta(days=6)
+        assert EmailOutbox.objects.get().notification.recipient == user_a
+        # The next tick doesn't pick another piece
+        assert deliver_due(now=now + timedelta(hours=1))["sent"] == 0
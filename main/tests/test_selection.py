@@ -0,0 +1,197 @@
+import pytest
+from main.models import ArtPiece, CustomUser, QueuedArtPiece, ReceivedArtBitmap, SentArtPiece
+from main.services.art_queue import pop_queued_piece, refill_queue, refill_queues
+from main.services.received import (
+    PieceBitmap, check_bitmaps, rebuild_bitmaps, received_bitmap,
+)
+from main.services.alias import AliasTable
+from main.services.selection import (
+    eligible_art_pieces, recent_sharers, sample_art_piece, sample_welcome_piece, welcome_pool,
+)
+from main.services.sharing import share_weekly_bulk
+
+
+def _make_pieces(owner, n, **extra):
+    return ArtPiece.objects.bulk_create([
+        ArtPiece(user=owner, artist_name="X", piece_name=f"P{i}",
+                 piece_description="-", **extra)
+        for i in range(n)
+    ])
+
+
+@pytest.mark.django_db
+class TestSampler:
+    def test_never_picks_own_sent_or_deleted(self, user_a, user_b, art_by_a, art_by_b):
+        gone, keep = _make_pieces(user_b, 2)
+        gone.soft_delete()
+        SentArtPiece.objects.create(user=user_a, art_piece=art_by_b, source="welcome")
+
+        for _ in range(20):
+            assert sample_art_piece(user_a) == keep
+
+    def test_returns_none_when_pool_exhausted(self, user_a, art_by_a, art_by_b):
+        SentArtPiece.objects.create(user=user_a, art_piece=art_by_b, source="welcome")
+        assert sample_art_piece(user_a) is None
+
+    def test_welcome_pool_ignores_approval_but_needs_flag(self, user_a, user_b):
+        curated, = _make_pieces(user_b, 1, welcome_eligible=True, approved_status=False)
+        _make_pieces(user_b, 3)
+
+        assert list(eligible_art_pieces(user_a, welcome=True)) == [curated]
+
+    def test_pieces_after_long_ineligible_runs_are_not_favoured(self, user_a, user_b):
+        _make_pieces(user_b, 100, approved_status=False)
+        first, second = _make_pieces(user_b, 2)
+
+        picks = [sample_art_piece(user_a) for _ in range(400)]
+
+        # A plain keyed walk would pick `first` ~98% of the time
+        assert picks.count(first) < 330 and picks.count(second) > 70
+
+    def test_query_count_is_flat(self, user_a, user_b, django_assert_max_num_queries):
+        _make_pieces(user_b, 200)
+        sample_art_piece(user_a)  # first call stores the received bitmap
+
+        # pivot, bitmap row, one pool page, chosen row
+        with django_assert_max_num_queries(4):
+            assert sample_art_piece(user_a) is not None
+
+    def test_alias_table_matches_weights(self):
+        import random
+        rng = random.Random(7)
+        table = AliasTable([1, 0, 3, 6])
+        counts = [0] * 4
+        for _ in range(20000):
+            counts[table.sample(rng)] += 1
+
+        assert counts[1] == 0
+        assert [round(c / 2000) for c in counts] == [1, 0, 3, 6]
+
+    def test_welcome_sampler_excludes_received_and_sees_updates(
+            self, user_a, user_b, django_capture_on_commit_callbacks):
+        first, second = _make_pieces(user_b, 2, welcome_eligible=True, welcome_weight=50)
+        SentArtPiece.objects.create(user=user_a, art_piece=first, source="welcome")
+        assert sample_welcome_piece(user_a) == second
+        assert welcome_pool()["ids"] == [first.id, second.id]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            second.welcome_eligible = False
+            second.save()
+        assert welcome_pool()["ids"] == [first.id]
+        assert sample_welcome_piece(user_a) is None
+
+
+@pytest.mark.django_db
+class TestSharerDiversity:
+    def test_skips_sharers_of_recent_deliveries(self, settings, user_a, user_b, user_c):
+        settings.ART_SELECTION_MODE = "diverse"
+        recent, *more_from_b = _make_pieces(user_b, 6)
+        from_c, = _make_pieces(user_c, 1)
+        SentArtPiece.objects.create(user=user_a, art_piece=recent, source="welcome")
+
+        assert recent_sharers([user_a.id], last=1) == {user_a.id: {user_b.id}}
+        for _ in range(10):
+            assert sample_art_piece(user_a) == from_c
+        assert dict(share_weekly_bulk([user_a], dry_run=True))[user_a] == from_c
+
+    def test_falls_back_when_only_recent_sharers_are_left(self, settings, user_a, user_b):
+        settings.ART_SELECTION_MODE = "diverse"
+        recent, other = _make_pieces(user_b, 2)
+        SentArtPiece.objects.create(user=user_a, art_piece=recent, source="welcome")
+
+        assert sample_art_piece(user_a) == other
+
+
+@pytest.mark.django_db
+class TestReceivedBitmap:
+    def test_bitmap_tracks_sent_rows(self, user_a, user_b, art_by_b):
+        extra = _make_pieces(user_b, 3)
+        SentArtPiece.objects.create(user=user_a, art_piece=art_by_b, source="welcome")
+        SentArtPiece.objects.create(user=user_a, art_piece=extra[1], source="welcome")
+        SentArtPiece.objects.get(user=user_a, art_piece=extra[1]).delete()
+
+        received = received_bitmap(user_a.id)
+        assert set(received) == {art_by_b.id}
+        assert list(check_bitmaps()) == []
+
+    @pytest.mark.django_db(transaction=True)
+    def test_deleting_a_user_who_received_art(self, user_a, user_b, art_by_b):
+        SentArtPiece.objects.create(user=user_a, art_piece=art_by_b, source="welcome")
+
+        user_a.delete()
+
+        assert not SentArtPiece.objects.exists() and not ReceivedArtBitmap.objects.exists()
+
+    def test_checker_reports_drift_and_rebuild_fixes_it(self, user_a, art_by_b):
+        SentArtPiece.objects.create(user=user_a, art_piece=art_by_b, source="welcome")
+        ReceivedArtBitmap.objects.filter(user=user_a).update(
+            bits=PieceBitmap.from_ids([999]).to_bytes())
+
+        assert list(check_bitmaps()) == [(user_a.id, [art_by_b.id], [999])]
+        assert rebuild_bitmaps() == 1
+        assert list(check_bitmaps()) == []
+
+    def test_sampler_skips_pieces_in_long_received_runs(self, user_a, user_b):
+        pieces = _make_pieces(user_b, 700)
+        SentArtPiece.objects.bulk_create([
+            SentArtPiece(user=user_a, art_piece=p, source="welcome") for p in pieces[:-1]
+        ])
+        rebuild_bitmaps([user_a.id])
+
+        assert sample_art_piece(user_a) == pieces[-1]
+
+
+@pytest.mark.django_db
+class TestArtQueue:
+    def test_pop_skips_and_drops_stale_entries(self, user_a, user_b):
+        gone, sent, fresh = _make_pieces(user_b, 3, approved_status=True)
+        QueuedArtPiece.objects.bulk_create([
+            QueuedArtPiece(user=user_a, art_piece=p) for p in (gone, sent, fresh)
+        ])
+        gone.soft_delete()
+        SentArtPiece.objects.create(user=user_a, art_piece=sent, source="welcome")
+
+        assert pop_queued_piece(user_a) == fresh
+        assert not QueuedArtPiece.objects.filter(user=user_a).exists()
+        assert pop_queued_piece(user_a) is None
+
+    def test_refill_tops_up_without_duplicates(self, user_a, user_b):
+        _make_pieces(user_b, 10, approved_status=True)
+        refill_queue(user_a, depth=3)
+        refill_queue(user_a, depth=3)
+
+        queued = list(QueuedArtPiece.objects.filter(
+            user=user_a, kind="general").values_list("art_piece_id", flat=True))
+        assert 0 < len(queued) <= 3
+        assert len(set(queued)) == len(queued)
+
+    def test_sweep_rotates_past_users_it_cannot_fill(self, settings, user_a, user_b, user_c):
+        settings.ART_QUEUE_DEPTH = 3
+        _make_pieces(user_b, 1, approved_status=True)
+
+        refill_queues(limit=1)
+        refill_queues(limit=1)
+
+        assert set(CustomUser.objects.filter(art_queue_refilled_at__isnull=False)
+                   .values_list("id", flat=True)) == {user_a.id, user_b.id}
+
+    def test_welcome_gift_uses_queued_piece(self, user_a, user_b):
+        from main.views import ensure_welcome_gift
+
+        welcome = _make_pieces(user_b, 4, welcome_eligible=True)
+        refill_queue(user_a)
+        queued = QueuedArtPiece.objects.get(user=user_a, kind="welcome")
+
+        assert ensure_welcome_gift(user_a) == queued.art_piece
+        assert queued.art_piece in welcome
+        assert not QueuedArtPiece.objects.filter(user=user_a, kind="welcome").exists()
+
+
+def test_refill_enqueue_survives_a_broker_outage(monkeypatch):
+    from main import tasks
+
+    def down(*args, **kwargs):
+        raise ConnectionRefusedError("broker down")
+    monkeypatch.setattr(tasks.refill_art_queue_task, "apply_async", down)
+
+    tasks.refill_art_queue_soon(1)  # logs, doesn't raise
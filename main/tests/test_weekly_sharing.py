@@ -0,0 +1,474 @@
+import io
+import json
+import re
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from main.mail import PooledConnection
+from main import tasks
+from main.models import Comment, EmailOutbox, Notification, NotificationDelivery, SentArtPiece
+from main.notifications_email import SharedArtFanOut, send_shared_art_email
+from main.services.digest import send_digests
+from main.services.distribution import run_weekly_distribution, start_run
+from main.services.plans import apply_plan, write_plan
+from main.services.sharing import (
+    persist_weekly_share, share_piece_with_users, share_weekly_bulk, share_weekly_range,
+    weekly_shards,
+)
+from main.services.rate_limit import RateLimited
+from main.tasks import send_comment_batch_task, send_shared_art_batch_task
+
+
+User = get_user_model()
+
+
+@pytest.mark.django_db
+class TestWeeklyBulk:
+    def test_each_user_gets_one_unsent_piece_not_their_own(self, user_a, user_b, user_c, art_by_a, art_by_b):
+        SentArtPiece.objects.create(user=user_c, art_piece=art_by_a, source="welcome")
+
+        results = dict(share_weekly_bulk([user_a, user_b, user_c], chunk_size=2))
+
+        assert results[user_a] == art_by_b
+        assert results[user_b] == art_by_a
+        assert results[user_c] == art_by_b
+        assert SentArtPiece.objects.filter(source="weekly").count() == 3
+        n = Notification.objects.get(recipient=user_c, notification_type="shared_art")
+        assert n.sender == user_b and n.art_piece == art_by_b
+        assert len(mail.outbox) == 3
+
+    def test_user_with_nothing_left_is_skipped(self, user_a, art_by_a, art_by_b):
+        SentArtPiece.objects.create(user=user_a, art_piece=art_by_b)
+
+        results = dict(share_weekly_bulk([user_a]))
+
+        assert results[user_a] is None
+        assert Notification.objects.count() == 0
+        assert len(mail.outbox) == 0
+
+    def test_dry_run_writes_nothing(self, user_a, art_by_b):
+        results = dict(share_weekly_bulk([user_a], dry_run=True))
+
+        assert results[user_a] == art_by_b
+        assert SentArtPiece.objects.count() == 0
+        assert Notification.objects.count() == 0
+        assert len(mail.outbox) == 0
+
+    def test_reuses_existing_notification(self, user_a, user_b, art_by_b):
+        earlier = Notification.objects.create(
+            recipient=user_a, sender=user_b, notification_type="shared_art",
+            art_piece=art_by_b, message="earlier",
+        )
+
+        dict(share_weekly_bulk([user_a]))
+
+        assert Notification.objects.filter(recipient=user_a).count() == 1
+        assert f"n={earlier.id}" in mail.outbox[0].body
+
+    def test_command_bulk_mode(self, user_a, user_b, art_by_a, art_by_b):
+        call_command("share_weekly_art", "--all", "--bulk", "--chunk-size", "1")
+
+        assert SentArtPiece.objects.filter(user=user_a, art_piece=art_by_b).exists()
+        assert SentArtPiece.objects.filter(user=user_b, art_piece=art_by_a).exists()
+
+
+@pytest.mark.django_db
+class TestWeeklyShards:
+    def test_shards_cover_cohort_in_id_ranges(self, user_a, user_b, user_c):
+        shards = weekly_shards(User.objects.all(), shard_size=2)
+
+        assert shards == [(user_a.id, user_b.id), (user_c.id, user_c.id)]
+
+    def test_rerunning_a_shard_does_not_send_twice(self, user_a, user_b, art_by_a, art_by_b):
+        since = timezone.now()
+
+        first = share_weekly_range(first_id=user_a.id, last_id=user_b.id, since=since)
+        again = share_weekly_range(first_id=user_a.id, last_id=user_b.id, since=since)
+
+        assert first == {"sent": 2, "skipped": 0, "failed": 0}
+        assert again == {"sent": 0, "skipped": 2, "failed": 0}
+        assert SentArtPiece.objects.count() == 2
+        assert len(mail.outbox) == 2
+
+    def test_a_failing_shard_does_not_stop_the_others(
+            self, monkeypatch, user_a, user_b, user_c, art_by_a, art_by_b):
+        from celery.exceptions import SoftTimeLimitExceeded
+        from omnivore.celery import app
+        real = tasks.share_weekly_range
+
+        def share(*, first_id, **kwargs):
+            if first_id == user_b.id:
+                raise SoftTimeLimitExceeded()
+            return real(first_id=first_id, **kwargs)
+        monkeypatch.setattr(tasks, "share_weekly_range", share)
+        monkeypatch.setattr(app.conf, "task_always_eager", True)
+
+        shards = weekly_shards(User.objects.all(), shard_size=1)
+        totals = tasks.dispatch_weekly_fan_out(shards, since=timezone.now()).get()
+
+        assert totals["shards"] == 3 and totals["failed_shards"] == 1
+        assert totals["sent"] == 2
+        assert set(SentArtPiece.objects.values_list("user_id", flat=True)) == {user_a.id, user_c.id}
+
+
+@pytest.mark.django_db
+class TestDistributionRun:
+    def test_run_records_entries_and_throughput(self, user_a, user_b, user_c, art_by_a):
+        run = start_run()
+
+        list(run_weekly_distribution(run, User.objects.all(), checkpoint_every=1))
+
+        run.refresh_from_db()
+        assert run.status == "finished" and run.finished_at is not None
+        assert run.last_user_id == user_c.id
+        assert (run.sent_count, run.skipped_count) == (2, 1)
+        assert run.users_per_second > 0
+        assert run.entries.filter(email_sent=True).count() == 2
+
+    def test_resume_after_crash_never_resends(self, user_a, user_b, user_c, art_by_a, art_by_b):
+        run = start_run()
+        users = User.objects.all()
+
+        crashed = run_weekly_distribution(run, users, checkpoint_every=10)
+        next(crashed)  # one user committed and emailed, no checkpoint yet
+        crashed.close()
+
+        list(run_weekly_distribution(run, users))
+
+        assert SentArtPiece.objects.count() == 3
+        assert len(mail.outbox) == 3
+        run.refresh_from_db()
+        assert run.users_processed == 3
+
+    def test_resume_sends_only_pending_emails(self, user_a, user_b, art_by_b):
+        run = start_run()
+        n = persist_weekly_share(user=user_a, art=art_by_b)
+        run.entries.create(user=user_a, art_piece=art_by_b, notification=n, outcome="sent")
+        run.status = "finished"
+        run.save()
+
+        list(run_weekly_distribution(run, User.objects.all()))
+        list(run_weekly_distribution(run, User.objects.all()))
+
+        assert len(mail.outbox) == 1
+        assert run.entries.get().email_sent
+
+    def test_resume_retries_failed_shares(self, monkeypatch, user_a, user_b, art_by_a, art_by_b):
+        from main.services import distribution
+        real = distribution.choose_art_piece
+
+        def flaky(user):
+            if user == user_b:
+                raise ConnectionResetError("database went away")
+            return real(user)
+        monkeypatch.setattr(distribution, "choose_art_piece", flaky)
+        run = start_run()
+        list(run_weekly_distribution(run, User.objects.all()))
+        run.refresh_from_db()
+        assert run.status == "finished" and run.failed_count == 1
+
+        monkeypatch.setattr(distribution, "choose_art_piece", real)
+        resumed = list(run_weekly_distribution(run, User.objects.all()))
+
+        assert resumed == [(user_b, art_by_a)]
+        assert run.entries.get(user=user_b).outcome == "sent"
+        assert len(mail.outbox) == 2
+        run.refresh_from_db()
+        assert (run.sent_count, run.failed_count) == (2, 0)
+
+    def test_resume_passes_by_opted_out_recipients(self, user_a, user_b, art_by_b):
+        user_a.email_on_art_shared = False
+        user_a.save()
+        run = start_run()
+        n = persist_weekly_share(user=user_a, art=art_by_b)
+        run.entries.create(user=user_a, art_piece=art_by_b, notification=n, outcome="sent")
+        run.status = "finished"
+        run.save()
+
+        list(run_weekly_distribution(run, User.objects.all()))
+
+        entry = run.entries.get()
+        assert entry.email_skipped and not entry.email_sent
+        assert len(mail.outbox) == 0
+
+    def test_command_writes_phase_summary(self, tmp_path, user_a, user_b, user_c, art_by_a, art_by_b):
+        path = tmp_path / "metrics.json"
+        call_command("share_weekly_art", "--all", "--metrics", str(path), stdout=io.StringIO())
+
+        summary = json.loads(path.read_text())
+        assert set(summary["phases"]) == {"select", "persist", "render", "send"}
+        assert summary["phases"]["select"]["count"] == 3
+        assert summary["phases"]["send"]["count"] == 3
+        assert summary["queries"] > 0 and summary["failures"] == {}
+
+
+@pytest.mark.django_db
+class TestPlanApply:
+    def _plan(self, seed):
+        fp = io.StringIO()
+        list(write_plan(User.objects.order_by("id"), fp, seed=seed))
+        return fp.getvalue()
+
+    def test_same_seed_same_plan_and_no_writes(self, user_a, user_b, user_c, art_by_a, art_by_b):
+        first = self._plan(seed=42)
+
+        assert first.splitlines()[1:] == self._plan(seed=42).splitlines()[1:]
+        assert json.loads(first.splitlines()[0])["seed"] == 42
+        assert SentArtPiece.objects.count() == 0 and len(mail.outbox) == 0
+
+    def test_apply_from_offset_skips_stale_lines(self, user_a, user_b, user_c, art_by_a, art_by_b):
+        plan = self._plan(seed=1)
+        user_c.receive_art_paused = True
+        user_c.save()
+
+        applied = list(apply_plan(io.StringIO(plan), offset=1))
+
+        assert [(line_no, u) for line_no, u, _ in applied] == [(3, user_b)]
+        assert list(SentArtPiece.objects.values_list("user", flat=True)) == [user_b.id]
+        assert len(mail.outbox) == 1
+
+    def test_skips_users_who_got_weekly_art_after_planning(
+            self, user_a, user_b, user_c, art_by_a, art_by_b):
+        plan = self._plan(seed=1)
+        persist_weekly_share(user=user_b, art=art_by_a)  # e.g. a ledgered run
+        user_c.last_art_sent_at = timezone.now()  # e.g. the scheduler
+        user_c.save()
+
+        applied = list(apply_plan(io.StringIO(plan)))
+
+        assert [u for _, u, _ in applied] == [user_a]
+        assert SentArtPiece.objects.filter(user=user_b).count() == 1
+        assert not SentArtPiece.objects.filter(user=user_c).exists()
+
+    def test_rejects_files_that_are_not_plans(self):
+        with pytest.raises(ValueError):
+            list(apply_plan(io.StringIO('{"user_id": 1}\n')))
+
+
+class FlakyBackend(LocmemBackend):
+    """Fails the first send it sees, like a dropped SMTP session."""
+    failed = False
+
+    def send_messages(self, messages):
+        if not FlakyBackend.failed:
+            FlakyBackend.failed = True
+            raise ConnectionResetError("connection dropped")
+        return super().send_messages(messages)
+
+
+class TestPooledConnection:
+    def _msg(self, i):
+        return mail.EmailMessage(f"s{i}", "body", "from@example.com", ["to@example.com"])
+
+    def test_reuses_then_recycles_and_recovers(self):
+        with PooledConnection(max_messages=2, backend=f"{__name__}.FlakyBackend") as conn:
+            for i in range(5):
+                assert conn.send_messages([self._msg(i)]) == 1
+
+        stats = conn.stats()
+        assert len(mail.outbox) == 5
+        assert stats["messages"] == 5 and stats["failures"] == 1
+        # first open, one reconnect after the failure, two recycles at max_messages
+        assert stats["connections"] == 4 and stats["reconnects"] == 3
+
+    @pytest.mark.django_db
+    def test_weekly_command_sends_over_one_connection(self, user_a, user_b, user_c, art_by_a, art_by_b):
+        out = io.StringIO()
+        call_command("share_weekly_art", "--all", "--bulk", stdout=out)
+
+        assert len(mail.outbox) == 3
+        assert "Mail: 3 message(s) over 1 connection(s)" in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestBenchWeekly:
+    def test_reports_both_modes_and_rolls_back(self, tmp_path, user_a):
+        out = tmp_path / "bench.json"
+        call_command("bench_weekly", "--users", "30", "--pieces", "20", "--history", "3",
+                     "--path", "bulk", "--json", str(out), stdout=io.StringIO())
+
+        report = json.loads(out.read_text())
+        dry, full = report["results"]
+        assert dry["rows_written"]["SentArtPiece"] == 0 and dry["emails"] == 0
+        assert full["rows_written"]["SentArtPiece"] == full["emails"] > 0
+        assert full["queries_per_user"] > 0
+        assert User.objects.count() == 1
+
+
+@pytest.mark.django_db
+class TestShareWithUsers:
+    def test_skips_owner_and_existing_and_batches_email(self, user_a, user_b, user_c, art_by_a):
+        SentArtPiece.objects.create(user=user_b, art_piece=art_by_a, source="welcome")
+
+        counts = share_piece_with_users(art_by_a, User.objects.all())
+
+        assert counts == {"sent": 1, "skipped": 1}
+        assert SentArtPiece.objects.get(user=user_c, art_piece=art_by_a).source == "manual"
+        n = Notification.objects.get(recipient=user_c, notification_type="shared_art")
+        assert list(EmailOutbox.objects.values_list("notification_id", flat=True)) == [n.id]
+
+        send_shared_art_batch_task(notification_ids=[n.id])
+        assert [m.to for m in mail.outbox] == [[user_c.email]]
+
+        # Running it again is a no-op
+        assert share_piece_with_users(art_by_a, User.objects.all()) == {"sent": 0, "skipped": 2}
+
+    def test_admin_action_shares_and_queues(self, client, user_a, user_b, art_by_a):
+        admin = User.objects.create_superuser(
+            email="admin@example.com", username="admin", password="pass")
+        admin.receive_art_paused = True
+        admin.save()
+        client.force_login(admin)
+
+        data = {"action": "share_with_users", "_selected_action": [art_by_a.pk]}
+        page = client.post("/admin/main/artpiece/", data)
+        assert b"Share a piece with users" in page.content
+
+        client.post("/admin/main/artpiece/", {**data, "apply": "1", "audience": "all"})
+
+        assert list(SentArtPiece.objects.values_list("user_id", flat=True)) == [user_b.id]
+        assert EmailOutbox.objects.filter(notification__recipient=user_b, state="pending").count() == 1
+
+
+@pytest.mark.django_db
+class TestBatchEmailTasks:
+    def _comment_notifications(self, art, owner, senders):
+        for sender in senders:
+            Comment.objects.create(sender=sender, recipient=owner, art_piece=art, text="hi")
+        return list(Notification.objects.filter(
+            notification_type="comment").order_by("id").values_list("id", flat=True))
+
+    def test_query_count_does_not_grow_with_batch(self, django_assert_num_queries,
+                                                  user_a, user_b, user_c, art_by_a):
+        ids = self._comment_notifications(art_by_a, user_a, [user_b, user_c])
+
+        # One load for the batch; per email only the delivery-log check and write
+        with django_assert_num_queries(1 + 2 * len(ids)):
+            send_comment_batch_task(notification_ids=ids)
+        assert len(mail.outbox) == 2
+
+    def test_retries_only_failed_notifications(self, monkeypatch, user_a, user_b, user_c, art_by_a):
+        ids = self._comment_notifications(art_by_a, user_a, [user_b, user_c])
+        real_send = tasks.send_notification_email
+
+        def flaky(n, **kwargs):
+            if n.id == ids[0]:
+                raise ConnectionResetError("dropped")
+            return real_send(n, **kwargs)
+
+        retried = {}
+
+        def retry(*, kwargs):
+            retried.update(kwargs)
+            return RuntimeError("retry")
+
+        monkeypatch.setattr(tasks, "send_notification_email", flaky)
+        monkeypatch.setattr(send_comment_batch_task, "retry", retry)
+
+        with pytest.raises(RuntimeError):
+            send_comment_batch_task(notification_ids=ids)
+        assert retried == {"notification_ids": [ids[0]]}
+        assert len(mail.outbox) == 1
+
+    def test_throttle_requeues_only_the_unsent_rest(self, monkeypatch, user_a, user_b, user_c,
+                                                     art_by_a, art_by_b):
+        Comment.objects.create(sender=user_a, recipient=user_b, art_piece=art_by_b, text="hi")
+        ids = self._comment_notifications(art_by_a, user_a, [user_b, user_c])
+        calls = []
+
+        def send(n, **kwargs):
+            calls.append(n.id)
+            if len(calls) == 1:
+                raise ConnectionResetError("dropped")
+            raise RateLimited(5)
+
+        requeued, retried = [], {}
+
+        def retry(*, kwargs):
+            retried.update(kwargs)
+            return RuntimeError("retry")
+
+        monkeypatch.setattr(tasks, "send_notification_email", send)
+        monkeypatch.setattr(send_comment_batch_task, "apply_async", lambda **kw: requeued.append(kw))
+        monkeypatch.setattr(send_comment_batch_task, "retry", retry)
+
+        with pytest.raises(RuntimeError):
+            send_comment_batch_task(notification_ids=ids)
+        # The real failure takes a counted retry; the rest keeps its count
+        assert retried == {"notification_ids": [ids[0]]}
+        assert requeued == [{"kwargs": {"notification_ids": ids[1:]}, "countdown": 5, "retries": 0}]
+
+    def test_weekly_bulk_queues_batched_tasks(self, monkeypatch, django_capture_on_commit_callbacks,
+                                              user_a, user_b, user_c, art_by_a, art_by_b):
+        batches = []
+        monkeypatch.setattr(send_shared_art_batch_task, "delay",
+                            lambda **kw: batches.append(kw["notification_ids"]))
+
+        with django_capture_on_commit_callbacks(execute=True):
+            call_command("share_weekly_art", "--all", "--bulk", "--queue-email", stdout=io.StringIO())
+
+        assert mail.outbox == []
+        assert len(batches) == 1 and sorted(batches[0]) == sorted(
+            Notification.objects.values_list("id", flat=True))
+
+
+@pytest.mark.django_db
+class TestDeliveryLog:
+    def test_retried_batch_does_not_send_twice(self, user_a, user_b, user_c, art_by_a):
+        for sender in (user_b, user_c):
+            Comment.objects.create(sender=sender, recipient=user_a, art_piece=art_by_a, text="hi")
+        ids = sorted(Notification.objects.values_list("id", flat=True))
+        send_comment_batch_task(notification_ids=ids)
+        # e.g. the worker died after SES accepted the messages, before the ack
+        send_comment_batch_task(notification_ids=ids)
+
+        assert len(mail.outbox) == 2
+        assert sorted(NotificationDelivery.objects.values_list("notification_id", flat=True)) == ids
+
+    def test_resumed_weekly_run_skips_delivered_emails(self, user_a, user_b, art_by_a):
+        n = Notification.objects.create(
+            recipient=user_b, sender=user_a, art_piece=art_by_a, notification_type="shared_art")
+        kwargs = {"recipient": user_b, "sender": user_a, "art_piece": art_by_a, "notification_id": n.id}
+
+        assert send_shared_art_email(**kwargs) and send_shared_art_email(**kwargs)
+        assert SharedArtFanOut(sender=user_a, art_piece=art_by_a).send(
+            user_b, notification_id=n.id)
+        assert len(mail.outbox) == 1
+
+    def test_digest_drops_notifications_already_emailed(self, user_a, user_b, art_by_a):
+        user_a.email_digest = "daily"
+        user_a.save(update_fields=["email_digest"])
+        Comment.objects.create(sender=user_b, recipient=user_a, art_piece=art_by_a, text="hi")
+        NotificationDelivery.objects.create(
+            notification=Notification.objects.get(notification_type="comment"), channel="email")
+
+        assert send_digests("daily")["digests"] == 0
+        assert mail.outbox == []
+
+
+@pytest.mark.django_db
+class TestRenderOnce:
+    def test_fan_out_matches_full_render(self, user_a, user_b, art_by_a):
+        user_b.first_name = "O'Brien <&>"
+        n = Notification.objects.create(
+            recipient=user_b, sender=user_a, art_piece=art_by_a, notification_type="shared_art")
+        send_shared_art_email(recipient=user_b, sender=user_a, art_piece=art_by_a, notification_id=n.id)
+        NotificationDelivery.objects.all().delete()
+        fan_out = SharedArtFanOut(sender=user_a, art_piece=art_by_a)
+        assert fan_out.send(user_b, notification_id=n.id)
+
+        full, once = mail.outbox
+        token = re.compile(r"/u/[^/]+/")
+        assert once.subject == full.subject and once.to == full.to
+        assert "O&#x27;Brien &lt;&amp;&gt;" in once.body
+        assert token.sub("", once.body) == token.sub("", full.body)
+        assert token.sub("", once.alternatives[0][0]) == token.sub("", full.alternatives[0][0])
+
+    def test_benchmark_reports_both_paths(self):
+        out = io.StringIO()
+        call_command("bench_email_render", "--recipients", "50", stdout=out)
+        assert "per_message" in out.getvalue() and "Speedup" in out.getvalue()
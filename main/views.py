@@ -4,12 +4,10 @@ from django.db.models import Q, Count
 from django.http import Http404
 from django.http import JsonResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
-from .forms import RegisterForm, ArtPieceForm, CommentForm, AccountInfoForm, ArtDeliveryForm, EmailPreferencesForm, CustomPasswordChangeForm, CustomSetPasswordForm
+from .forms import RegisterForm, ArtPieceForm, CommentForm, AccountInfoForm, ArtDeliveryForm, EmailPreferencesForm, CustomPasswordChangeForm, CustomSetPasswordForm, CustomPasswordResetForm
 from django.contrib import messages
 from django.contrib.auth import login, logout, update_session_auth_hash, authenticate, views as auth_views
 from django.contrib.auth.decorators import login_required
-from django.utils.html import strip_tags
-from django.core.mail import send_mail
 from django.urls import reverse, reverse_lazy
 from django.db import IntegrityError, transaction
 import random
@@ -22,8 +20,12 @@ from django.utils import timezone
 from datetime import timedelta
 from django.views.decorators.http import require_POST
 from django.views.decorators.cache import never_cache
-from .models import ArtPiece, SentArtPiece, CustomUser, Comment, Like, Notification, ReciprocalGrant, WelcomeGrant, Feedback
+from .models import ArtPiece, SentArtPiece, CustomUser, Comment, Like, Notification, ReciprocalGrant, WelcomeGrant, Feedback, EmailOutbox
 from main.utils.email_unsub import load_unsub_token
+from main.services.art_queue import pop_queued_piece
+from main.services.outbox import queue_message
+from main.services.recommend import recommended_piece
+from main.services.selection import sample_art_piece, sample_welcome_piece
 import json
 from django.utils.http import url_has_allowed_host_and_scheme
 from zoneinfo import ZoneInfo
@@ -95,26 +97,8 @@ def welcome_page(request):
 
 
 def choose_welcome_piece_weighted(user):
-    qs = ArtPiece.active.filter(
-        welcome_eligible=True,
-    ).exclude(
-        user=user
-    ).exclude(
-        id__in=SentArtPiece.objects.filter(
-            user=user).values_list('art_piece_id', flat=True)
-    ).values('id', 'welcome_weight')
-
-    items = list(qs)
-    if not items:
-        return None
-
-    # Build a weighted bag (small pools of 5–10 keep this trivial)
-    weighted = []
-    for it in items:
-        weighted.extend([it['id']] * max(1, it['welcome_weight']))
-
-    chosen_id = random.choice(weighted)
-    return ArtPiece.objects.select_related('user').get(pk=chosen_id)
+    # Weighted pick from the curated pool the user doesn't have yet
+    return sample_welcome_piece(user)
 
 
 def ensure_welcome_gift(user):
@@ -130,7 +114,8 @@ def ensure_welcome_gift(user):
         if grant.sent_art_piece:
             return grant.sent_art_piece
 
-        piece = choose_welcome_piece_weighted(user)  # <-- curated pool
+        # pre-drawn if the refill task got there first, else the curated pool
+        piece = pop_queued_piece(user, kind="welcome") or choose_welcome_piece_weighted(user)
         if not piece:
             return None
 
@@ -179,7 +164,7 @@ def share_art(request):
             )
 
             if created:
-                reciprocal = choose_art_piece(user)
+                reciprocal = pop_queued_piece(user) or choose_art_piece(user)
                 if reciprocal:
                     grant.sent_art_piece = reciprocal
                     grant.save(update_fields=["sent_art_piece"])
@@ -942,21 +927,9 @@ def LogOut(request):
 
 
 def choose_art_piece(user):
-    # Get all approved art pieces that the user did not submit and have not been sent to them
-    art_pieces = ArtPiece.active.filter(
-        approved_status=True
-    ).exclude(
-        user=user
-    ).exclude(
-        id__in=SentArtPiece.objects.filter(
-            user=user).values_list('art_piece_id', flat=True)
-    )
-
-    # Select a random art piece from the filtered queryset
-    if art_pieces.exists():
-        return random.choice(art_pieces)
-    else:
-        return None
+    # Usually one of the user's precomputed recommendations; otherwise a random
+    # approved art piece the user did not submit and has not been sent
+    return recommended_piece(user) or sample_art_piece(user)
 
 
 def mark_art_piece_as_sent(user, art_piece, *, source="weekly"):
@@ -1003,6 +976,7 @@ def csrf_failure(request, reason=""):
 
 class CustomPasswordResetView(auth_views.PasswordResetView):
     email_template_name = 'registration/password_reset_email.html'
+    form_class = CustomPasswordResetForm
 
     def get_form(self, form_class=None):
         form = super().get_form(form_class)
@@ -1014,19 +988,6 @@ class CustomPasswordResetView(auth_views.PasswordResetView):
         })
         return form
 
-    def send_mail(self, subject_template_name, email_template_name,
-                  context, from_email, to_email, html_email_template_name=None):
-        """
-        Send a django.core.mail.EmailMultiAlternatives to `to_email`.
-        """
-        subject = render_to_string(subject_template_name, context)
-        # Email subject *must not* contain newlines
-        subject = ''.join(subject.splitlines())
-        body = render_to_string(email_template_name, context)
-        plain_body = strip_tags(body)
-        send_mail(subject, plain_body, from_email,
-                  [to_email], html_message=body)
-
     # Override the method to use custom email subject and content
     def form_valid(self, form):
         opts = {
@@ -1039,6 +1000,12 @@ class CustomPasswordResetView(auth_views.PasswordResetView):
             'html_email_template_name': self.email_template_name,
         }
         form.save(**opts)
+        if form.queued:
+            # main.tasks imports this module (via services.sharing)
+            from .tasks import dispatch_email_outbox_now
+            # The email is queued, not sent; don't leave it for the next beat tick
+            transaction.on_commit(
+                lambda: dispatch_email_outbox_now(priority=EmailOutbox.PRIORITY_HIGH))
         return super(auth_views.PasswordResetView, self).form_valid(form)
 
 
@@ -1289,18 +1256,15 @@ def feedback_report(request):
         "page": page[:128],
     })
 
-    # Email you a copy
-    try:
-        send_mail(
-            subject="Omnivore: Problem report",
-            message=f"From: {request.user.email if request.user.is_authenticated else 'Anonymous'}\n"
-                    f"Page: {page}\nUA: {ua}\n\n{msg}",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=["support@omnivorearts.com"],
-            fail_silently=True,
-        )
-    except Exception:
-        pass
+    # Email you a copy, through the outbox so the request never waits on SES
+    queue_message(
+        kind="feedback",
+        to=["support@omnivorearts.com"],
+        subject="Omnivore: Problem report",
+        body=f"From: {request.user.email if request.user.is_authenticated else 'Anonymous'}\n"
+             f"Page: {page}\nUA: {ua}\n\n{msg}",
+        priority=EmailOutbox.PRIORITY_LOW,
+    )
 
     return JsonResponse({"ok": True, "message": "Thanks — we got your report!"})
 
@@ -3,6 +3,7 @@ import os
 from os import getenv
 from dotenv import load_dotenv
 import warnings
+from celery.schedules import crontab
 from django.urls import reverse_lazy
 
 # Figure out which environment we're in
@@ -40,13 +41,52 @@ DATABASES = {
     }
 }
 
-# Amazon SES configuration
-EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND')
+# Amazon SES configuration. Every send goes through the send-rate limiter
+# (main.mail.RateLimitedBackend), which hands it to the configured backend
+EMAIL_BACKEND = 'main.mail.RateLimitedBackend'
+EMAIL_RATE_LIMITED_BACKEND = os.environ.get('EMAIL_BACKEND')
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 AWS_SES_REGION_NAME = os.environ.get('AWS_SES_REGION_NAME')
 AWS_SES_REGION_ENDPOINT = os.environ.get('AWS_SES_REGION_ENDPOINT')
 DEFAULT_FROM_EMAIL = "Omnivore Arts <oliver@omnivorearts.com>"
+# Bulk sends reuse one connection for this many messages before reconnecting
+EMAIL_CONNECTION_MAX_MESSAGES = 100
+# SES max send rate (recipients/second) and burst, shared by every process
+# through Redis; without EMAIL_RATE_LIMIT_REDIS_URL each process gets the
+# whole rate. A send waits at most MAX_WAIT seconds for the quota, then its
+# email is retried later
+EMAIL_SEND_RATE = float(os.environ.get('EMAIL_SEND_RATE', 14))
+EMAIL_SEND_BURST = None
+EMAIL_RATE_LIMIT_MAX_WAIT = 30
+EMAIL_RATE_LIMIT_REDIS_URL = os.getenv('EMAIL_RATE_LIMIT_REDIS_URL', os.getenv('CELERY_BROKER_URL'))
+# Admin "share with users" writes this many recipients per transaction
+MANUAL_SHARE_CHUNK_SIZE = 1000
+# Email outbox: rows claimed per batch, how long a claim is held, sends tried
+# per row, and how long one dispatch tick keeps claiming new batches
+EMAIL_OUTBOX_BATCH_SIZE = 100
+EMAIL_OUTBOX_LEASE_SECONDS = 300
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_BUDGET_SECONDS = 60
+EMAIL_OUTBOX_TIME_LIMIT = 120
+EMAIL_OUTBOX_SOFT_TIME_LIMIT = 110
+# A burst of messages in one comment thread sends one email (the latest
+# message) once the thread is quiet this long, at most MAX after the first;
+# 0 sends every comment email right away
+COMMENT_EMAIL_DEBOUNCE_SECONDS = 120
+COMMENT_EMAIL_DEBOUNCE_MAX_SECONDS = 600
+# Notifications per batched email task (send_*_batch_task)
+EMAIL_TASK_BATCH_SIZE = 200
+EMAIL_TASK_BATCH_TIME_LIMIT = 120
+EMAIL_TASK_BATCH_SOFT_TIME_LIMIT = 110
+# Like/comment digests (CustomUser.email_digest): users per claim, items
+# listed per email
+EMAIL_DIGEST_BATCH_USERS = 200
+EMAIL_DIGEST_MAX_ITEMS = 20
+EMAIL_DIGEST_TIME_LIMIT = 1800
+EMAIL_DIGEST_SOFT_TIME_LIMIT = 1770
+# Daily digests go out at this hour (UTC)
+EMAIL_DIGEST_DAILY_HOUR = 8
 
 
 # Celery configuration
@@ -54,16 +94,109 @@ CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv(
     "CELERY_RESULT_BACKEND", "redis://localhost:6379/1")
 
+# Shared cache (e.g. the welcome-pool alias table) when CACHE_URL is set;
+# otherwise Django's per-process local-memory cache.
+if os.getenv("CACHE_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("CACHE_URL"),
+        }
+    }
+
 # Good defaults
 CELERY_TASK_ACKS_LATE = True
+# Honour task priorities (0 = first) on the Redis broker, e.g. a dispatch
+# kicked off by a password reset goes ahead of queued bulk email tasks
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "queue_order_strategy": "priority",
+    "priority_steps": list(range(10)),
+    "sep": ":",
+}
 CELERY_TASK_TIME_LIMIT = 30
 CELERY_TASK_SOFT_TIME_LIMIT = 25
 CELERY_TASK_ROUTES = {
     "main.tasks.send_like_email_task": {"queue": "emails"},
     "main.tasks.send_comment_email_task": {"queue": "emails"},
     "main.tasks.send_shared_art_email_task": {"queue": "emails"},
+    "main.tasks.send_like_batch_task": {"queue": "emails"},
+    "main.tasks.send_comment_batch_task": {"queue": "emails"},
+    "main.tasks.send_shared_art_batch_task": {"queue": "emails"},
+    "main.tasks.dispatch_email_outbox_task": {"queue": "emails"},
+    "main.tasks.send_email_digests_task": {"queue": "emails"},
+    "main.tasks.share_weekly_shard_task": {"queue": "weekly"},
 }
 
+# Weekly fan-out (share_weekly_art --fan-out): users per shard task. How many
+# shards run at once is the "weekly" worker's --concurrency (see Procfile,
+# WEEKLY_SHARD_CONCURRENCY)
+WEEKLY_SHARD_SIZE = int(os.getenv("WEEKLY_SHARD_SIZE", "200"))
+# A shard sends its emails synchronously, so it outlives the 30s default
+WEEKLY_SHARD_TIME_LIMIT = 600
+WEEKLY_SHARD_SOFT_TIME_LIMIT = 570
+
+# Continuous delivery scheduler: users get art every ART_DELIVERY_CADENCE_DAYS
+# at ART_DELIVERY_LOCAL_HOUR in their own timezone. Each beat tick handles
+# at most ART_DELIVERY_TICK_BATCH due users. Off unless enabled: the
+# share_weekly_art command doesn't move users' schedules, so running both
+# would send weekly art twice. Stop the weekly cron before turning it on.
+ART_DELIVERY_SCHEDULER_ENABLED = os.getenv("ART_DELIVERY_SCHEDULER_ENABLED", "False").lower() == "true"
+ART_DELIVERY_CADENCE_DAYS = 7
+ART_DELIVERY_LOCAL_HOUR = 9
+ART_DELIVERY_TICK_BATCH = 200
+# Pre-drawn gift queue: pieces kept ready per user for reciprocal/welcome gifts
+ART_QUEUE_DEPTH = 3
+ART_QUEUE_REFILL_BATCH = 200
+
+# Recommendations (main/services/recommend.py): share of picks drawn from a
+# user's candidate list when they have one; the rest follow
+# ART_SELECTION_MODE. 0 (the default) keeps selection as it was; opt in
+# with e.g. ART_RECOMMENDATION_RATE=0.8 once the candidate lists are built.
+ART_RECOMMENDATION_RATE = float(os.getenv("ART_RECOMMENDATION_RATE", "0"))
+ART_RECOMMENDATIONS_INCLUDE_COMMENTS = False
+ART_RECOMMENDATION_TIME_LIMIT = 1800
+ART_RECOMMENDATION_SOFT_TIME_LIMIT = 1770
+
+# "uniform" picks uniformly over eligible pieces; "diverse" picks a sharer
+# first, skipping the sharers of the user's last ART_DIVERSITY_RECENT pieces.
+ART_SELECTION_MODE = "uniform"
+ART_DIVERSITY_RECENT = 3
+
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-email-outbox": {
+        "task": "main.tasks.dispatch_email_outbox_task",
+        "schedule": 10.0,  # every 10 seconds
+    },
+    "send-hourly-email-digests": {
+        "task": "main.tasks.send_email_digests_task",
+        "schedule": 3600.0,  # hourly
+        "kwargs": {"frequency": "hourly"},
+    },
+    "send-daily-email-digests": {
+        "task": "main.tasks.send_email_digests_task",
+        "schedule": crontab(hour=EMAIL_DIGEST_DAILY_HOUR, minute=0),
+        "kwargs": {"frequency": "daily"},
+    },
+    "refill-art-queues": {
+        "task": "main.tasks.refill_art_queues_task",
+        "schedule": 600.0,  # every 10 minutes
+    },
+    "refresh-art-recommendations": {
+        "task": "main.tasks.refresh_recommendations_task",
+        "schedule": 3600.0,  # hourly, users whose likes changed
+    },
+    "rebuild-art-recommendations": {
+        "task": "main.tasks.rebuild_recommendations_task",
+        "schedule": 86400.0,  # daily, full neighbor rebuild
+    },
+}
+
+if ART_DELIVERY_SCHEDULER_ENABLED:
+    CELERY_BEAT_SCHEDULE["deliver-due-art"] = {
+        "task": "main.tasks.deliver_due_art_task",
+        "schedule": 300.0,  # every 5 minutes
+    }
+
 # During first local test you can force inline execution:
 # CELERY_TASK_ALWAYS_EAGER = True
 